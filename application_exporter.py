@@ -0,0 +1,214 @@
+#!/usr/bin/python
+
+import bisect
+import threading
+import time
+from functools import partial
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+
+from concurrent_collector import collect_once
+from http_client import HTTP, HttpError
+from json_stream import iter_array_items
+from metric_descriptors import DescriptorTable, LabelCache, add_sample
+from ha_state import ha_state, is_passive, resourcemanager_state
+
+
+class YarnApplicationCollector(object):
+    name = 'application'
+
+    # Summed over the running applications of a queue and user
+    statuses = {
+        "allocatedMB": "Memory allocated to the running applications in MB",
+        "allocatedVCores": "Virtual cores allocated to the running applications",
+        "runningContainers": "Containers of the running applications",
+    }
+
+    # Upper bounds of the yarn_application_duration_seconds buckets
+    duration_buckets = (60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400, float('inf'))
+
+    def __init__(self, target, cluster, retention=86400, overlap=60):
+        # Only accepted and running apps plus the apps finished since the
+        # last poll are asked for, /ws/v1/cluster/apps without filters lists
+        # every app the resourcemanager remembers. Finished apps are counted
+        # per queue and user; a queue and user without finished apps for
+        # retention seconds is forgotten.
+        self._cluster = cluster
+        self._targets = target.rstrip("/").split(";")
+        self._prefix = 'yarn_application_'
+        self._retention = retention
+        self._overlap = int(overlap * 1000)
+        self._descriptors = DescriptorTable(self._prefix, self.statuses, ["cluster", "queue", "user"])
+        self._labels = LabelCache(["cluster", "queue", "user"])
+        self._statuses = tuple(self.statuses)
+        self._lock = threading.Lock()
+        # Apps are counted from the start of the exporter on. Every poll asks
+        # for the apps finished since the cursor less overlap, in case an app
+        # shows up late, and skips the ones in _counted.
+        self._cursor = int(time.time() * 1000)
+        # id -> finishedTime of the apps counted within the overlap
+        self._counted = {}
+        # (queue, user) -> FinishedApps
+        self._finished = {}
+
+    def fetch_jobs(self):
+        # One job per resourcemanager, only the active one answers
+        begin = self._cursor - self._overlap
+        return [(url, partial(self._request_data, url, begin)) for url in self._targets]
+
+    def build_metrics(self, results):
+        metrics = self._descriptors.families()
+        self._labels.rotate()
+        apps = GaugeMetricFamily(self._prefix + 'apps', 'Applications accepted or running',
+                                 labels=["cluster", "queue", "user", "state"])
+        # (queue, user, state) -> apps, (queue, user) -> the running apps
+        # summed up in the order of _statuses
+        counts = {}
+        sums = {}
+        # builds of overlapping live scrapes must not count an app twice
+        with self._lock:
+            for url in self._targets:
+                if results.get(url) is None:
+                    continue
+                running, finished = results[url]
+                if running is not None:
+                    try:
+                        for app in running:
+                            self._add_running(app, counts, sums)
+                    except (HttpError, ValueError):
+                        # a list cut short keeps the apps read so far
+                        pass
+                if finished is not None:
+                    self._add_finished(finished)
+            self._expire(time.time())
+            finished = sorted(self._finished.items())
+
+        for (queue, user, state), count in sorted(counts.items()):
+            apps.add_metric([self._cluster, queue, user, state], count)
+        for (queue, user), values in sorted(sums.items()):
+            labels = self._labels.get(self._cluster, queue, user)
+            for status, value in zip(self._statuses, values):
+                add_sample(metrics[status], labels, value)
+
+        completed = CounterMetricFamily(self._prefix + 'completed',
+                                        'Applications finished since the exporter started, by final status',
+                                        labels=["cluster", "queue", "user", "final_status"])
+        duration = HistogramMetricFamily(self._prefix + 'duration_seconds',
+                                         'Time from start to finish of the finished applications',
+                                         labels=["cluster", "queue", "user"])
+        memory = CounterMetricFamily(self._prefix + 'memory_seconds',
+                                     'MB-seconds of memory used by the finished applications',
+                                     labels=["cluster", "queue", "user"])
+        vcores = CounterMetricFamily(self._prefix + 'vcore_seconds',
+                                     'Vcore-seconds used by the finished applications',
+                                     labels=["cluster", "queue", "user"])
+        for (queue, user), apps_of in finished:
+            for final_status, count in sorted(apps_of.final_statuses.items()):
+                completed.add_metric([self._cluster, queue, user, final_status], count)
+            buckets = []
+            cumulative = 0
+            for bound, count in zip(self.duration_buckets, apps_of.buckets):
+                cumulative += count
+                buckets.append(('+Inf' if bound == float('inf') else str(bound), cumulative))
+            duration.add_metric([self._cluster, queue, user], buckets, apps_of.duration)
+            memory.add_metric([self._cluster, queue, user], apps_of.memory_seconds)
+            vcores.add_metric([self._cluster, queue, user], apps_of.vcore_seconds)
+
+        yield apps
+        for status in self._statuses:
+            yield metrics[status]
+        yield completed
+        yield duration
+        yield memory
+        yield vcores
+
+    def collect(self):
+        return collect_once(self)
+
+    def _request_data(self, target, begin):
+        # The apps of a standby resourcemanager are stale, only the active one is asked
+        if is_passive(ha_state(self._targets, target, resourcemanager_state)):
+            return None
+        url = '{0}/ws/v1/cluster/apps'.format(target)
+
+        # Finished apps are few per poll and read right away, the running
+        # ones are decoded one app at a time by build_metrics.
+        finished = None
+        chunks = HTTP.get_stream(url, {"states": "FINISHED,FAILED,KILLED", "finishedTimeBegin": begin,
+                                       "deSelects": "resourceRequests"})
+        if chunks is not None:
+            try:
+                finished = [finished_app(app) for app in iter_array_items(chunks, ('apps', 'app'))]
+            except (HttpError, ValueError):
+                finished = None
+
+        running = HTTP.get_stream(url, {"states": "ACCEPTED,RUNNING", "deSelects": "resourceRequests"})
+        if running is not None:
+            running = iter_array_items(running, ('apps', 'app'))
+        return running, finished
+
+    def _add_running(self, app, counts, sums):
+        queue, user = app['queue'], app['user']
+        key = (queue, user, app['state'])
+        counts[key] = counts.get(key, 0) + 1
+        values = sums.get((queue, user))
+        if values is None:
+            values = sums[(queue, user)] = [0] * len(self._statuses)
+        for i, status in enumerate(self._statuses):
+            # accepted apps report -1
+            value = app.get(status, 0)
+            if value > 0:
+                values[i] += value
+
+    def _add_finished(self, finished):
+        floor = self._cursor - self._overlap
+        cursor = self._cursor
+        for app in finished:
+            app_id, queue, user, final_status, finished_time, elapsed, memory_seconds, vcore_seconds = app
+            if finished_time < floor or app_id in self._counted:
+                continue
+            self._counted[app_id] = finished_time
+            cursor = max(cursor, finished_time)
+
+            apps_of = self._finished.get((queue, user))
+            if apps_of is None:
+                apps_of = self._finished[(queue, user)] = FinishedApps(len(self.duration_buckets))
+            apps_of.add(final_status, elapsed / 1000.0, memory_seconds, vcore_seconds,
+                        bisect.bisect_left(self.duration_buckets, elapsed / 1000.0))
+
+        self._cursor = cursor
+        floor = cursor - self._overlap
+        self._counted = dict((app_id, finished_time) for app_id, finished_time in self._counted.items()
+                             if finished_time >= floor)
+
+    def _expire(self, now):
+        for key, apps_of in self._finished.items():
+            if apps_of.seen < now - self._retention:
+                del self._finished[key]
+
+
+class FinishedApps(object):
+    # What the finished apps of a queue and user added up to
+    __slots__ = ('final_statuses', 'buckets', 'duration', 'memory_seconds', 'vcore_seconds', 'seen')
+
+    def __init__(self, buckets):
+        self.final_statuses = {}
+        self.buckets = [0] * buckets
+        self.duration = 0.0
+        self.memory_seconds = 0
+        self.vcore_seconds = 0
+        self.seen = time.time()
+
+    def add(self, final_status, duration, memory_seconds, vcore_seconds, bucket):
+        self.final_statuses[final_status] = self.final_statuses.get(final_status, 0) + 1
+        self.buckets[bucket] += 1
+        self.duration += duration
+        self.memory_seconds += memory_seconds
+        self.vcore_seconds += vcore_seconds
+        self.seen = time.time()
+
+
+def finished_app(app):
+    # The fields of a finished app that are counted, the rest is dropped right away
+    return (app['id'], app['queue'], app['user'], app['finalStatus'], app['finishedTime'],
+            app['elapsedTime'], app.get('memorySeconds', 0), app.get('vcoreSeconds', 0))
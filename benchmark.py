@@ -0,0 +1,419 @@
+#!/usr/bin/python
+
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib
+import urllib2
+from multiprocessing.pool import ThreadPool
+
+import namenode_exporter
+from concurrent_collector import run_jobs
+from fsimage_exporter import FILES, SIZE
+from hadoop_standin import StandIn, fsimage_lines, namenode_beans, resourcemanager_nodes
+from json_decoder import DECODER, available_backends, backend_loads
+from json_stream import iter_array_items
+from namenode_exporter import NameNodeCollector
+from queue_exporter import YarnQueueCollector
+from application_exporter import YarnApplicationCollector
+from resourcemanager_exporter import ResourceManagerCollector, ResourceManagerNodeCollector
+
+# How each collector is pointed at a stand-in
+COLLECTORS = (
+    ('namenode', lambda url: NameNodeCollector(url + '/jmx', 'bench')),
+    ('resourcemanager', lambda url: ResourceManagerCollector(url, 'bench')),
+    ('resourcemanager_node', lambda url: ResourceManagerNodeCollector(url, 'bench')),
+    ('queue', lambda url: YarnQueueCollector(url, 'bench')),
+    ('application', lambda url: YarnApplicationCollector(url, 'bench')),
+)
+
+
+def bench_jmx(args):
+    server = StandIn(args.datanodes, filler_beans=args.filler_beans, keep_bodies=True).start()
+    url = server.url + '/jmx'
+    pool = ThreadPool(len(NameNodeCollector(url, 'bench').beans))
+
+    print "%-10s %12s %12s %12s" % ("mode", "bytes", "decode_ms", "collect_ms")
+    for mode in ("full", "qry"):
+        collector = NameNodeCollector(url, 'bench')
+        if mode == "full":
+            collector._full_dump_targets[url] = float('inf')
+
+        collect_time = 0
+        for i in range(args.rounds):
+            start = time.time()
+            for metric in collector.build_metrics(run_jobs(collector.fetch_jobs(), pool)):
+                pass
+            collect_time += time.time() - start
+
+        bodies = server.take_bodies()
+        decode_time = 0
+        for body in bodies:
+            start = time.time()
+            json.loads(body)
+            decode_time += time.time() - start
+
+        print "%-10s %12d %12.1f %12.1f" % (
+            mode, sum(len(body) for body in bodies) / args.rounds,
+            decode_time * 1000 / args.rounds, collect_time * 1000 / args.rounds)
+
+
+def bench_build(args):
+    # Turning already decoded responses into metric families, no http involved.
+    namenode = NameNodeCollector('http://nn.example.com:50070/jmx', 'bench')
+    beans = json.loads(json.dumps(namenode_beans(args.nodes, 0)))
+    namenode_results = {}
+    for key, job in namenode.fetch_jobs():
+        namenode_results[key] = [bean for bean in beans if bean['name'] == key[1]]
+
+    nodes = ResourceManagerNodeCollector('http://rm.example.com:8088', 'bench')
+    nodes_results = {}
+    for key, job in nodes.fetch_jobs():
+        nodes_results[key] = resourcemanager_nodes(args.nodes)
+
+    print "%-22s %10s %10s %12s" % ("collector", "cpu_ms", "samples", "label_dicts")
+    for name, collector, results in (("namenode", namenode, namenode_results),
+                                     ("resourcemanager_node", nodes, nodes_results)):
+        cpu = 0
+        for i in range(args.rounds):
+            gc.collect()
+            start = time.clock()
+            metrics = list(collector.build_metrics(results))
+            cpu += time.clock() - start
+
+        # every sample holds a labels dict, shared dicts are allocated once
+        samples = [sample for metric in metrics for sample in metric.samples]
+        print "%-22s %10.1f %10d %12d" % (
+            name, cpu * 1000 / args.rounds, len(samples), len(set(id(sample[1]) for sample in samples)))
+
+
+def bench_memory(args):
+    if args.variant:
+        return _memory_variant(args.variant, args.payload)
+
+    tmpdir = tempfile.mkdtemp()
+    livenodes = os.path.join(tmpdir, 'livenodes.json')
+    with open(livenodes, 'w') as f:
+        f.write([bean for bean in namenode_beans(args.nodes, 0)
+                 if bean['name'].endswith('NameNodeInfo')][0]['LiveNodes'])
+    nodes = os.path.join(tmpdir, 'nodes.json')
+    with open(nodes, 'w') as f:
+        json.dump({"nodes": {"node": resourcemanager_nodes(args.nodes)}}, f)
+
+    print "%-22s %12s %14s" % ("variant", "payload_kb", "rss_growth_kb")
+    for variant, payload in (("livenodes-loads", livenodes), ("livenodes-stream", livenodes),
+                             ("nodes-loads", nodes), ("nodes-stream", nodes)):
+        # ru_maxrss only goes up, every variant gets a fresh process
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), 'memory',
+                                          '--variant', variant, '--payload', payload])
+        print "%-22s %12d %14s" % (variant, os.path.getsize(payload) / 1024, output.strip())
+    os.remove(livenodes)
+    os.remove(nodes)
+    os.rmdir(tmpdir)
+
+
+def _memory_variant(variant, payload):
+    # Prints how far the peak rss grows while the payload is turned into
+    # metric families. The LiveNodes string is already in memory when the
+    # namenode collector gets it, so it is read before the baseline.
+    if variant.startswith('livenodes'):
+        if variant == 'livenodes-loads':
+            namenode_exporter.iter_object_items = lambda text: json.loads(text).iteritems()
+        collector = NameNodeCollector('http://nn.example.com:50070/jmx', 'bench')
+        with open(payload) as f:
+            beans = [{"name": "Hadoop:service=NameNode,name=NameNodeInfo", "LiveNodes": f.read(), "DeadNodes": "{}"}]
+        results = {('http://nn.example.com:50070/jmx', bean): beans if bean.endswith('NameNodeInfo') else []
+                   for bean in collector.beans}
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        metrics = list(collector.build_metrics(results))
+    else:
+        collector = ResourceManagerNodeCollector('http://rm.example.com:8088', 'bench')
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        with open(payload) as f:
+            if variant == 'nodes-loads':
+                nodes = json.loads(f.read())['nodes']['node']
+            else:
+                nodes = iter_array_items(iter(lambda: f.read(64 * 1024), ''), ('nodes', 'node'))
+            metrics = list(collector.build_metrics({'http://rm.example.com:8088': nodes}))
+    print resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+
+
+def bench_json(args):
+    # Every json backend installed on the same bodies, the ones --record
+    # saved in --dir or generated ones, then the worker processes: wall time
+    # of a decode and the CPU it still costs the exporter process.
+    payloads = []
+    if args.dir:
+        for name in sorted(os.listdir(args.dir)):
+            if name.endswith('.json'):
+                with open(os.path.join(args.dir, name)) as f:
+                    payloads.append((urllib.unquote(name[:-len('.json')]), f.read()))
+    else:
+        info = [bean for bean in namenode_beans(args.nodes, 0) if bean['name'].endswith('NameNodeInfo')]
+        payloads.append(('/jmx?qry=NameNodeInfo', json.dumps({"beans": info})))
+        payloads.append(('LiveNodes', info[0]['LiveNodes']))
+        payloads.append(('/ws/v1/cluster/nodes', json.dumps({"nodes": {"node": resourcemanager_nodes(args.nodes)}})))
+
+    # what the collectors have the workers send back
+    extracts = (('/jmx', NameNodeCollector('http://nn.example.com:50070/jmx', 'bench')._extract),
+                ('/ws/v1/cluster/nodes', ResourceManagerNodeCollector('http://rm.example.com:8088', 'bench')._extract))
+    backends = available_backends()
+    DECODER.start_pool(args.processes, 0)
+
+    print "%-40s %10s" % ("payload", "kb") + "".join(" %12s" % (backend + "_ms") for backend in backends) + \
+        " %12s %12s" % ("pool_ms", "pool_cpu_ms")
+    for path, body in payloads:
+        row = "%-40s %10d" % (path[:40], len(body) / 1024)
+        for backend in backends:
+            loads = backend_loads(backend)
+            times = []
+            for i in range(args.rounds):
+                start = time.time()
+                loads(body)
+                times.append(time.time() - start)
+            row += " %12.1f" % (_median(times) * 1000)
+
+        extract = next((extract for prefix, extract in extracts if path.startswith(prefix)), None)
+        walls = []
+        cpus = []
+        for i in range(args.rounds):
+            wall, cpu = time.time(), time.clock()
+            DECODER.decode(body, extract)
+            walls.append(time.time() - wall)
+            cpus.append(time.clock() - cpu)
+        print row + " %12.1f %12.1f" % (_median(walls) * 1000, _median(cpus) * 1000)
+
+
+def bench_fsimage(args):
+    # The fsimage collector's child process on a generated oiv -p Delimited
+    # dump of --entries lines, for every --depth: wall time, peak rss of the
+    # child and whether the root adds up to the files written.
+    tmpdir = tempfile.mkdtemp()
+    dump = os.path.join(tmpdir, 'fsimage.tsv')
+    files = 0
+    size = 0
+    with open(dump, 'w') as f:
+        for line in fsimage_lines(args.entries):
+            f.write(line)
+            f.write('\n')
+            fields = line.split('\t')
+            if fields[9].startswith('-'):
+                files += 1
+                size += int(fields[6])
+
+    print "%-6s %10s %10s %10s %14s %12s %8s" % ("depth", "mb", "entries", "dirs", "entries_per_s", "peak_rss_mb",
+                                                 "adds_up")
+    for depth in [int(depth) for depth in args.depth.split(',')]:
+        # ru_maxrss of the children is that of the largest one so far, every
+        # depth is measured in a fresh process
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), 'fsimage', '--child',
+                                          '--depth', str(depth), '--entries', str(args.entries), dump])
+        result = json.loads(output)
+        root = result['root']
+        print "%-6d %10d %10d %10d %14d %12.1f %8s" % (
+            depth, os.path.getsize(dump) >> 20, result['entries'], result['dirs'],
+            result['entries'] / result['seconds'], result['peak_rss_kb'] / 1024.0,
+            root[FILES] == files and root[SIZE] == size)
+    os.remove(dump)
+    os.rmdir(tmpdir)
+
+
+def _fsimage_child(args):
+    start = time.time()
+    output = subprocess.check_output([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                   'fsimage_exporter.py'),
+                                      '--depth', str(args.depth), args.dump])
+    seconds = time.time() - start
+    usage = json.loads(output)
+    print json.dumps({"entries": usage['entries'], "dirs": len(usage['dirs']), "seconds": seconds,
+                      "peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+                      "root": usage['dirs']['/']})
+
+
+def bench_collectors(args):
+    # Every collector against a stand-in of each size, each in a fresh process
+    # so its peak memory is its own.
+    if args.child:
+        return _collectors_child(args)
+
+    names = args.collectors.split(',') if args.collectors else [name for name, make in COLLECTORS]
+    results = []
+    print "%-22s %7s %12s %10s %12s %8s" % ("collector", "nodes", "collect_ms", "cpu_ms", "peak_rss_kb", "series")
+    for nodes in [int(n) for n in args.nodes.split(',')]:
+        port = _free_port()
+        standin = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                 'hadoop_standin.py'),
+                                    '--port', str(port), '--nodes', str(nodes),
+                                    '--queue-depth', str(args.queue_depth), '--queue-width', str(args.queue_width),
+                                    '--scheduler', args.scheduler, '--apps', str(args.apps), '--latency', str(args.latency)], stdout=open(os.devnull, 'w'))
+        url = 'http://127.0.0.1:%d' % port
+        try:
+            _wait_for(url)
+            for name in names:
+                output = subprocess.check_output([sys.executable, os.path.abspath(__file__), 'collectors',
+                                                  '--child', name, '--url', url, '--rounds', str(args.rounds)])
+                result = json.loads(output)
+                result.update(collector=name, nodes=nodes)
+                results.append(result)
+                print "%-22s %7d %12.1f %10.1f %12d %8d" % (
+                    name, nodes, result['collect_ms'], result['cpu_ms'], result['peak_rss_kb'], result['series'])
+        finally:
+            standin.terminate()
+            standin.wait()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({"python": platform.python_version(), "time": int(time.time()), "rounds": args.rounds,
+                       "results": results}, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_results(baseline, results, args.tolerance)
+        for regression in regressions:
+            print "REGRESSION", regression
+        if regressions:
+            sys.exit(1)
+
+
+def compare_results(baseline, results, tolerance):
+    # Timings and memory may grow by tolerance, series must stay the same.
+    # Growth below the floor of a measure is noise.
+    floors = {'collect_ms': 5, 'cpu_ms': 5, 'peak_rss_kb': 1024}
+    previous = dict(((result['collector'], result['nodes']), result) for result in baseline)
+    regressions = []
+    for result in results:
+        before = previous.get((result['collector'], result['nodes']))
+        if before is None:
+            continue
+        where = '%s with %d nodes:' % (result['collector'], result['nodes'])
+        for key in ('collect_ms', 'cpu_ms', 'peak_rss_kb'):
+            if result[key] > before[key] * (1 + tolerance) and result[key] - before[key] > floors[key]:
+                regressions.append('%s %s %.1f -> %.1f' % (where, key, before[key], result[key]))
+        if result['series'] != before['series']:
+            regressions.append('%s series %d -> %d' % (where, before['series'], result['series']))
+    return regressions
+
+
+def _collectors_child(args):
+    collector = dict(COLLECTORS)[args.child](args.url)
+    gc.collect()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    walls = []
+    cpus = []
+    for i in range(args.rounds):
+        wall, cpu = time.time(), time.clock()
+        metrics = list(collector.collect())
+        walls.append(time.time() - wall)
+        cpus.append(time.clock() - cpu)
+    print json.dumps({
+        "collect_ms": _median(walls) * 1000,
+        "cpu_ms": _median(cpus) * 1000,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline,
+        "series": sum(len(metric.samples) for metric in metrics),
+    })
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _wait_for(url):
+    for i in range(100):
+        try:
+            urllib2.urlopen(url + '/ws/v1/cluster/info', timeout=1).read()
+            return
+        except (urllib2.URLError, socket.error):
+            time.sleep(0.1)
+    raise RuntimeError('stand-in at %s did not come up' % url)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='hadoop exporter benchmarks on synthetic cluster payloads'
+    )
+    subparsers = parser.add_subparsers()
+
+    jmx = subparsers.add_parser('jmx', help='full /jmx dump against ?qry= bean requests')
+    jmx.add_argument('--datanodes', type=int, default=5000, help='number of LiveNodes (default 5000)')
+    jmx.add_argument('--filler-beans', dest='filler_beans', type=int, default=150,
+                     help='number of beans the exporter does not read (default 150)')
+    jmx.add_argument('--rounds', type=int, default=5, help='collections per mode (default 5)')
+    jmx.set_defaults(func=bench_jmx)
+
+    build = subparsers.add_parser('build', help='cost of building metric families from decoded responses')
+    build.add_argument('--nodes', type=int, default=5000, help='number of datanodes and nodemanagers (default 5000)')
+    build.add_argument('--rounds', type=int, default=10, help='builds per collector (default 10)')
+    build.set_defaults(func=bench_build)
+
+    memory = subparsers.add_parser('memory', help='peak memory of decoding the datanode and nodemanager lists')
+    memory.add_argument('--nodes', type=int, default=10000, help='number of datanodes and nodemanagers (default 10000)')
+    memory.add_argument('--variant', help=argparse.SUPPRESS)
+    memory.add_argument('--payload', help=argparse.SUPPRESS)
+    memory.set_defaults(func=bench_memory)
+
+    decoders = subparsers.add_parser('json', help='json backends and decoder processes on recorded or generated bodies')
+    decoders.add_argument('--dir', help='bodies saved by hadoop_standin.py --record (default generated ones)')
+    decoders.add_argument('--nodes', type=int, default=20000,
+                          help='datanodes and nodemanagers of the generated bodies (default 20000)')
+    decoders.add_argument('--processes', type=int, default=2, help='decoder worker processes (default 2)')
+    decoders.add_argument('--rounds', type=int, default=5, help='decodes per backend, the median is kept (default 5)')
+    decoders.set_defaults(func=bench_json)
+
+    fsimage = subparsers.add_parser('fsimage', help='per dir usage of a generated fsimage dump')
+    fsimage.add_argument('--entries', type=int, default=3000000,
+                         help='files and dirs of the generated dump (default 3000000)')
+    fsimage.add_argument('--depth', default='1,3,5', help='comma separated dir depths to report (default 1,3,5)')
+    fsimage.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    fsimage.add_argument('dump', nargs='?', help=argparse.SUPPRESS)
+    fsimage.set_defaults(func=lambda args: _fsimage_child(args) if args.child else bench_fsimage(args))
+
+    collectors = subparsers.add_parser('collectors', help='every collector against a local hadoop stand-in')
+    collectors.add_argument('--nodes', default='100,1000,5000,20000',
+                            help='comma separated cluster sizes (default 100,1000,5000,20000)')
+    collectors.add_argument('--queue-depth', dest='queue_depth', type=int, default=3,
+                            help='levels of queues below root (default 3)')
+    collectors.add_argument('--queue-width', dest='queue_width', type=int, default=4,
+                            help='child queues of every parent queue (default 4)')
+    collectors.add_argument('--scheduler', choices=('fair', 'capacity'), default='fair',
+                            help='scheduler whose queues the stand-in serves (default fair)')
+    collectors.add_argument('--apps', type=int, default=2000,
+                            help='running applications of the stand-in (default 2000)')
+    collectors.add_argument('--latency', type=float, default=0, help='seconds the stand-in delays requests (default 0)')
+    collectors.add_argument('--collectors', help='comma separated collectors to run (default all)')
+    collectors.add_argument('--rounds', type=int, default=5, help='collections per collector, the median is kept (default 5)')
+    collectors.add_argument('--save', metavar='file', help='write the results as json to file')
+    collectors.add_argument('--compare', metavar='file',
+                            help='compare with results saved before and exit 1 on regressions')
+    collectors.add_argument('--tolerance', type=float, default=0.25,
+                            help='growth of a timing or of memory counted as regression (default 0.25)')
+    collectors.add_argument('--child', help=argparse.SUPPRESS)
+    collectors.add_argument('--url', help=argparse.SUPPRESS)
+    collectors.set_defaults(func=bench_collectors)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/python
+
+import bisect
+import fnmatch
+import math
+import re
+
+from prometheus_client.core import HistogramMetricFamily, Metric, SummaryMetricFamily
+
+from concurrent_collector import collect_once
+from self_metrics import SELF_METRICS
+
+# The keys of a --cardinality.file and of each of its rules
+#
+# {"max_series": 50000,
+#  "budgets": {"resourcemanager_node": 20000},
+#  "rules": [
+#    {"match": "hadoop_datanode_node_block_pool_used_percent", "aggregate": "histogram",
+#     "by": ["cluster", "nn_host"], "buckets": [10, 25, 50, 75, 90, 95]},
+#    {"match": "hadoop_datanode_node_*", "labels": {"drop": ["xferaddr"]},
+#     "hosts": {"deny": ["*.test.example.com"]}},
+#    {"match": "hadoop_resourcemanager_node_*", "labels": {"drop": ["version"]}},
+#    {"match": "yarn_queue_*_resources", "drop": true}]}
+CONFIG_KEYS = ('max_series', 'budgets', 'rules')
+RULE_KEYS = ('match', 'drop', 'labels', 'hosts', 'aggregate', 'by', 'buckets', 'quantiles')
+AGGREGATES = ('histogram', 'summary')
+
+# Samples are filtered by the host of this label, samples without it are kept.
+# Globs match the host name, a datanode's :port is left out.
+HOST_LABEL = 'host'
+# Labels that are part of the sample format, never dropped
+_FORMAT_LABELS = ('le', 'quantile')
+# Hosts whose verdict a rule remembers, more than the hosts of every cluster
+# it sees. Hosts come and go, the verdicts are forgotten past that.
+_MAX_HOSTS = 100000
+
+# Reasons a series is dropped, the reason label of hadoop_exporter_dropped_series
+RULE = 'rule'
+HOST = 'host'
+BUDGET = 'budget'
+
+
+class FamilyRule(object):
+    # What happens to the families whose name matches the glob of a rule:
+    # dropped, samples of hosts filtered out, labels dropped (series that
+    # become the same are summed) or the per host samples collapsed into one
+    # histogram or summary per value of the by labels.
+
+    def __init__(self, rule):
+        unknown = set(rule) - set(RULE_KEYS)
+        if unknown:
+            raise ValueError('unknown cardinality rule settings: {0}'.format(', '.join(sorted(unknown))))
+        if 'match' not in rule:
+            raise ValueError('every cardinality rule needs a "match" glob')
+        self.match = rule['match']
+        self._pattern = re.compile(fnmatch.translate(self.match))
+        self.drop = bool(rule.get('drop', False))
+
+        labels = rule.get('labels', {})
+        self._keep_labels = labels.get('keep')
+        self._drop_labels = set(labels.get('drop', ())) - set(_FORMAT_LABELS)
+        self._relabel = self._keep_labels is not None or bool(self._drop_labels)
+
+        hosts = rule.get('hosts', {})
+        self._allow = _globs(hosts.get('allow'))
+        self._deny = _globs(hosts.get('deny'))
+        # host -> kept, a rule sees the same hosts on every refresh
+        self._hosts = {}
+
+        self.aggregate = rule.get('aggregate')
+        if self.aggregate is not None and self.aggregate not in AGGREGATES:
+            raise ValueError('aggregate of {0} must be one of {1}'.format(self.match, ', '.join(AGGREGATES)))
+        self._by = tuple(rule.get('by', ('cluster',)))
+        self._buckets = tuple(sorted(float(bound) for bound in rule.get('buckets', ()))) + (float('inf'),)
+        if self.aggregate == 'histogram' and len(self._buckets) == 1:
+            raise ValueError('the histogram of {0} needs buckets'.format(self.match))
+        self._quantiles = tuple(rule.get('quantiles', (0.5, 0.9, 0.99)))
+
+    def matches(self, name):
+        return self._pattern.match(name) is not None
+
+    def apply(self, metric, dropped):
+        # The family as the rule wants it, a new one, or None when it is
+        # dropped. The families and labels dicts of the collector are shared
+        # with its snapshot and label caches and left as they are.
+        if self.drop:
+            _count(dropped, metric.name, RULE, len(metric.samples))
+            return None
+        samples = metric.samples
+        if self._allow is not None or self._deny is not None:
+            samples = [sample for sample in samples if self._host_kept(sample.labels.get(HOST_LABEL))]
+            _count(dropped, metric.name, HOST, len(metric.samples) - len(samples))
+        if self.aggregate is not None:
+            return self._aggregated(metric, samples)
+        copy = Metric(metric.name, metric.documentation, metric.type)
+        copy.samples = self._relabeled(samples) if self._relabel else samples
+        return copy
+
+    def _host_kept(self, host):
+        if host is None:
+            return True
+        kept = self._hosts.get(host)
+        if kept is None:
+            name = host.split(':', 1)[0]
+            kept = ((self._allow is None or any(glob.match(name) for glob in self._allow)) and
+                    not (self._deny is not None and any(glob.match(name) for glob in self._deny)))
+            if len(self._hosts) >= _MAX_HOSTS:
+                self._hosts.clear()
+            self._hosts[host] = kept
+        return kept
+
+    def _relabeled(self, samples):
+        # Every projected label set gets one dict, shared by its samples
+        labels_of = {}
+        index = {}
+        relabeled = []
+        for sample in samples:
+            if self._keep_labels is not None:
+                names = [name for name in sample.labels if name in self._keep_labels or name in _FORMAT_LABELS]
+            else:
+                names = [name for name in sample.labels if name not in self._drop_labels]
+            key = (sample.name, tuple(sorted((name, sample.labels[name]) for name in names)))
+            at = index.get(key)
+            if at is not None:
+                relabeled[at] = relabeled[at]._replace(value=relabeled[at].value + sample.value)
+                continue
+            labels = labels_of.get(key[1])
+            if labels is None:
+                labels = labels_of[key[1]] = dict(key[1])
+            index[key] = len(relabeled)
+            relabeled.append(sample._replace(labels=labels))
+        return relabeled
+
+    def _aggregated(self, metric, samples):
+        # Values of the plain samples grouped by the by labels, NaN is left out
+        groups = {}
+        for sample in samples:
+            if sample.name != metric.name or sample.value != sample.value:
+                continue
+            key = tuple(sample.labels.get(name, '') for name in self._by)
+            groups.setdefault(key, []).append(sample.value)
+
+        if self.aggregate == 'histogram':
+            family = HistogramMetricFamily(metric.name, metric.documentation, labels=self._by)
+            for key, values in sorted(groups.items()):
+                counts = [0] * len(self._buckets)
+                for value in values:
+                    counts[bisect.bisect_left(self._buckets, value)] += 1
+                buckets = []
+                cumulative = 0
+                for bound, count in zip(self._buckets, counts):
+                    cumulative += count
+                    buckets.append(('+Inf' if bound == float('inf') else repr(bound), cumulative))
+                family.add_metric(list(key), buckets, sum(values))
+            return family
+
+        family = SummaryMetricFamily(metric.name, metric.documentation, labels=self._by)
+        for key, values in sorted(groups.items()):
+            values.sort()
+            labels = dict(zip(self._by, key))
+            for quantile in self._quantiles:
+                # nearest rank
+                rank = min(max(int(math.ceil(quantile * len(values))) - 1, 0), len(values) - 1)
+                family.add_sample(metric.name, dict(labels, quantile=repr(float(quantile))), values[rank])
+            family.add_metric(list(key), len(values), sum(values))
+        return family
+
+
+class Cardinality(object):
+    # The rules of a --cardinality.file. The first rule matching the name of
+    # a family applies to it, families no rule matches pass as they are.
+    # max_series is the series budget of every collector unless budgets names
+    # the collector.
+
+    def __init__(self, config=None, max_series=0):
+        config = config or {}
+        if not isinstance(config, dict):
+            raise ValueError('the cardinality config must be a mapping')
+        unknown = set(config) - set(CONFIG_KEYS)
+        if unknown:
+            raise ValueError('unknown cardinality settings: {0}'.format(', '.join(sorted(unknown))))
+        self.max_series = config.get('max_series', max_series)
+        self._budgets = config.get('budgets', {})
+        self._rules = [FamilyRule(rule) for rule in config.get('rules', ())]
+        # family name -> its rule or None
+        self._rule_of = {}
+
+    def rule(self, name):
+        try:
+            return self._rule_of[name]
+        except KeyError:
+            rule = self._rule_of[name] = next((rule for rule in self._rules if rule.matches(name)), None)
+            return rule
+
+    def budget(self, collector):
+        return self._budgets.get(collector, self.max_series)
+
+    def limit(self, collector, served=False):
+        # collector itself when nothing would limit it. served is for
+        # collectors like the quota one, whose collect() serves families the
+        # poller does not build.
+        if not self._rules and not self.budget(collector.name):
+            return collector
+        return (LimitedServedCollector if served else LimitedCollector)(collector, self)
+
+
+class LimitedCollector(object):
+    # Runs the families a collector builds through the cardinality rules and
+    # its series budget. It has the interface of a collector, so the poller,
+    # ConcurrentCollector and collect_once take it like any other.
+    #
+    # A family that would take the collector over its budget is dropped as a
+    # whole (later, smaller families may still fit): a family cut short would
+    # look complete to queries summing over it.
+
+    def __init__(self, collector, cardinality):
+        self.collector = collector
+        self.name = collector.name
+        self._cluster = getattr(collector, '_cluster', '')
+        self._cardinality = cardinality
+        self._budget = cardinality.budget(collector.name)
+
+    def fetch_jobs(self):
+        return self.collector.fetch_jobs()
+
+    def build_metrics(self, results):
+        return self._limited(self.collector.build_metrics(results))
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        return collect_once(self)
+
+    def _limited(self, metrics):
+        # (family, reason) -> series dropped by this build
+        dropped = {}
+        left = self._budget or None
+        for metric in metrics:
+            rule = self._cardinality.rule(metric.name)
+            if rule is not None:
+                metric = rule.apply(metric, dropped)
+                if metric is None:
+                    continue
+            if left is not None:
+                if len(metric.samples) > left:
+                    _count(dropped, metric.name, BUDGET, len(metric.samples))
+                    continue
+                left -= len(metric.samples)
+            yield metric
+        SELF_METRICS.dropped(self._cluster, self.name, dropped)
+
+
+class LimitedServedCollector(LimitedCollector):
+    # The families collect() of the collector serves, limited on every scrape
+
+    def collect(self):
+        return self._limited(self.collector.collect())
+
+
+def _globs(patterns):
+    if patterns is None:
+        return None
+    return [re.compile(fnmatch.translate(pattern)) for pattern in patterns]
+
+
+def _count(dropped, family, reason, series):
+    if series:
+        dropped[(family, reason)] = dropped.get((family, reason), 0) + series
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+import random
+import threading
+import time
+
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+
+class _Circuit(object):
+    __slots__ = ('state', 'failures', 'opened', 'retry_at', 'probing')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        # times opened in a row, the backoff doubles with each
+        self.opened = 0
+        self.retry_at = 0
+        self.probing = False
+
+
+class CircuitBreaker(object):
+    # Health of every hadoop host. After threshold failed requests in a row
+    # the circuit of a host opens and requests to it are refused right away,
+    # so a dead namenode / resourcemanager costs no connect timeout. Once the
+    # backoff is over the circuit is half open and a single request probes the
+    # host: success closes the circuit, failure opens it again for twice as
+    # long, up to max_backoff. Backoffs are jittered so hosts that died
+    # together are not probed together.
+
+    def __init__(self, threshold=2, backoff=5, max_backoff=300):
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._circuits = {}
+        self._opened_total = {}
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None or circuit.state == CLOSED:
+                return True
+            if circuit.state == OPEN:
+                if time.time() < circuit.retry_at:
+                    return False
+                circuit.state = HALF_OPEN
+            if circuit.probing:
+                return False
+            circuit.probing = True
+            return True
+
+    def success(self, host):
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is not None:
+                circuit.state = CLOSED
+                circuit.failures = 0
+                circuit.opened = 0
+                circuit.probing = False
+
+    def failure(self, host):
+        with self._lock:
+            circuit = self._circuits.setdefault(host, _Circuit())
+            circuit.failures += 1
+            circuit.probing = False
+            if circuit.state == HALF_OPEN or circuit.failures >= self.threshold:
+                self._open(host, circuit)
+
+    def _open(self, host, circuit):
+        backoff = min(self.backoff * 2 ** circuit.opened, self.max_backoff)
+        circuit.state = OPEN
+        circuit.opened += 1
+        circuit.retry_at = time.time() + backoff * random.uniform(0.5, 1)
+        self._opened_total[host] = self._opened_total.get(host, 0) + 1
+
+    def states(self):
+        # [(host, state, times opened)]
+        with self._lock:
+            return [(host, circuit.state, self._opened_total.get(host, 0))
+                    for host, circuit in self._circuits.items()]
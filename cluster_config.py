@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+import argparse
+import json
+
+# The settings a cluster in the config file may set, named like the dest of
+# the matching hadoop_exporter flag. Anything left out falls back to the flag.
+CLUSTER_KEYS = (
+    'cluster',
+    'nnurl',
+    'rmurl',
+    'concurrency',
+    'poll_interval',
+    'namenode_poll_interval',
+    'resourcemanager_poll_interval',
+    'resourcemanager_node_poll_interval',
+    'queue_poll_interval',
+    'application_poll_interval',
+    'quota_dirs',
+    'quota_interval',
+    'quota_user',
+    'application_retention',
+    'host_jmx_interval',
+    'host_jmx_workers',
+    'host_jmx_timeout',
+    'fsimage_delimited',
+    'fsimage_fetch_dir',
+    'fsimage_depth',
+    'fsimage_interval',
+)
+
+
+def load_config(path):
+    # JSON, or YAML when the file is named .yml / .yaml and PyYAML is installed
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(('.yml', '.yaml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError('{0}: reading YAML needs PyYAML, use JSON instead'.format(path))
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+def cluster_settings(config, defaults):
+    # One argparse namespace per cluster: the flags given on the command line
+    # overridden by the keys of the cluster in the config.
+    #
+    # {"clusters": [{"cluster": "prod", "nnurl": "http://nn1:50070/jmx;http://nn2:50070/jmx",
+    #                "rmurl": "http://rm1:8088", "poll_interval": 30}, ...]}
+    clusters = config.get('clusters') if isinstance(config, dict) else None
+    if not clusters:
+        raise ValueError('the config has no clusters')
+
+    settings = []
+    names = set()
+    for cluster in clusters:
+        unknown = set(cluster) - set(CLUSTER_KEYS)
+        if unknown:
+            raise ValueError('unknown cluster settings: {0}'.format(', '.join(sorted(unknown))))
+        if 'cluster' not in cluster:
+            raise ValueError('every cluster needs a "cluster" name')
+        if cluster['cluster'] in names:
+            raise ValueError('cluster {0} is listed twice'.format(cluster['cluster']))
+        names.add(cluster['cluster'])
+
+        values = dict(vars(defaults))
+        values.update(cluster)
+        settings.append(argparse.Namespace(**values))
+    return settings
@@ -0,0 +1,242 @@
+#!/usr/bin/python
+
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from prometheus_client.core import GaugeMetricFamily, Metric
+
+from self_metrics import SELF_METRICS, target_of
+
+
+def run_jobs(jobs, pool=None):
+    # jobs is a list of (key, callable). Without a pool they run one after
+    # another, which is what a single collector registered on its own does.
+    # The key of a job that raised is left out of the results, build_metrics
+    # skips its target and the other targets are not affected.
+    if pool is None:
+        values = [(key, _call(job)) for key, job in jobs]
+    else:
+        pending = [(key, pool.apply_async(_call, (job,))) for key, job in jobs]
+        values = [(key, result.get()) for key, result in pending]
+    return dict((key, value) for key, value in values if value is not _FAILED)
+
+
+def _call(job):
+    try:
+        return job()
+    except Exception:
+        # counted by SELF_METRICS.jobs
+        return _FAILED
+
+
+_FAILED = object()
+
+
+def collect_once(collector, pool=None):
+    # What collect() of a collector registered on its own does, with the jobs
+    # and build_metrics timed by SELF_METRICS
+    jobs = SELF_METRICS.jobs(collector, collector.fetch_jobs())
+    return SELF_METRICS.build(collector, run_jobs(jobs, pool))
+
+
+class ConcurrentCollector(object):
+    # Wraps several collectors so that every target of every collector is
+    # fetched at the same time. Each collector only has to split its work into
+    # fetch_jobs() (blocking http calls) and build_metrics(results).
+    #
+    # With a deadline a scrape waits for the jobs until deadline seconds
+    # after it started, less the time the builds took last time, and a late
+    # job is replaced by its last result. Streamed results can only be read
+    # once, a collector with a late job that has none is served its families
+    # of the last build instead. Either way its targets are reported stale.
+    # Late jobs keep running, the next scrape waits on them instead of
+    # asking hadoop again, and so does a scrape that comes in while another
+    # one waits on the same job. A job that raised is served like a late
+    # one, the other targets of the scrape are not affected.
+
+    def __init__(self, collectors, workers=8, deadline=0):
+        self._collectors = collectors
+        self._pool = ThreadPool(workers)
+        self._deadline = deadline
+        self._lock = threading.Lock()
+        # held by the builds of a scrape and what they keep for the next one,
+        # scrapes coming in together share the state of the collectors
+        self._build_lock = threading.Lock()
+        # (index of the collector, key) -> AsyncResult of a job in flight
+        self._inflight = {}
+        # (index, key) -> last result of a job that can be used again
+        self._last_results = {}
+        # index -> families of the last build, index -> seconds it took
+        self._last_families = {}
+        self._build_seconds = {}
+        # (index, target) -> [unix time of the last job in time, stale]
+        self._targets = {}
+
+    def collect(self):
+        if self._deadline:
+            return self._collect_within_deadline()
+        return self._collect_all()
+
+    def _collect_all(self):
+        jobs = []
+        for index, collector in enumerate(self._collectors):
+            for key, job in SELF_METRICS.jobs(collector, collector.fetch_jobs()):
+                jobs.append(((index, key), job))
+
+        results = run_jobs(jobs, self._pool)
+
+        for index, collector in enumerate(self._collectors):
+            collector_results = dict((key, value) for (i, key), value in results.items() if i == index)
+            for metric in SELF_METRICS.build(collector, collector_results):
+                yield metric
+
+    def _collect_within_deadline(self):
+        start = time.time()
+        pending = {}
+        with self._lock:
+            for index, collector in enumerate(self._collectors):
+                for key, job in SELF_METRICS.jobs(collector, collector.fetch_jobs()):
+                    result = self._inflight.get((index, key))
+                    if result is None:
+                        result = self._inflight[(index, key)] = self._pool.apply_async(job)
+                    pending[(index, key)] = result
+            # late jobs no collector asks for any more
+            for key in self._inflight.keys():
+                if key not in pending and self._inflight[key].ready():
+                    del self._inflight[key]
+            # at least half the deadline is left to the fetches
+            until = start + max(self._deadline - sum(self._build_seconds.values()), self._deadline / 2.0)
+
+        done = {}
+        late = set()
+        for key, result in pending.items():
+            result.wait(max(until - time.time(), 0))
+            if not result.ready():
+                late.add(key)
+                continue
+            with self._lock:
+                if self._inflight.get(key) is result:
+                    del self._inflight[key]
+            try:
+                done[key] = result.get()
+            except Exception:
+                # counted by SELF_METRICS.jobs, the target is served stale
+                late.add(key)
+
+        with self._build_lock:
+            return self._build_within_deadline(pending, done, late)
+
+    def _build_within_deadline(self, pending, done, late):
+        families = []
+        now = time.time()
+        for index, collector in enumerate(self._collectors):
+            keys = [key for i, key in pending if i == index]
+            results = dict((key, done[(index, key)]) for key in keys if (index, key) not in late)
+            fallback = False
+            for key in keys:
+                if (index, key) in late:
+                    if (index, key) in self._last_results:
+                        results[key] = self._last_results[(index, key)]
+                    else:
+                        fallback = True
+                elif reusable(results[key]):
+                    self._last_results[(index, key)] = results[key]
+
+            stale = dict((target_of(key), fallback) for key in keys)
+            for key in keys:
+                if (index, key) in late:
+                    stale[target_of(key)] = True
+            for target, is_stale in stale.items():
+                state = self._targets.setdefault((index, target), [0, False])
+                state[1] = is_stale
+                if not is_stale:
+                    state[0] = now
+
+            if fallback:
+                families.extend(self._last_families.get(index, ()))
+            else:
+                build_start = time.time()
+                built = self._last_families[index] = list(SELF_METRICS.build(collector, results))
+                with self._lock:
+                    self._build_seconds[index] = time.time() - build_start
+                families.extend(built)
+
+        stale = GaugeMetricFamily('hadoop_exporter_target_stale',
+                                  'Whether the last scrape served old values of the target because it did not '
+                                  'answer within the scrape deadline. 1:stale, 0:fresh',
+                                  labels=["cluster", "collector", "target"])
+        last_success = GaugeMetricFamily('hadoop_exporter_target_last_success_timestamp_seconds',
+                                         'Unix time the target last answered within the scrape deadline',
+                                         labels=["cluster", "collector", "target"])
+        for (index, target), (success, is_stale) in sorted(self._targets.items()):
+            collector = self._collectors[index]
+            labels = [getattr(collector, '_cluster', ''), collector.name, target]
+            stale.add_metric(labels, 1 if is_stale else 0)
+            last_success.add_metric(labels, success)
+        families.append(stale)
+        families.append(last_success)
+        return families
+
+
+def reusable(result):
+    # Whether a job result can be built from again: iterators (streamed
+    # bodies) are used up by the build that reads them
+    if isinstance(result, tuple):
+        return all(reusable(value) for value in result)
+    return not hasattr(result, 'next')
+
+
+def merge_families(metrics, previous=None):
+    # Collectors of different clusters yield families of the same name, the
+    # text format wants each name once, so their samples are joined. The
+    # families themselves may be part of a snapshot and are not modified.
+    # previous maps names to (families, joined family) of an earlier call:
+    # when the same snapshot families come again their joined family is
+    # reused, so it is the same object from refresh to refresh. It is updated
+    # in place.
+    groups = {}
+    order = []
+    for metric in metrics:
+        group = groups.get(metric.name)
+        if group is None:
+            group = groups[metric.name] = []
+            order.append(metric.name)
+        group.append(metric)
+
+    merged = []
+    joined = {}
+    for name in order:
+        group = groups[name]
+        if len(group) == 1:
+            merged.append(group[0])
+            continue
+        before = previous.get(name) if previous is not None else None
+        if before is not None and len(before[0]) == len(group) and all(
+                a is b for a, b in zip(before[0], group)):
+            copy = before[1]
+        else:
+            first = group[0]
+            copy = Metric(first.name, first.documentation, first.type)
+            copy.samples = [sample for metric in group for sample in metric.samples]
+        joined[name] = (group, copy)
+        merged.append(copy)
+    if previous is not None:
+        previous.clear()
+        previous.update(joined)
+    return merged
+
+
+class MergedCollector(object):
+    # Serves several collectors as one, see merge_families()
+
+    def __init__(self, collectors):
+        self._collectors = collectors
+        self._joined = {}
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        return merge_families((metric for collector in self._collectors for metric in collector.collect()),
+                              self._joined)
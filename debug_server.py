@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+import BaseHTTPServer
+import SocketServer
+import gc
+import threading
+import urlparse
+
+from self_metrics import SELF_METRICS
+
+
+class DebugHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # /debug/profile/start    profile every job and build_metrics from now on
+    # /debug/profile/stop     stop and answer with the cProfile stats
+    # /debug/memory/start     count the objects gc tracks, by type
+    # /debug/memory           the types whose count grew the most since then
+    # /debug/memory/stop      forget the counts
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        query = urlparse.parse_qs(url.query)
+        limit = int(query.get('limit', ['50'])[0])
+
+        if url.path == '/debug/profile/start':
+            SELF_METRICS.start_profile()
+            self._reply(200, 'profiling, get /debug/profile/stop for the stats\n')
+        elif url.path == '/debug/profile/stop':
+            self._reply(200, SELF_METRICS.stop_profile(limit))
+        elif url.path.startswith('/debug/memory'):
+            self._memory(url.path, limit)
+        else:
+            self._reply(404, 'not found\n')
+
+    def _memory(self, path, limit):
+        # tracemalloc is python 3 only, a census of the objects gc tracks
+        # shows what piles up on 2.7 too: strings and numbers are not
+        # tracked, the dicts, lists and tuples holding them are
+        server = self.server
+        if path == '/debug/memory/start':
+            server.census = object_census()
+            self._reply(200, 'counted {0} objects, get /debug/memory for what grew\n'.format(
+                sum(server.census.values())))
+        elif path == '/debug/memory/stop':
+            server.census = None
+            self._reply(200, 'forgot the counts\n')
+        elif path == '/debug/memory':
+            if server.census is None:
+                self._reply(409, 'get /debug/memory/start first\n')
+                return
+            counts = object_census()
+            grown = sorted(((count - server.census.get(name, 0), count, name) for name, count in counts.items()),
+                           reverse=True)[:limit]
+            lines = ['{0:>10} {1:>10}  {2}\n'.format('grown', 'count', 'type')]
+            lines.extend('{0:>+10} {1:>10}  {2}\n'.format(delta, count, name) for delta, count, name in grown)
+            self._reply(200, ''.join(lines))
+        else:
+            self._reply(404, 'not found\n')
+
+    def _reply(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+class _DebugServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    # type name -> count of /debug/memory/start
+    census = None
+
+
+def object_census():
+    # type name -> number of live objects gc tracks of that type
+    gc.collect()
+    counts = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def start_debug_server(port, addr='127.0.0.1'):
+    # Kept off the metrics port and bound to localhost by default, profiling
+    # slows scrapes down.
+    httpd = _DebugServer((addr, port), DebugHandler)
+    thread = threading.Thread(target=httpd.serve_forever, name='debug-server')
+    thread.daemon = True
+    thread.start()
+    return httpd
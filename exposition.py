@@ -0,0 +1,290 @@
+#!/usr/bin/python
+
+import BaseHTTPServer
+import Queue
+import os
+import select
+import threading
+import time
+import urlparse
+import zlib
+
+from prometheus_client import exposition
+from prometheus_client.openmetrics import exposition as openmetrics_exposition
+
+TEXT = 'text'
+OPENMETRICS = 'openmetrics'
+
+_FORMATS = {
+    TEXT: (exposition.generate_latest, exposition.CONTENT_TYPE_LATEST),
+    OPENMETRICS: (openmetrics_exposition.generate_latest, openmetrics_exposition.CONTENT_TYPE_LATEST),
+}
+
+
+class _Family(object):
+    # One family rendered in each format the first time a request asks for
+    # it. Families of a poller snapshot stay the same objects until the next
+    # refresh, so they are rendered once per refresh.
+    __slots__ = ('family', 'bodies')
+
+    def __init__(self, family):
+        self.family = family
+        self.bodies = {}
+
+    def collect(self):
+        return [self.family]
+
+    def body(self, fmt):
+        body = self.bodies.get(fmt)
+        if body is None:
+            body = _FORMATS[fmt][0](self)
+            if fmt == OPENMETRICS:
+                body = body[:-len(_EOF)]
+            self.bodies[fmt] = body
+        return body
+
+
+class _Collected(object):
+    # The families of one collection of the registry and the payloads built
+    # from them. The gzipped payload is the whole body compressed as one
+    # stream, the families repeat the same label names and values.
+
+    def __init__(self, families, generation):
+        self.families = families
+        self.generation = generation
+        self.started = 0
+        self.collected_at = time.time()
+        self._bodies = {}
+
+    def body(self, fmt, gzipped):
+        body = self._bodies.get((fmt, gzipped))
+        if body is None:
+            if gzipped:
+                body = _gzip(self.body(fmt, False))
+            else:
+                parts = [family.body(fmt) for family in self.families]
+                if fmt == OPENMETRICS:
+                    parts.append(_EOF)
+                body = ''.join(parts)
+            self._bodies[(fmt, gzipped)] = body
+        return body
+
+
+class Exposition(object):
+    # Collects the registry at most once per max_age seconds, or again as soon
+    # as generation() changes (the poller refreshed a collector), and keeps
+    # the payloads so most scrapes are only a write of a ready buffer.
+    # Requests arriving while a collection runs wait for it instead of
+    # starting their own.
+
+    def __init__(self, registry, max_age=0, generation=None):
+        self._registry = registry
+        self._max_age = max_age
+        self._generation = generation or (lambda: None)
+        self._collected = None
+        # id of a family -> its _Family, for the families of the last collection
+        self._families = {}
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+
+    def payload(self, fmt, gzipped):
+        collected = self._current()
+        with self._render_lock:
+            return collected.body(fmt, gzipped)
+
+    def families(self):
+        # The families of the collection scrapes are served from, e.g. for
+        # the pusher: collecting the registry again would run the collectors
+        # on their own, next to the scrapes
+        return [family.family for family in self._current().families]
+
+    def _current(self):
+        requested = time.time()
+        collected = self._collected
+        if self._fresh(collected, requested):
+            return collected
+        with self._lock:
+            collected = self._collected
+            # a collection that started after this request came in will do
+            if collected is not None and (collected.started >= requested or self._fresh(collected, requested)):
+                return collected
+            started = time.time()
+            generation = self._generation()
+            families = {}
+            rendered = []
+            for metric in self._registry.collect():
+                family = self._families.get(id(metric))
+                if family is None or family.family is not metric:
+                    family = _Family(metric)
+                families[id(metric)] = family
+                rendered.append(family)
+            self._families = families
+            collected = _Collected(rendered, generation)
+            collected.started = started
+            self._collected = collected
+        return collected
+
+    def _fresh(self, collected, now):
+        return (collected is not None and collected.generation == self._generation() and
+                now - collected.collected_at < self._max_age)
+
+
+def _gzip(body):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+_EOF = '# EOF\n'
+
+
+class ExpositionHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # HTTP/1.1 with keep-alive. A handler serves one request, the server
+    # keeps the connection open for the next one. A request has timeout
+    # seconds to arrive once it started.
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    timeout = 10
+    # unbuffered, nothing of a next request is read into a buffer that goes
+    # away with the handler
+    rbufsize = 0
+
+    def handle(self):
+        self.close_connection = 1
+        self.handle_one_request()
+
+    def do_GET(self):
+        server = self.server
+        path = urlparse.urlsplit(self.path).path
+        if path == server.telemetry_path:
+            fmt = OPENMETRICS if 'application/openmetrics-text' in self.headers.get('Accept', '') else TEXT
+            gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+            try:
+                body = server.exposition.payload(fmt, gzipped)
+            except Exception as e:
+                self._reply(500, 'text/plain; charset=utf-8', 'collecting metrics failed: {0}\n'.format(e))
+                return
+            self._reply(200, _FORMATS[fmt][1], body, 'gzip' if gzipped else None)
+        elif path == '/healthz':
+            self._reply(200, 'text/plain; charset=utf-8', 'ok\n')
+        elif path == '/ready':
+            if server.ready():
+                self._reply(200, 'text/plain; charset=utf-8', 'ready\n')
+            else:
+                self._reply(503, 'text/plain; charset=utf-8', 'waiting for the first refresh\n')
+        elif path == '/':
+            self._reply(200, 'text/html; charset=utf-8',
+                        '<html><head><title>Hadoop Exporter</title></head><body><h1>Hadoop Exporter</h1>'
+                        '<p><a href="{0}">Metrics</a></p></body></html>\n'.format(server.telemetry_path))
+        else:
+            self._reply(404, 'text/plain; charset=utf-8', 'not found\n')
+
+    def _reply(self, code, content_type, body, encoding=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+class PooledHTTPServer(BaseHTTPServer.HTTPServer):
+    # Requests are served by a fixed pool of threads instead of a new thread
+    # per connection. A thread is only taken while a request is served:
+    # between requests keep-alive connections wait in the poll() of one
+    # thread, which hands a connection back to the pool when its next
+    # request arrives, so idle clients can not use the pool up. Unlike
+    # select() poll() has no limit on the descriptor numbers. Connections
+    # idle for idle_timeout seconds are closed.
+    allow_reuse_address = True
+    request_queue_size = 64
+    idle_timeout = 60
+
+    def __init__(self, address, handler, threads=8):
+        BaseHTTPServer.HTTPServer.__init__(self, address, handler)
+        self._connections = Queue.Queue()
+        # socket -> (client address, unix time it went idle)
+        self._idle = {}
+        self._idle_lock = threading.Lock()
+        # written to when a connection goes idle, to wake the poll() up
+        self._wakeup, self._wake = os.pipe()
+        for i in range(threads):
+            thread = threading.Thread(target=self._serve_connections, name='exposition-%d' % i)
+            thread.daemon = True
+            thread.start()
+        thread = threading.Thread(target=self._watch_idle, name='exposition-idle')
+        thread.daemon = True
+        thread.start()
+
+    def process_request(self, request, client_address):
+        self._connections.put((request, client_address))
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def _serve_connections(self):
+        while True:
+            request, client_address = self._connections.get()
+            try:
+                handler = self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+                self.shutdown_request(request)
+                continue
+            if handler.close_connection:
+                self.shutdown_request(request)
+                continue
+            with self._idle_lock:
+                self._idle[request] = (client_address, time.time())
+            os.write(self._wake, 'x')
+
+    def _watch_idle(self):
+        # Connections are only registered and unregistered here, a socket is
+        # no longer watched when it is handed back or closed, so its
+        # descriptor can be reused.
+        poller = select.poll()
+        poller.register(self._wakeup, select.POLLIN)
+        # descriptor -> socket of the watched connections
+        watched = {}
+        while True:
+            with self._idle_lock:
+                for request in self._idle:
+                    if request.fileno() not in watched:
+                        watched[request.fileno()] = request
+                        poller.register(request, select.POLLIN | select.POLLPRI)
+            events = poller.poll(1000)
+            now = time.time()
+            with self._idle_lock:
+                # a closed connection is readable too, its handler sees the end
+                for fd, event in events:
+                    if fd == self._wakeup:
+                        os.read(self._wakeup, 4096)
+                        continue
+                    poller.unregister(fd)
+                    request = watched.pop(fd)
+                    self._connections.put((request, self._idle.pop(request)[0]))
+                expired = [request for request, (client_address, since) in self._idle.items()
+                           if now - since > self.idle_timeout]
+                for request in expired:
+                    if watched.pop(request.fileno(), None) is not None:
+                        poller.unregister(request)
+                    del self._idle[request]
+            for request in expired:
+                self.shutdown_request(request)
+
+
+def start_exposition_server(port, telemetry_path, registry, addr='', max_age=0, generation=None, ready=None,
+                            threads=8):
+    # Serves registry on telemetry_path, plus /healthz (the process is up)
+    # and /ready (ready() is true, e.g. every polled collector refreshed once)
+    httpd = PooledHTTPServer((addr, port), ExpositionHandler, threads)
+    httpd.telemetry_path = telemetry_path
+    httpd.exposition = Exposition(registry, max_age, generation)
+    httpd.ready = ready or (lambda: True)
+    thread = threading.Thread(target=httpd.serve_forever, name='exposition')
+    thread.daemon = True
+    thread.start()
+    return httpd
@@ -0,0 +1,432 @@
+#!/usr/bin/python
+
+import argparse
+import gzip
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from bisect import bisect_left
+
+from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily
+
+from ha_state import ha_state, is_passive, namenode_state
+from http_client import HTTP, HttpError
+from json_decoder import DECODER
+from metric_descriptors import DescriptorTable, add_sample
+from quota_exporter import HdfsQuotaCollector, quota_values
+
+# File size buckets in bytes of the histogram of every dir, small files are
+# the ones in the first buckets
+DEFAULT_BUCKETS = (0, 1 << 20, 16 << 20, 64 << 20, 128 << 20, 256 << 20, 1 << 30, 10 << 30)
+
+# The columns of `hdfs oiv -p Delimited`, when its output has no header line
+COLUMNS = ('Path', 'Replication', 'ModificationTime', 'AccessTime', 'PreferredBlockSize', 'BlocksCount',
+           'FileSize', 'NSQUOTA', 'DSQUOTA', 'Permission', 'UserName', 'GroupName')
+
+# The values kept per dir, followed by the counts of the file size buckets
+SIZE, CONSUMED, FILES, DIRS, BLOCKS, NS_QUOTA, DS_QUOTA = range(7)
+HISTOGRAM = 7
+
+# status -> index of its value
+_FIELDS = (("SizeBytes", SIZE), ("ConsumedBytes", CONSUMED), ("Files", FILES), ("Dirs", DIRS), ("Blocks", BLOCKS))
+
+# The namespace quota every namenode sets on / is Long.MAX_VALUE, no quota
+_UNLIMITED = (1 << 63) - 1
+
+# The bean and attribute the checkpoint txid of a namenode is read of, asked
+# for with ?get= so the namenode does not render its LiveNodes
+_JOURNAL_INFO = 'Hadoop:service=NameNode,name=NameNodeInfo'
+
+_SCRIPT = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+
+
+class FsImageUsage(object):
+    # The usage of every dir down to depth of one fsimage, read in one pass
+    # over the lines `hdfs oiv -p Delimited` prints of it. oiv prints inodes
+    # in no particular order, so every entry is added to the one dir it
+    # falls in at depth (or its parent dir above it) and finish() adds the
+    # dirs up into their parents. Memory grows with the dirs down to depth,
+    # not with the entries of the image.
+
+    def __init__(self, depth=3, buckets=DEFAULT_BUCKETS):
+        self.depth = depth
+        self.buckets = tuple(sorted(buckets))
+        # dir -> [size, consumed, files, dirs, blocks, ns quota, ds quota, bucket counts...]
+        self.dirs = {}
+        self.entries = 0
+        self._columns = _columns(COLUMNS)
+
+    def read(self, lines):
+        lines = iter(lines)
+        path_at, replication_at, blocks_at, size_at, ns_at, ds_at, permission_at = self._columns
+        width = max(self._columns) + 1
+        depth = self.depth
+        buckets = self.buckets
+        dirs = self.dirs
+        # the parent dir of the last entries, entries of a dir mostly come together
+        parent = None
+        values = None
+        # parent dir -> values of the dir it falls in, dropped when it grows large
+        parents = {}
+        for line in lines:
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) < width:
+                continue
+            path = fields[path_at]
+            if path == 'Path':
+                # a header line, it names the columns
+                self._columns = _columns(fields)
+                return self.read(lines)
+            self.entries += 1
+            kind = fields[permission_at][:1]
+            if path == '/':
+                root = self._dir('/')
+                root[NS_QUOTA] = _quota(fields[ns_at])
+                root[DS_QUOTA] = int(fields[ds_at])
+                continue
+            head = path.rpartition('/')[0] or '/'
+            if head != parent:
+                parent = head
+                values = parents.get(head)
+                if values is None:
+                    if len(parents) >= 65536:
+                        parents.clear()
+                    values = parents[head] = self._dir(_within(head, depth))
+            if kind == 'd':
+                values[DIRS] += 1
+                if path.count('/') <= depth:
+                    own = dirs.get(path) or self._dir(path)
+                    own[NS_QUOTA] = _quota(fields[ns_at])
+                    own[DS_QUOTA] = int(fields[ds_at])
+            elif kind == '-':
+                size = int(fields[size_at])
+                values[SIZE] += size
+                values[CONSUMED] += size * int(fields[replication_at])
+                values[FILES] += 1
+                values[BLOCKS] += int(fields[blocks_at])
+                values[HISTOGRAM + bisect_left(buckets, size)] += 1
+        return self
+
+    def finish(self):
+        # Adds every dir to its parent, deepest first, so each holds its subtree.
+        # Parents the lines did not name, e.g. of a filtered dump, are made first.
+        dirs = self.dirs
+        for path in list(dirs):
+            while path != '/':
+                path = path.rpartition('/')[0] or '/'
+                if path in dirs:
+                    break
+                self._dir(path)
+        for path in sorted(dirs, key=lambda path: -path.count('/') if path != '/' else 0):
+            if path == '/':
+                continue
+            values = dirs[path]
+            parent = dirs[path.rpartition('/')[0] or '/']
+            for i in range(len(values)):
+                if i != NS_QUOTA and i != DS_QUOTA:
+                    parent[i] += values[i]
+        return self
+
+    def _dir(self, path):
+        values = self.dirs.get(path)
+        if values is None:
+            values = self.dirs[path] = [0] * (HISTOGRAM + len(self.buckets) + 1)
+            values[NS_QUOTA] = values[DS_QUOTA] = -1
+        return values
+
+
+class FsImageCollector(object):
+    name = 'fsimage'
+
+    # The build statuses we want to export about, per dir
+    statuses = {
+        "SizeBytes": "Bytes of the files under the dir, before replication",
+        "ConsumedBytes": "Bytes the files under the dir take with their replicas",
+        "Files": "Files under the dir",
+        "Dirs": "Dirs under the dir, itself not included",
+        "Blocks": "Blocks of the files under the dir",
+    }
+
+    def __init__(self, target, cluster, depth=3, interval=3600, delimited=None, fetch_dir=None,
+                 oiv='hdfs oiv', buckets=DEFAULT_BUCKETS):
+        # The usage of the dirs down to depth, read off an fsimage every
+        # interval seconds: the `hdfs oiv -p Delimited` output some job keeps
+        # writing to delimited, read again when it changed, or the latest
+        # fsimage downloaded from a namenode to fetch_dir and run through oiv.
+        # The image is read by a child process, which keeps the many seconds
+        # of parsing off the GIL of the exporter.
+        self._cluster = cluster
+        self._targets = target.rstrip("/").split(';')
+        self._depth = depth
+        self.interval = interval
+        self._delimited = delimited
+        self._fetch_dir = fetch_dir
+        self._oiv = oiv
+        self._buckets = tuple(sorted(buckets))
+        self._prefix = 'hadoop_fsimage_'
+        self._statuses = tuple(self.statuses)
+        self._descriptors = DescriptorTable(self._prefix, self.statuses, ["cluster", "dir"])
+        # quotas in the families of the quota collector
+        self._quota_descriptors = DescriptorTable(self._prefix + 'quota_', HdfsQuotaCollector.quota_statuses,
+                                                  ["cluster", "dir"])
+        self._next_refresh = 0
+        # refreshes failed in a row, retries back off from tick to interval
+        self._failures = 0
+        # unix time of the image read last, of its delimited output file
+        self._image_time = None
+        self._families = ()
+        # (path, checkpoint txid or None, unix time it was downloaded) of the
+        # fsimage in fetch_dir, and of the one read last
+        self._image = self._downloaded() if fetch_dir else None
+        self._analysed = None
+
+    @property
+    def tick(self):
+        # how often the poller should look whether the image is due, the
+        # first retry of a failed refresh is that soon
+        return min(self.interval, 60)
+
+    def fetch_jobs(self):
+        if time.time() < self._next_refresh:
+            return []
+        if self._delimited:
+            try:
+                if os.path.getmtime(self._delimited) == self._image_time:
+                    self._next_refresh = time.time() + self.interval
+                    return []
+            except OSError:
+                return []
+        return [(self.name, self._refresh)]
+
+    def build_metrics(self, results):
+        if self.name not in results:
+            return self._families
+        result = results[self.name]
+        if result is None:
+            # a broken oiv or namenode is not asked for a whole image every tick
+            self._failures += 1
+            self._next_refresh = time.time() + min(self.tick * 2 ** (self._failures - 1), self.interval)
+            return self._families
+        self._failures = 0
+        self._next_refresh = time.time() + self.interval
+        image_time, usage = result
+        if usage is not None:
+            self._image_time = image_time
+            self._families = tuple(self._build(image_time, usage))
+        return self._families
+
+    def describe(self):
+        return []
+
+    def _refresh(self):
+        try:
+            if self._delimited:
+                image_time = os.path.getmtime(self._delimited)
+                usage = self._analyse(self._delimited, None)
+            else:
+                image = self._fetch_image()
+                if image is None:
+                    return None
+                if image == self._analysed:
+                    # no checkpoint since the image read last
+                    return self._image_time, None
+                image_time = image[2]
+                usage = self._analyse(image[0], self._oiv)
+                if usage is not None:
+                    self._analysed = image
+        except (OSError, IOError, ValueError) as e:
+            print "Reading the fsimage failed: %s" % e
+            return None
+        return (image_time, usage) if usage is not None else None
+
+    def _analyse(self, source, oiv):
+        command = [sys.executable, _SCRIPT, '--depth', str(self._depth),
+                   '--buckets', ','.join(str(bound) for bound in self._buckets)]
+        if oiv:
+            command.extend(['--oiv', oiv])
+        process = subprocess.Popen(command + [source], stdout=subprocess.PIPE)
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            print "Reading the fsimage %s failed with exit code %d" % (source, process.returncode)
+            return None
+        return DECODER.loads(output)
+
+    def _fetch_image(self):
+        # (path, txid, unix time) of the latest fsimage, from a standby
+        # namenode when there is one: it has the same checkpoints and the
+        # active one is left alone. The image in fetch_dir is used again
+        # while the namenode has no newer checkpoint, or, when it can not
+        # tell, for the retries within interval of one whose reading failed.
+        targets = sorted(self._targets, key=lambda url: not is_passive(ha_state(self._targets, url,
+                                                                                 namenode_state)))
+        if not os.path.isdir(self._fetch_dir):
+            os.makedirs(self._fetch_dir)
+        image = self._image_path()
+        for url in targets:
+            txid = checkpoint_txid(url)
+            last = self._image
+            if last is not None and os.path.exists(last[0]):
+                if txid is not None and txid == last[1]:
+                    return last
+                if txid is None and last != self._analysed and time.time() - last[2] < self.interval:
+                    return last
+            base = url[:-len('/jmx')] if url.endswith('/jmx') else url
+            # an fsimage is as large as the namespace, it is not held to the json size limit
+            chunks = HTTP.get_stream(base + '/imagetransfer', {'getimage': 1, 'txid': 'latest'},
+                                     (HTTP.connect_timeout, max(HTTP.read_timeout, 300)), max_bytes=float('inf'))
+            if chunks is None:
+                continue
+            try:
+                with open(image + '.tmp', 'wb') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+            except HttpError:
+                os.remove(image + '.tmp')
+                continue
+            os.rename(image + '.tmp', image)
+            with open(image + '.txid', 'w') as f:
+                f.write(str(txid) if txid is not None else '')
+            self._image = (image, txid, time.time())
+            return self._image
+        return None
+
+    def _image_path(self):
+        # clusters may share the directory
+        return os.path.join(self._fetch_dir, 'fsimage_' + self._cluster)
+
+    def _downloaded(self):
+        # The image a run before left in fetch_dir, its txid saved next to it
+        image = self._image_path()
+        try:
+            with open(image + '.txid') as f:
+                txid = f.read().strip()
+            return image, int(txid) if txid else None, os.path.getmtime(image)
+        except (OSError, IOError, ValueError):
+            return None
+
+    def _build(self, image_time, usage):
+        metrics = self._descriptors.families()
+        quota_metrics = self._quota_descriptors.families()
+        histogram = HistogramMetricFamily(self._prefix + 'file_size_bytes', 'Sizes of the files under the dir',
+                                          labels=["cluster", "dir"])
+        bounds = [repr(float(bound)) for bound in usage['buckets']] + ['+Inf']
+        for path, values in sorted(usage['dirs'].items()):
+            labels = {"cluster": self._cluster, "dir": path}
+            for status, at in _FIELDS:
+                add_sample(metrics[status], labels, values[at])
+            if values[NS_QUOTA] >= 0 or values[DS_QUOTA] >= 0:
+                # the namespace quota counts the dir itself too
+                quota = quota_values(values[NS_QUOTA], values[FILES] + values[DIRS] + 1,
+                                     values[DS_QUOTA], values[CONSUMED])
+                for status in HdfsQuotaCollector.quota_statuses:
+                    add_sample(quota_metrics[status], labels, quota[status])
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(bounds, values[HISTOGRAM:]):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            histogram.add_metric([self._cluster, path], buckets, values[SIZE])
+
+        entries = GaugeMetricFamily(self._prefix + 'entries', 'Files, dirs and links in the fsimage',
+                                    labels=["cluster"])
+        entries.add_metric([self._cluster], usage['entries'])
+        timestamp = GaugeMetricFamily(self._prefix + 'timestamp_seconds',
+                                      'Unix time the fsimage read last was fetched or its oiv output written',
+                                      labels=["cluster"])
+        timestamp.add_metric([self._cluster], image_time)
+
+        for status in self._statuses:
+            yield metrics[status]
+        yield histogram
+        for status in HdfsQuotaCollector.quota_statuses:
+            yield quota_metrics[status]
+        yield entries
+        yield timestamp
+
+
+def checkpoint_txid(url):
+    # The txid of the latest checkpoint of a namenode, the fsimage
+    # /imagetransfer?txid=latest sends. None when it does not tell.
+    result = HTTP.get_json(url, {'get': _JOURNAL_INFO + '::JournalTransactionInfo'})
+    if result is None:
+        return None
+    for bean in result.get('beans', ()):
+        if bean.get('name') != _JOURNAL_INFO:
+            continue
+        info = bean.get('JournalTransactionInfo')
+        try:
+            info = DECODER.loads(info) if isinstance(info, basestring) else info
+            return int(info['MostRecentCheckpointTxId'])
+        except (ValueError, TypeError, KeyError):
+            return None
+    return None
+
+
+def read_usage(source, depth=3, buckets=DEFAULT_BUCKETS, oiv=None):
+    # The FsImageUsage of an oiv -p Delimited file (gzipped when named .gz),
+    # or with oiv of the fsimage itself, run through that oiv command
+    usage = FsImageUsage(depth, buckets)
+    if oiv:
+        process = subprocess.Popen(shlex.split(oiv) + ['-p', 'Delimited', '-i', source, '-o', '-'],
+                                   stdout=subprocess.PIPE, bufsize=1 << 20)
+        usage.read(process.stdout)
+        if process.wait() != 0:
+            raise ValueError('{0} exited with {1}'.format(oiv, process.returncode))
+    else:
+        with (gzip.open(source) if source.endswith('.gz') else open(source, 'rb', 1 << 20)) as f:
+            usage.read(f)
+    return usage.finish()
+
+
+def _columns(names):
+    # the indexes of the columns FsImageUsage reads
+    names = list(names)
+    try:
+        return tuple(names.index(name) for name in ('Path', 'Replication', 'BlocksCount', 'FileSize', 'NSQUOTA',
+                                                    'DSQUOTA', 'Permission'))
+    except ValueError:
+        raise ValueError('the fsimage header lacks a column FsImageUsage reads: {0}'.format('\t'.join(names)))
+
+
+def _quota(field):
+    quota = int(field)
+    return -1 if quota >= _UNLIMITED else quota
+
+
+def _within(path, depth):
+    # the dir path is in at depth, or path itself above it
+    if depth <= 0:
+        return '/'
+    return '/'.join(path.split('/', depth + 1)[:depth + 1]) or '/'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Prints the usage of every dir down to --depth of an fsimage as json, what the fsimage '
+                    'collector of hadoop_exporter runs in a child process'
+    )
+    parser.add_argument('source', help='hdfs oiv -p Delimited output, or with --oiv the fsimage')
+    parser.add_argument('--depth', type=int, default=3, help='Depth of the deepest dirs reported. (default 3)')
+    parser.add_argument('--buckets', default=','.join(str(bound) for bound in DEFAULT_BUCKETS),
+                        help='Comma separated file size bucket bounds in bytes.')
+    parser.add_argument('--oiv', help='Offline image viewer command turning the fsimage into Delimited lines, '
+                                      'e.g. "hdfs oiv".')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        usage = read_usage(args.source, args.depth, [int(bound) for bound in args.buckets.split(',') if bound],
+                           args.oiv)
+    except (OSError, IOError, ValueError) as e:
+        sys.stderr.write('{0}\n'.format(e))
+        sys.exit(1)
+    json.dump({"entries": usage.entries, "buckets": usage.buckets, "dirs": usage.dirs}, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+
+import threading
+import time
+
+from http_client import HTTP
+
+ACTIVE = 'active'
+STANDBY = 'standby'
+
+
+class HAStateCache(object):
+    # Remembers the HA state of every namenode / resourcemanager for ttl
+    # seconds, so the cheap state probe is not repeated by every collector and
+    # every scrape. Probes of the same target are serialised, the others wait
+    # for the first one and use its answer.
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._states = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, probe):
+        state = self._cached(url)
+        if state is not None:
+            return state
+
+        with self._lock:
+            lock = self._locks.setdefault(url, threading.Lock())
+        with lock:
+            state = self._cached(url)
+            if state is None:
+                state = probe(url)
+                # an unreachable target is probed again on the next scrape
+                if state is not None:
+                    self._states[url] = (state, time.time() + self.ttl)
+            return state
+
+    def _cached(self, url):
+        cached = self._states.get(url)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        return None
+
+
+# Shared by all collectors, the resourcemanager collectors probe the same urls.
+HA_STATES = HAStateCache()
+
+
+def ha_state(targets, url, probe):
+    # Only HA setups are probed, a single target is always the active one.
+    if len(targets) < 2:
+        return None
+    return HA_STATES.get(url, probe)
+
+
+def is_passive(state):
+    # standby and observer members only get the cheap probe
+    return state is not None and state != ACTIVE
+
+
+NAMENODE_STATUS = 'Hadoop:service=NameNode,name=NameNodeStatus'
+
+
+def namenode_state(url):
+    result = HTTP.get_json(url, {'qry': NAMENODE_STATUS})
+    if result is None:
+        return None
+    # namenodes that ignore ?qry= send every bean, an unknown one none
+    for bean in result.get('beans', ()):
+        if bean.get('name') == NAMENODE_STATUS and 'State' in bean:
+            return bean['State'].lower()
+    return None
+
+
+def resourcemanager_state(target):
+    result = HTTP.get_json('{0}/ws/v1/cluster/info'.format(target))
+    if result is None:
+        return None
+    return result['clusterInfo']['haState'].lower()
@@ -7,7 +7,24 @@ from namenode_exporter import NameNodeCollector
 from resourcemanager_exporter import ResourceManagerNodeCollector
 from resourcemanager_exporter import ResourceManagerCollector
 from queue_exporter import YarnQueueCollector
-from prometheus_client import start_http_server
+from application_exporter import YarnApplicationCollector
+from quota_exporter import HdfsQuotaCollector
+from fsimage_exporter import DEFAULT_BUCKETS, FsImageCollector
+from host_jmx_exporter import HostJmxCollector
+from concurrent_collector import ConcurrentCollector, MergedCollector
+from cluster_config import load_config, cluster_settings
+from poller import Poller
+from sharding import Shard
+from cardinality import Cardinality
+from ha_state import HA_STATES
+from http_client import HTTP
+from json_decoder import BACKENDS, DECODER, available_backends
+from self_metrics import SELF_METRICS
+from debug_server import start_debug_server
+from exposition import start_exposition_server
+from metric_rules import load_rules
+from push_exporter import Pusher, Spool
+from rate_buffer import Derived
 from prometheus_client.core import REGISTRY
 
 def parse_args():
@@ -50,30 +67,650 @@ def parse_args():
         default=int(os.environ.get('VIRTUAL_PORT', '9088'))
     )
 
+    parser.add_argument(
+        '--web.cache-seconds',
+        metavar='seconds',
+        dest='web_cache_seconds',
+        required=False,
+        type=float,
+        help='Serve the rendered metrics to every scrape for up to this many seconds, as long as no collector '
+             'refreshed in the meantime. 0 collects on every scrape. (default 1)',
+        default=1
+    )
+
+    parser.add_argument(
+        '--web.threads',
+        metavar='threads',
+        dest='web_threads',
+        required=False,
+        type=int,
+        help='Threads serving scrapes, idle keep-alive connections hold none. (default 8)',
+        default=8
+    )
+
     parser.add_argument(
         '--cluster',
         metavar='cluster',
-        required=True,
+        required=False,
         help='label for cluster'
     )
-    return parser.parse_args()
+
+    parser.add_argument(
+        '--config.file',
+        metavar='config_file',
+        dest='config_file',
+        required=False,
+        help='JSON (or YAML with PyYAML installed) file listing the clusters to export, each with its '
+             'cluster label, nnurl, rmurl and intervals. The other flags are the defaults of every cluster.'
+    )
+
+    parser.add_argument(
+        '--concurrency',
+        metavar='concurrency',
+        required=False,
+        type=int,
+        help='Number of upstream requests made in parallel during one scrape, 1 disables it. With several '
+             'clusters it bounds the requests of all clusters together, one of them is kept for every cluster. (default 8)',
+        default=8
+    )
+
+    parser.add_argument(
+        '--poll-interval',
+        metavar='poll_interval',
+        dest='poll_interval',
+        required=False,
+        type=float,
+        help='Refresh metrics in the background every this many seconds and serve scrapes from the last '
+             'snapshot, 0 requests hadoop on every scrape. (default 0)',
+        default=0
+    )
+
+    parser.add_argument(
+        '--scrape-deadline',
+        metavar='seconds',
+        dest='scrape_deadline',
+        required=False,
+        type=float,
+        help='Collectors without a poll interval wait this long for hadoop during a scrape, targets that '
+             'did not answer in time are served their last values and reported stale. Keep it below the '
+             'scrape_timeout of prometheus, 0 waits as long as it takes. (default 0)',
+        default=0
+    )
+
+    parser.add_argument(
+        '--ha-state-ttl',
+        metavar='ha_state_ttl',
+        dest='ha_state_ttl',
+        required=False,
+        type=float,
+        help='Seconds the active/standby state of an HA member is cached, standbys only export up and '
+             'ha_state. (default 30)',
+        default=30
+    )
+
+    parser.add_argument(
+        '--http.connect-timeout',
+        metavar='seconds',
+        dest='http_connect_timeout',
+        required=False,
+        type=float,
+        help='Timeout for connecting to hadoop. (default 5)',
+        default=5
+    )
+
+    parser.add_argument(
+        '--http.read-timeout',
+        metavar='seconds',
+        dest='http_read_timeout',
+        required=False,
+        type=float,
+        help='Timeout for reading from hadoop. (default 30)',
+        default=30
+    )
+
+    parser.add_argument(
+        '--http.max-bytes',
+        metavar='bytes',
+        dest='http_max_bytes',
+        required=False,
+        type=int,
+        help='Responses larger than this are dropped and counted as errors. (default 536870912)',
+        default=512 * 1024 * 1024
+    )
+
+    parser.add_argument(
+        '--http.failure-threshold',
+        metavar='failures',
+        dest='http_failure_threshold',
+        required=False,
+        type=int,
+        help='Failed requests in a row after which a hadoop host is skipped and reported down without '
+             'being asked. (default 2)',
+        default=2
+    )
+
+    parser.add_argument(
+        '--http.backoff',
+        metavar='seconds',
+        dest='http_backoff',
+        required=False,
+        type=float,
+        help='Seconds a failed host is skipped before it is probed again, doubled after every failed '
+             'probe and jittered. (default 5)',
+        default=5
+    )
+
+    parser.add_argument(
+        '--http.max-backoff',
+        metavar='seconds',
+        dest='http_max_backoff',
+        required=False,
+        type=float,
+        help='Longest time a failed host is skipped. (default 300)',
+        default=300
+    )
+
+    parser.add_argument(
+        '--json.backend',
+        metavar='backend',
+        dest='json_backend',
+        required=False,
+        choices=('auto',) + BACKENDS,
+        help='Json decoder: auto (the fastest installed), %s. (default "auto")' % ', '.join(BACKENDS),
+        default='auto'
+    )
+
+    parser.add_argument(
+        '--json.processes',
+        metavar='processes',
+        dest='json_processes',
+        required=False,
+        type=int,
+        help='Worker processes decoding large responses off the exporter process, which then reads the '
+             'resourcemanager node list whole instead of streaming it. 0 decodes on the scraping thread. '
+             '(default 0)',
+        default=0
+    )
+
+    parser.add_argument(
+        '--json.process-threshold',
+        metavar='bytes',
+        dest='json_process_threshold',
+        required=False,
+        type=int,
+        help='Responses of at least this many bytes go to the json worker processes. (default 1048576)',
+        default=1024 * 1024
+    )
+
+    parser.add_argument(
+        '--quota.dirs',
+        metavar='dirs',
+        dest='quota_dirs',
+        required=False,
+        help='Comma separated HDFS directory globs to export quotas of, each may end in =seconds to set its '
+             'own refresh interval, "" disables it. (default "/user/*")',
+        default='/user/*'
+    )
+
+    parser.add_argument(
+        '--quota.interval',
+        metavar='seconds',
+        dest='quota_interval',
+        required=False,
+        type=float,
+        help='Seconds between two WebHDFS quota refreshes of a directory glob. (default 300)',
+        default=300
+    )
+
+    parser.add_argument(
+        '--quota.user',
+        metavar='user',
+        dest='quota_user',
+        required=False,
+        help='user.name sent with WebHDFS requests. (default "hdfs")',
+        default='hdfs'
+    )
+
+    parser.add_argument(
+        '--fsimage.delimited',
+        metavar='file',
+        dest='fsimage_delimited',
+        required=False,
+        help='`hdfs oiv -p Delimited` output of an fsimage (gzipped when named .gz) to export the usage of every '
+             'dir down to --fsimage.depth of, read again when it changed.'
+    )
+
+    parser.add_argument(
+        '--fsimage.fetch-dir',
+        metavar='dir',
+        dest='fsimage_fetch_dir',
+        required=False,
+        help='Download the latest fsimage of a namenode, a standby one when there is one, to this directory every '
+             '--fsimage.interval and export the usage of every dir down to --fsimage.depth of it.'
+    )
+
+    parser.add_argument(
+        '--fsimage.oiv',
+        metavar='command',
+        dest='fsimage_oiv',
+        required=False,
+        help='Offline image viewer command the fsimage of --fsimage.fetch-dir is read through. (default "hdfs oiv")',
+        default='hdfs oiv'
+    )
+
+    parser.add_argument(
+        '--fsimage.depth',
+        metavar='depth',
+        dest='fsimage_depth',
+        required=False,
+        type=int,
+        help='Depth of the deepest dirs exported, 1 is /user, 2 /user/<name>. (default 3)',
+        default=3
+    )
+
+    parser.add_argument(
+        '--fsimage.interval',
+        metavar='seconds',
+        dest='fsimage_interval',
+        required=False,
+        type=float,
+        help='Seconds between two reads of the fsimage. (default 3600)',
+        default=3600
+    )
+
+    parser.add_argument(
+        '--fsimage.buckets',
+        metavar='bytes',
+        dest='fsimage_buckets',
+        required=False,
+        help='Comma separated file size bucket bounds in bytes of hadoop_fsimage_file_size_bytes. '
+             '(default "%s")' % ','.join(str(bound) for bound in DEFAULT_BUCKETS),
+        default=','.join(str(bound) for bound in DEFAULT_BUCKETS)
+    )
+
+    parser.add_argument(
+        '--application.retention',
+        metavar='seconds',
+        dest='application_retention',
+        required=False,
+        type=float,
+        help='Seconds the finished application counters of a queue and user are kept after its last '
+             'finished application. (default 86400)',
+        default=86400
+    )
+
+    parser.add_argument(
+        '--host-jmx.interval',
+        metavar='seconds',
+        dest='host_jmx_interval',
+        required=False,
+        type=float,
+        help='Scrape the /jmx of every live datanode and nodemanager once in this many seconds, spread over '
+             'the interval, 0 disables it. (default 0)',
+        default=0
+    )
+
+    parser.add_argument(
+        '--host-jmx.workers',
+        metavar='workers',
+        dest='host_jmx_workers',
+        required=False,
+        type=int,
+        help='Datanode / nodemanager /jmx requests in flight, each. (default 32)',
+        default=32
+    )
+
+    parser.add_argument(
+        '--host-jmx.timeout',
+        metavar='seconds',
+        dest='host_jmx_timeout',
+        required=False,
+        type=float,
+        help='Connect and read timeout of a datanode / nodemanager /jmx request. (default 5)',
+        default=5
+    )
+
+    parser.add_argument(
+        '--shard-index',
+        metavar='index',
+        dest='shard_index',
+        required=False,
+        type=int,
+        help='Index of this replica when --shard-count replicas split the datanodes and nodemanagers, '
+             'replica 0 also exports the cluster level metrics. (default 0)',
+        default=0
+    )
+
+    parser.add_argument(
+        '--shard-count',
+        metavar='count',
+        dest='shard_count',
+        required=False,
+        type=int,
+        help='Number of exporter replicas splitting the datanodes and nodemanagers by a consistent hash '
+             'of the host name. (default 1)',
+        default=1
+    )
+
+    parser.add_argument(
+        '--cardinality.file',
+        metavar='cardinality_file',
+        dest='cardinality_file',
+        required=False,
+        help='JSON (or YAML with PyYAML installed) file of rules dropping families, labels or hosts, '
+             'collapsing per host families into histograms or summaries and setting series budgets per '
+             'collector.'
+    )
+
+    parser.add_argument(
+        '--cardinality.max-series',
+        metavar='series',
+        dest='cardinality_max_series',
+        required=False,
+        type=int,
+        help='Series a collector may emit per refresh, families that would go over it are dropped and '
+             'counted in hadoop_exporter_dropped_series. 0 is unlimited. (default 0)',
+        default=0
+    )
+
+    parser.add_argument(
+        '--jmx.rules',
+        metavar='rules_file',
+        dest='jmx_rules',
+        required=False,
+        help='JSON (or YAML with PyYAML installed) file of jmx_exporter style rules mapping more bean '
+             'attributes of the namenode, datanodes and nodemanagers to metrics, tried before the built in '
+             'ones.'
+    )
+
+    parser.add_argument(
+        '--derived',
+        dest='derived',
+        required=False,
+        action='store_true',
+        help='Export rates and slopes computed in the exporter from the values of every refresh: '
+             'applications submitted, completed and failed per minute, growth of blocks, files and '
+             'under replicated blocks, and seconds until the namenode capacity is full.'
+    )
+
+    parser.add_argument(
+        '--derived.file',
+        metavar='derived_file',
+        dest='derived_file',
+        required=False,
+        help='JSON (or YAML with PyYAML installed) file of the derived series to export instead of the '
+             'ones of --derived.'
+    )
+
+    parser.add_argument(
+        '--derived.samples',
+        metavar='samples',
+        dest='derived_samples',
+        required=False,
+        type=int,
+        help='Values kept per source series, spread over the longest window derived from it. (default 60)',
+        default=60
+    )
+
+    parser.add_argument(
+        '--push.url',
+        metavar='url',
+        dest='push_url',
+        required=False,
+        help='Prometheus remote write url (e.g. http://prometheus:9090/api/v1/write) to push the metrics to '
+             'every --push.interval, as snappy compressed protobuf.'
+    )
+
+    parser.add_argument(
+        '--push.gateway',
+        metavar='url',
+        dest='push_gateway',
+        required=False,
+        help='Pushgateway to push the metrics to every --push.interval, as job --push.job.'
+    )
+
+    parser.add_argument(
+        '--push.job',
+        metavar='job',
+        dest='push_job',
+        required=False,
+        help='Job of the pushes to --push.gateway. (default "hadoop_exporter")',
+        default='hadoop_exporter'
+    )
+
+    parser.add_argument(
+        '--push.label',
+        metavar='name=value',
+        dest='push_labels',
+        required=False,
+        action='append',
+        help='Label added to every pushed series, the grouping key on --push.gateway. Repeat it for '
+             'several labels.',
+        default=[]
+    )
+
+    parser.add_argument(
+        '--push.interval',
+        metavar='seconds',
+        dest='push_interval',
+        required=False,
+        type=float,
+        help='Seconds between two pushes. (default 30)',
+        default=30
+    )
+
+    parser.add_argument(
+        '--push.changed-only',
+        dest='push_changed_only',
+        required=False,
+        action='store_true',
+        help='Remote write only the series whose value changed, and the others every --push.resend-after.'
+    )
+
+    parser.add_argument(
+        '--push.resend-after',
+        metavar='seconds',
+        dest='push_resend_after',
+        required=False,
+        type=float,
+        help='With --push.changed-only, seconds after which an unchanged series is sent again, below the 5 '
+             'minutes after which prometheus takes it as stale. (default 240)',
+        default=240
+    )
+
+    parser.add_argument(
+        '--push.batch-size',
+        metavar='series',
+        dest='push_batch_size',
+        required=False,
+        type=int,
+        help='Series per remote write request. (default 2000)',
+        default=2000
+    )
+
+    parser.add_argument(
+        '--push.retries',
+        metavar='retries',
+        dest='push_retries',
+        required=False,
+        type=int,
+        help='Times a failed push is retried, with jittered exponential backoff. (default 5)',
+        default=5
+    )
+
+    parser.add_argument(
+        '--push.spool-dir',
+        metavar='dir',
+        dest='push_spool_dir',
+        required=False,
+        help='Keep the remote write batches that failed after all retries in this directory and send them '
+             'once the receiver is back, oldest first. (default none, they are dropped)'
+    )
+
+    parser.add_argument(
+        '--push.spool-bytes',
+        metavar='bytes',
+        dest='push_spool_bytes',
+        required=False,
+        type=int,
+        help='Size of --push.spool-dir above which the oldest batches are dropped. (default 268435456)',
+        default=256 * 1024 * 1024
+    )
+
+    parser.add_argument(
+        '--debug.port',
+        metavar='port',
+        dest='debug_port',
+        required=False,
+        type=int,
+        help='Serve /debug/profile/start|stop (cProfile) and /debug/memory (gc object census) on '
+             'this localhost port, 0 disables it. (default 0)',
+        default=0
+    )
+
+    for name in ('namenode', 'resourcemanager', 'resourcemanager_node', 'queue', 'application'):
+        parser.add_argument(
+            '--%s.poll-interval' % name.replace('_', '.'),
+            metavar='poll_interval',
+            dest='%s_poll_interval' % name,
+            required=False,
+            type=float,
+            help='Poll interval of the %s collector. (default --poll-interval)' % name
+        )
+    args = parser.parse_args()
+    if args.cluster is None and args.config_file is None:
+        parser.error('--cluster or --config.file is required')
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error('--shard-index must be within 0 and --shard-count - 1')
+    if args.json_backend != 'auto' and args.json_backend not in available_backends():
+        parser.error('json backend %s is not installed' % args.json_backend)
+    if any('=' not in label for label in args.push_labels):
+        parser.error('--push.label takes name=value')
+    if not all(bound.strip().isdigit() for bound in args.fsimage_buckets.split(',')):
+        parser.error('--fsimage.buckets takes comma separated sizes in bytes')
+    return args
+
+def add_cluster(settings, poller, live, served, shard=None, cardinality=None, derived=None, rules=None):
+    # With shard set this replica exports its share of the datanodes and
+    # nodemanagers, the cluster level collectors only run on the primary.
+    # With cardinality set every collector builds through its rules, with
+    # derived the series it derives from their values are added first.
+    # rules are the --jmx.rules of each jmx collector.
+    rules = rules or {}
+    limit = cardinality.limit if cardinality is not None else (lambda collector: collector)
+    derive = derived.wrap if derived is not None else (lambda collector: collector)
+    primary = shard is None or shard.primary
+    namenode = NameNodeCollector(settings.nnurl, settings.cluster, shard, rules.get('namenode'))
+    nodes = ResourceManagerNodeCollector(settings.rmurl, settings.cluster, shard)
+    collectors = [namenode, nodes]
+    if primary:
+        collectors.extend([
+            ResourceManagerCollector(settings.rmurl, settings.cluster),
+            YarnQueueCollector(settings.rmurl, settings.cluster),
+            YarnApplicationCollector(settings.rmurl, settings.cluster, settings.application_retention),
+        ])
+    for collector in map(limit, map(derive, collectors)):
+        interval = getattr(settings, '%s_poll_interval' % collector.name)
+        if interval is None:
+            interval = settings.poll_interval
+        if interval > 0:
+            poller.add(collector, interval, settings.cluster, settings.concurrency)
+        else:
+            live.append(collector)
+    # quotas are expensive for the namenode and always refreshed in the background
+    quota = HdfsQuotaCollector(settings.nnurl, settings.cluster, settings.quota_dirs, settings.quota_interval,
+                               settings.quota_user, max(settings.concurrency, 1))
+    if quota.globs and primary:
+        poller.add(quota, quota.interval, settings.cluster, settings.concurrency)
+        served.append(cardinality.limit(quota, served=True) if cardinality is not None else quota)
+    # reading the fsimage takes minutes on a large namespace, always in the background
+    if (settings.fsimage_delimited or settings.fsimage_fetch_dir) and primary:
+        fsimage = FsImageCollector(settings.nnurl, settings.cluster, settings.fsimage_depth, settings.fsimage_interval,
+                                   settings.fsimage_delimited, settings.fsimage_fetch_dir, settings.fsimage_oiv,
+                                   [int(bound) for bound in settings.fsimage_buckets.split(',') if bound])
+        poller.add(limit(fsimage), fsimage.tick, settings.cluster, settings.concurrency)
+    # thousands of hosts, only ever scraped in the background
+    if settings.host_jmx_interval > 0:
+        for kind, hosts in (('datanode', namenode.datanode_addresses),
+                            ('nodemanager', nodes.nodemanager_addresses)):
+            host_jmx = HostJmxCollector(kind, hosts, settings.cluster, settings.host_jmx_interval,
+                                        settings.host_jmx_workers, settings.host_jmx_timeout, rules.get(kind))
+            poller.add(limit(host_jmx), host_jmx.tick, settings.cluster, settings.concurrency)
+
 
 def main():
     try:
         args = parse_args()
+        if args.config_file:
+            clusters = cluster_settings(load_config(args.config_file), args)
+        else:
+            clusters = [args]
+
+        HA_STATES.ttl = args.ha_state_ttl
+        HTTP.connect_timeout = args.http_connect_timeout
+        HTTP.read_timeout = args.http_read_timeout
+        HTTP.max_bytes = args.http_max_bytes
+        HTTP.breaker.threshold = args.http_failure_threshold
+        HTTP.breaker.backoff = args.http_backoff
+        HTTP.breaker.max_backoff = args.http_max_backoff
+        DECODER.use(args.json_backend)
+        if args.json_processes > 0:
+            # forks, before any thread is started
+            DECODER.start_pool(args.json_processes, args.json_process_threshold)
+        # one connection pool per namenode / resourcemanager host
+        hosts = sum(len(settings.nnurl.split(';')) + len(settings.rmurl.split(';')) for settings in clusters)
+        HTTP.configure(max([settings.concurrency for settings in clusters] + [1]), max(hosts, 32))
+        REGISTRY.register(HTTP)
+        REGISTRY.register(SELF_METRICS)
+
+        # All clusters share one poller and one process, their families are
+        # merged so every metric name is exported once.
+        live = []
+        served = []
+        poller = Poller(args.concurrency)
+        shard = Shard(args.shard_index, args.shard_count) if args.shard_count > 1 else None
+        cardinality = Cardinality(load_config(args.cardinality_file) if args.cardinality_file else None,
+                                  args.cardinality_max_series)
+        derived = None
+        if args.derived or args.derived_file:
+            derived = Derived(load_config(args.derived_file) if args.derived_file else None, args.derived_samples)
+        rules = load_rules(load_config(args.jmx_rules) if args.jmx_rules else None)
+        for settings in clusters:
+            add_cluster(settings, poller, live, served, shard, cardinality, derived, rules)
 
-        REGISTRY.register(NameNodeCollector(args.nnurl, args.cluster))
-        REGISTRY.register(ResourceManagerCollector(args.rmurl, args.cluster))
-        REGISTRY.register(ResourceManagerNodeCollector(args.rmurl, args.cluster))
-        REGISTRY.register(YarnQueueCollector(args.rmurl, args.cluster))
+        # a deadline needs the jobs on threads it does not wait for
+        if live and (args.concurrency > 1 or args.scrape_deadline > 0):
+            served.append(ConcurrentCollector(live, max(args.concurrency, 1), args.scrape_deadline))
+        else:
+            served.extend(live)
+        if len(poller):
+            served.append(poller)
+            poller.start()
+        REGISTRY.register(MergedCollector(served))
 
         port = int(args.port)
-        start_http_server(port)
-        print "Polling %s. Serving at port: %s" % (args.nnurl, port)
-        print "Polling %s. Serving at port: %s" % (args.rmurl, port)
+        # Between refreshes the snapshots do not change, the payload is only
+        # collected again when a refresh finished or it is older than the
+        # cache seconds (ages, http and self metrics).
+        httpd = start_exposition_server(port, args.telemetry_path, REGISTRY, max_age=args.web_cache_seconds,
+                                        generation=lambda: poller.generation, ready=poller.ready,
+                                        threads=args.web_threads)
+        if args.push_url or args.push_gateway:
+            # pushes what a scrape gets, from the same collection
+            spool = Spool(args.push_spool_dir, args.push_spool_bytes) if args.push_spool_dir else None
+            pusher = Pusher(httpd.exposition, args.push_url, args.push_gateway, args.push_job,
+                            dict(label.split('=', 1) for label in args.push_labels), args.push_interval,
+                            args.push_changed_only, args.push_resend_after, args.push_batch_size,
+                            args.push_retries, args.http_read_timeout, spool)
+            REGISTRY.register(pusher)
+            pusher.start()
+        if args.debug_port:
+            start_debug_server(args.debug_port)
+        for settings in clusters:
+            print "Polling %s. Serving at port: %s" % (settings.nnurl, port)
+            print "Polling %s. Serving at port: %s" % (settings.rmurl, port)
         while True:
-            os.system('bash quota_count.sh')
-            time.sleep(3600)
+            time.sleep(1)
     except KeyboardInterrupt:
         print(" Interrupted")
         exit(0)
@@ -0,0 +1,640 @@
+#!/usr/bin/python
+
+import argparse
+import fnmatch
+import gzip
+import json
+import os
+import random
+import struct
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from StringIO import StringIO
+
+from push_exporter import STALE_MARKER, decode_write_request
+from snappy_codec import decompress
+
+
+def namenode_beans(datanodes, filler_beans=0, dead_datanodes=0, state='active', info_addr=None):
+    # A /jmx dump shaped like the one of a big namenode: the beans the exporter
+    # reads plus the jvm, rpc and metrics system beans it does not care about.
+    # With info_addr set every datanode says its http server is there.
+    live_nodes = {}
+    for i in range(datanodes):
+        live_nodes['dn%05d.example.com:50010' % i] = {
+            "infoAddr": info_addr or "10.%d.%d.%d:50075" % (i >> 16, (i >> 8) & 255, i & 255),
+            "infoSecureAddr": "10.%d.%d.%d:0" % (i >> 16, (i >> 8) & 255, i & 255),
+            "xferaddr": "10.%d.%d.%d:50010" % (i >> 16, (i >> 8) & 255, i & 255),
+            "lastContact": i % 3,
+            "usedSpace": 4000000000000 + i,
+            "adminState": "In Service",
+            "nonDfsUsedSpace": 120000000000,
+            "capacity": 48000000000000,
+            "numBlocks": 350000 + i,
+            "version": "2.8.3",
+            "used": 4000000000000 + i,
+            "remaining": 43880000000000,
+            "blockScheduled": 0,
+            "blockPoolUsed": 4000000000000 + i,
+            "blockPoolUsedPercent": 8.33,
+            "volfails": 0,
+        }
+    dead_nodes = {}
+    for i in range(datanodes, datanodes + dead_datanodes):
+        dead_nodes['dn%05d.example.com:50010' % i] = {
+            "lastContact": 86400 + i,
+            "decommissioned": False,
+            "xferaddr": "10.%d.%d.%d:50010" % (i >> 16, (i >> 8) & 255, i & 255),
+        }
+
+    beans = [
+        {"name": "Hadoop:service=NameNode,name=FSNamesystemState",
+         "CapacityTotal": 48000000000000 * datanodes, "CapacityUsed": 4000000000000 * datanodes,
+         "CapacityRemaining": 43880000000000 * datanodes, "TotalLoad": 3 * datanodes,
+         "BlocksTotal": 350000 * datanodes / 3, "FilesTotal": 300000 * datanodes / 3,
+         "PendingReplicationBlocks": 0, "UnderReplicatedBlocks": 12, "ScheduledReplicationBlocks": 0,
+         "NumLiveDataNodes": datanodes, "NumDeadDataNodes": dead_datanodes, "FSState": "Operational"},
+        {"name": "Hadoop:service=NameNode,name=FSNamesystem",
+         "MissingBlocks": 0, "CapacityUsedNonDFS": 120000000000 * datanodes, "CorruptBlocks": 0,
+         "PendingDeletionBlocks": 0, "ExcessBlocks": 0, "PostponedMisreplicatedBlocks": 0,
+         "PendingDataNodeMessageCount": 0, "BlockCapacity": 67108864, "StaleDataNodes": 0},
+        {"name": "Hadoop:service=NameNode,name=NameNodeInfo",
+         "LiveNodes": json.dumps(live_nodes), "DeadNodes": json.dumps(dead_nodes), "DecomNodes": "{}"},
+        {"name": "Hadoop:service=NameNode,name=NameNodeStatus",
+         "State": state, "HostAndPort": "nn.example.com:8020"},
+        {"name": "java.lang:type=Runtime",
+         "ClassPath": ":".join("/usr/lib/hadoop/lib/jar-%04d.jar" % i for i in range(400)),
+         "SystemProperties": [{"key": "prop.%d" % i, "value": "x" * 64} for i in range(200)]},
+    ]
+    for i in range(filler_beans):
+        bean = {"name": "Hadoop:service=NameNode,name=RpcDetailedActivityForPort%d" % i}
+        for j in range(60):
+            bean["Method%dNumOps" % j] = i * j
+            bean["Method%dAvgTime" % j] = 0.25
+        beans.append(bean)
+    return beans
+
+
+def host_beans():
+    # The beans of a datanode and a nodemanager that the host jmx collectors read
+    return [
+        {"name": "Hadoop:service=DataNode,name=FSDatasetState-DS-1234",
+         "NumFailedVolumes": 0, "Capacity": 48000000000000, "DfsUsed": 4000000000000,
+         "Remaining": 43880000000000, "StorageInfo": "FSDataset{dirpath='[/data/1, /data/2]'}"},
+        {"name": "Hadoop:service=DataNode,name=DataNodeActivity-dn.example.com-50010",
+         "VolumeFailures": 0, "DataNodeActiveXceiversCount": 12, "BlockReportsNumOps": 40,
+         "BlockReportsAvgTime": 250.5, "HeartbeatsNumOps": 86400, "HeartbeatsAvgTime": 1.5,
+         "BytesRead": 10 ** 12, "BytesWritten": 2 * 10 ** 12},
+        {"name": "Hadoop:service=DataNode,name=DataNodeInfo", "XceiverCount": 14,
+         "VolumeInfo": json.dumps({"/data/%d" % i: {"freeSpace": 10 ** 12} for i in range(12)})},
+        {"name": "Hadoop:service=NodeManager,name=NodeManagerMetrics",
+         "ContainerLaunchDurationNumOps": 5000, "ContainerLaunchDurationAvgTime": 320.0,
+         "ContainersLaunched": 5000, "ContainersCompleted": 4900, "ContainersFailed": 40,
+         "ContainersKilled": 30, "ContainersRunning": 30, "AllocatedGB": 30, "AvailableGB": 66,
+         "AllocatedVCores": 30, "AvailableVCores": 18, "BadLocalDirs": 0, "BadLogDirs": 0},
+    ]
+
+
+def fsimage_lines(entries, seed=0):
+    # `hdfs oiv -p Delimited` lines of a namespace of about entries files and
+    # dirs: home dirs with quotas under /user, data sets under /data and
+    # /apps, short lived files in /tmp. Files come in runs per dir, as inodes
+    # created together do, sizes spread from empty to tens of GB.
+    rng = random.Random(seed)
+    yield '\t'.join(('Path', 'Replication', 'ModificationTime', 'AccessTime', 'PreferredBlockSize',
+                     'BlocksCount', 'FileSize', 'NSQUOTA', 'DSQUOTA', 'Permission', 'UserName', 'GroupName'))
+
+    def entry(path, is_dir, size=0, replication=3, ns_quota=-1, ds_quota=-1):
+        blocks = (size + (128 << 20) - 1) >> 27
+        return '\t'.join((path, '0' if is_dir else str(replication), '2017-01-01 00:00', '1970-01-01 00:00' if is_dir
+                          else '2017-01-02 00:00', '0' if is_dir else str(128 << 20), str(blocks), str(size),
+                          str(ns_quota), str(ds_quota), 'drwxr-xr-x' if is_dir else '-rw-r--r--', 'hdfs', 'hadoop'))
+
+    yield entry('/', True, ns_quota=2 ** 63 - 1)
+    dirs = []
+    for top in ('/user', '/data', '/apps', '/tmp'):
+        yield entry(top, True)
+        dirs.append(top)
+    for i in range(max(entries / 5000, 4)):
+        home = '/user/u%05d' % i
+        yield entry(home, True, ns_quota=100000, ds_quota=10 << 40)
+        dirs.append(home)
+    count = len(dirs) + 1
+    current = rng.choice(dirs)
+    while count < entries:
+        roll = rng.random()
+        if roll < 0.02:
+            current = rng.choice(dirs)
+            continue
+        count += 1
+        if roll < 0.07 and current.count('/') < 8:
+            current = '%s/d%d' % (current, count)
+            dirs.append(current)
+            yield entry(current, True)
+            continue
+        size = 0 if roll > 0.97 else min(int(rng.lognormvariate(15, 3)), 50 << 30)
+        yield entry('%s/f%d' % (current, count), False, size, 1 if current.startswith('/tmp') else 3)
+
+
+def resourcemanager_nodes(nodes, http_addr=None):
+    return [{
+        "rack": "/rack%d" % (i / 40),
+        "state": "RUNNING",
+        "id": "nm%05d.example.com:45454" % i,
+        "nodeHostName": "nm%05d.example.com" % i,
+        "nodeHTTPAddress": http_addr or "nm%05d.example.com:8042" % i,
+        "lastHealthUpdate": 1500000000000 + i,
+        "version": "2.8.3",
+        "healthReport": "",
+        "numContainers": i % 30,
+        "usedMemoryMB": 1024 * (i % 30),
+        "availMemoryMB": 1024 * (96 - i % 30),
+        "usedVirtualCores": i % 30,
+        "availableVirtualCores": 48 - i % 30,
+    } for i in range(nodes)]
+
+
+def cluster_metrics(nodes, finished=0):
+    # finished apps since the stand-in started count as submitted and completed
+    return {"clusterMetrics": {
+        "appsSubmitted": 120000 + finished, "appsCompleted": 119000 + finished, "appsPending": 12,
+        "appsRunning": 300,
+        "appsFailed": 400, "appsKilled": 288, "reservedMB": 0, "availableMB": 1024 * 66 * nodes,
+        "allocatedMB": 1024 * 30 * nodes, "reservedVirtualCores": 0, "availableVirtualCores": 33 * nodes,
+        "allocatedVirtualCores": 15 * nodes, "containersAllocated": 15 * nodes, "containersReserved": 0,
+        "containersPending": 40, "totalMB": 1024 * 96 * nodes, "totalVirtualCores": 48 * nodes,
+        "totalNodes": nodes, "lostNodes": 0, "unhealthyNodes": 0, "decommissionedNodes": 0,
+        "rebootedNodes": 0, "activeNodes": nodes,
+    }}
+
+
+def cluster_info(state='active'):
+    return {"clusterInfo": {"id": 1500000000000, "state": "STARTED", "haState": state.upper(),
+                            "resourceManagerVersion": "2.8.3", "hadoopVersion": "2.8.3"}}
+
+
+def fair_scheduler(depth, width):
+    # root with width children per queue, depth levels below root
+    def resources(seed):
+        return {"memory": 1024 * seed, "vCores": seed}
+
+    def queue(name, level, index):
+        info = {
+            "queueName": name,
+            "schedulingPolicy": "fair",
+            "minResources": resources(0),
+            "maxResources": resources(100000),
+            "usedResources": resources(level + index),
+            "demandResources": resources(2 * (level + index)),
+            "steadyFairResources": resources(10 * level),
+            "fairResources": resources(10 * level + index),
+            "clusterResources": resources(100000),
+            "allocatedContainers": level + index,
+            "reservedContainers": 0,
+            "numActiveApps": index,
+            "numPendingApps": level,
+            "preemptable": True,
+        }
+        if level < depth:
+            info["childQueues"] = {"queue": [queue("%s.q%d" % (name, i), level + 1, i) for i in range(width)]}
+        else:
+            info["type"] = "fairSchedulerLeafQueueInfo"
+        return info
+
+    return {"scheduler": {"schedulerInfo": {"type": "fairScheduler", "rootQueue": queue("root", 0, 0)}}}
+
+
+def capacity_scheduler(depth, width):
+    # Same tree as fair_scheduler, in the capacity scheduler layout: short
+    # queue names, children under "queues" and the root queue as schedulerInfo
+    def resources(seed):
+        return {"memory": 1024 * seed, "vCores": seed}
+
+    def queue(name, level, index):
+        info = {
+            "queueName": name,
+            "state": "RUNNING",
+            "capacity": 100.0 / width if level else 100.0,
+            "usedCapacity": 10.0 * index,
+            "maxCapacity": 100.0,
+            "absoluteCapacity": 100.0 / width ** level,
+            "absoluteUsedCapacity": 10.0 * index / width ** level,
+            "absoluteMaxCapacity": 100.0,
+            "numApplications": level + index,
+            "usedResources": "<memory:%d, vCores:%d>" % (1024 * (level + index), level + index),
+            "resourcesUsed": resources(level + index),
+        }
+        if level < depth:
+            info["queues"] = {"queue": [queue("q%d" % i, level + 1, i) for i in range(width)]}
+        else:
+            info.update({
+                "type": "capacitySchedulerLeafQueueInfo",
+                "numActiveApplications": index,
+                "numPendingApplications": level,
+                "numContainers": level + index,
+                "maxApplications": 10000,
+                "usedAMResource": resources(index),
+                "AMResourceLimit": resources(100),
+            })
+        return info
+
+    root = queue("root", 0, 0)
+    root["type"] = "capacityScheduler"
+    return {"scheduler": {"schedulerInfo": root}}
+
+
+def applications(running, finish_rate, started, query, now=None):
+    # /ws/v1/cluster/apps of running apps spread over 8 queues and 20 users,
+    # plus finish_rate apps a second finished since started (ms), filtered
+    # by states and finishedTimeBegin like the resourcemanager does
+    if now is None:
+        now = int(time.time() * 1000)
+    states = set(query['states'][0].upper().split(',')) if 'states' in query else None
+    begin = int(query.get('finishedTimeBegin', ['0'])[0])
+
+    apps = []
+    for i in range(running):
+        state = 'ACCEPTED' if i % 10 == 9 else 'RUNNING'
+        if states is None or state in states:
+            apps.append({
+                "id": "application_1500000000000_%06d" % i, "user": "user%d" % (i % 20),
+                "queue": "q%d" % (i % 8), "state": state, "finalStatus": "UNDEFINED",
+                "startedTime": now - 60000 * (i % 30), "finishedTime": 0, "elapsedTime": 60000 * (i % 30),
+                "allocatedMB": 2048 * (i % 5 + 1) if state == 'RUNNING' else -1,
+                "allocatedVCores": i % 5 + 1 if state == 'RUNNING' else -1,
+                "runningContainers": i % 5 + 1 if state == 'RUNNING' else -1,
+            })
+
+    if finish_rate > 0:
+        first = max(0, -(-(begin - started) * finish_rate // 1000))
+        last = int((now - started) * finish_rate // 1000)
+        for k in range(int(first), last + 1):
+            finished = started + int(k * 1000 / finish_rate)
+            final = 'FAILED' if k % 20 == 0 else 'KILLED' if k % 33 == 0 else 'SUCCEEDED'
+            state = 'FINISHED' if final == 'SUCCEEDED' else final
+            if finished < begin or (states is not None and state not in states):
+                continue
+            elapsed = 1000 * (60 * (k % 90) + 5)
+            apps.append({
+                "id": "application_1500000000001_%06d" % k, "user": "user%d" % (k % 20),
+                "queue": "q%d" % (k % 8), "state": state, "finalStatus": final,
+                "startedTime": finished - elapsed, "finishedTime": finished, "elapsedTime": elapsed,
+                "allocatedMB": -1, "allocatedVCores": -1, "runningContainers": -1,
+                "memorySeconds": 2048 * elapsed / 1000, "vcoreSeconds": elapsed / 1000,
+            })
+    return {"apps": {"app": apps} if apps else None}
+
+
+class StandIn(object):
+    # A local stand-in for a namenode and resourcemanager, serving generated
+    # /jmx (honouring ?qry= like JMXJsonServlet), /ws/v1/cluster/metrics,
+    # nodes, scheduler (fair or capacity), apps and info, and with host_jmx
+    # the /jmx of every datanode and nodemanager. Requests are delayed by
+    # latency seconds and answered with a 500 for failure_rate of them, or
+    # with a dropped connection for drop_rate. With record set to an upstream url the
+    # requests are proxied to it and every body is saved in directory, with
+    # replay set the saved bodies are served instead of generated ones.
+
+    def __init__(self, nodes=1000, queue_depth=2, queue_width=4, filler_beans=0, dead_nodes=0,
+                 state='active', latency=0, failure_rate=0, drop_rate=0, record=None, replay=None,
+                 directory=None, keep_bodies=False, scheduler='fair', apps=0, finish_rate=0, host_jmx=False):
+        self.nodes = nodes
+        self.queue_depth = queue_depth
+        self.queue_width = queue_width
+        self.scheduler = scheduler
+        self.apps = apps
+        self.finish_rate = finish_rate
+        self.host_jmx = host_jmx
+        self._started = int(time.time() * 1000)
+        self.filler_beans = filler_beans
+        self.dead_nodes = dead_nodes
+        self.state = state
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.record = record.rstrip('/') if record else None
+        self.directory = replay or directory
+        self.replay = replay is not None
+        # bodies sent, for benchmarks counting bytes
+        self.keep_bodies = keep_bodies
+        self.bodies = []
+        self.requests = 0
+        self._beans = None
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self._httpd = None
+
+    def start(self, port=0, addr='127.0.0.1'):
+        standin = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body leave in one write, not one packet per header
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                standin._handle(self)
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._httpd = Server((addr, port), Handler)
+        self.url = 'http://%s:%d' % (addr, self._httpd.server_address[1])
+        thread = threading.Thread(target=self._httpd.serve_forever, name='standin')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def take_bodies(self):
+        with self._lock:
+            bodies, self.bodies = self.bodies, []
+        return bodies
+
+    def _handle(self, handler):
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+        if self.latency:
+            time.sleep(self.latency)
+        if roll < self.drop_rate:
+            handler.close_connection = 1
+            return
+        if roll < self.drop_rate + self.failure_rate:
+            self._send(handler, 500, 'injected failure\n', 'text/plain')
+            return
+
+        if self.record:
+            code, body = self._proxy(handler.path)
+        elif self.replay:
+            code, body = self._load(handler.path)
+        else:
+            code, body = self._generate(handler.path)
+        self._send(handler, code, body, 'application/json')
+
+    def _send(self, handler, code, body, content_type):
+        if self.keep_bodies and code == 200:
+            with self._lock:
+                self.bodies.append(body)
+        if 'gzip' in handler.headers.get('Accept-Encoding', ''):
+            out = StringIO()
+            f = gzip.GzipFile(fileobj=out, mode='w', compresslevel=1)
+            f.write(body)
+            f.close()
+            body = out.getvalue()
+            handler.send_response(code)
+            handler.send_header('Content-Encoding', 'gzip')
+        else:
+            handler.send_response(code)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _generate(self, path):
+        url = urlparse.urlsplit(path)
+        query = urlparse.parse_qs(url.query)
+        if url.path == '/ws/v1/cluster/apps':
+            # finished apps depend on the time of the request
+            return 200, json.dumps(applications(self.apps, self.finish_rate, self._started, query))
+        if url.path == '/ws/v1/cluster/metrics' and self.finish_rate:
+            finished = int(self.finish_rate * (time.time() * 1000 - self._started) / 1000)
+            return 200, json.dumps(cluster_metrics(self.nodes, finished))
+        # other bodies are generated once per path and query
+        body = self._cache.get(path)
+        if body is not None:
+            return 200, body
+        if url.path == '/jmx':
+            if self._beans is None:
+                self._beans = namenode_beans(self.nodes, self.filler_beans, self.dead_nodes, self.state,
+                                             self._host_addr())
+                if self.host_jmx:
+                    self._beans.extend(host_beans())
+            beans = self._beans
+            if 'qry' in query:
+                # object name patterns like Hadoop:service=DataNode,name=*
+                beans = [bean for bean in beans if fnmatch.fnmatchcase(bean['name'], query['qry'][0])]
+            result = {"beans": beans}
+        elif url.path == '/ws/v1/cluster/metrics':
+            result = cluster_metrics(self.nodes)
+        elif url.path == '/ws/v1/cluster/nodes':
+            result = {"nodes": {"node": resourcemanager_nodes(self.nodes, self._host_addr())}}
+        elif url.path == '/ws/v1/cluster/scheduler':
+            if self.scheduler == 'capacity':
+                result = capacity_scheduler(self.queue_depth, self.queue_width)
+            else:
+                result = fair_scheduler(self.queue_depth, self.queue_width)
+        elif url.path == '/ws/v1/cluster/info':
+            result = cluster_info(self.state)
+        else:
+            return 404, '{}'
+        body = json.dumps(result)
+        self._cache[path] = body
+        return 200, body
+
+    def _host_addr(self):
+        # with host_jmx the datanodes and nodemanagers are served here too
+        return urlparse.urlsplit(self.url).netloc if self.host_jmx else None
+
+    def _file(self, path):
+        return os.path.join(self.directory, urllib.quote(path, safe='') + '.json')
+
+    def _proxy(self, path):
+        try:
+            response = urllib2.urlopen(self.record + path, timeout=60)
+            code, body = response.getcode(), response.read()
+        except urllib2.HTTPError as e:
+            code, body = e.code, e.read()
+        if code == 200:
+            with open(self._file(path), 'w') as f:
+                f.write(body)
+        return code, body
+
+    def _load(self, path):
+        try:
+            with open(self._file(path)) as f:
+                return 200, f.read()
+        except IOError:
+            return 404, '{}'
+
+
+class Receiver(object):
+    # A stand-in remote write receiver and Pushgateway: POST /api/v1/write
+    # takes snappy compressed WriteRequests, PUT / POST /metrics/job/... text
+    # pushes. It keeps the last value of every series and answers GET
+    # /series with what it got so far. failure_rate of the pushes are
+    # answered with a 503, to see them retried.
+
+    def __init__(self, failure_rate=0):
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failed = 0
+        self.samples = 0
+        self.stale = 0
+        self.bytes = 0
+        self.gateway_pushes = 0
+        self.series = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self._httpd = None
+
+    def start(self, port=0, addr='127.0.0.1'):
+        receiver = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with receiver._lock:
+                    body = json.dumps({"requests": receiver.requests, "failed": receiver.failed,
+                                       "series": len(receiver.series), "samples": receiver.samples,
+                                       "stale": receiver.stale, "bytes": receiver.bytes,
+                                       "gateway_pushes": receiver.gateway_pushes})
+                receiver._answer(self, 200, body)
+
+            def do_POST(self):
+                receiver._push(self)
+
+            do_PUT = do_POST
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._httpd = Server((addr, port), Handler)
+        self.url = 'http://%s:%d' % (addr, self._httpd.server_address[1])
+        thread = threading.Thread(target=self._httpd.serve_forever, name='receiver')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _push(self, handler):
+        body = handler.rfile.read(int(handler.headers.get('Content-Length', 0)))
+        with self._lock:
+            self.requests += 1
+            if self._random.random() < self.failure_rate:
+                self.failed += 1
+                return self._answer(handler, 503, 'injected failure\n')
+        if handler.path.startswith('/metrics/job/'):
+            with self._lock:
+                self.gateway_pushes += 1
+                self.samples += sum(1 for line in body.splitlines() if line and not line.startswith('#'))
+            return self._answer(handler, 202, '')
+        if handler.path != '/api/v1/write':
+            return self._answer(handler, 404, 'not found\n')
+        try:
+            series = decode_write_request(decompress(body))
+        except (ValueError, IndexError, struct.error) as e:
+            return self._answer(handler, 400, 'bad write request: %s\n' % e)
+        with self._lock:
+            self.bytes += len(body)
+            for labels, samples in series:
+                key = tuple(sorted(labels.items()))
+                for value, timestamp in samples:
+                    self.samples += 1
+                    if struct.pack('<d', value) == STALE_MARKER:
+                        self.stale += 1
+                        self.series.pop(key, None)
+                    else:
+                        self.series[key] = value
+        self._answer(handler, 204, '')
+
+    def _answer(self, handler, code, body):
+        handler.send_response(code)
+        handler.send_header('Content-Type', 'application/json' if code == 200 else 'text/plain')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='stand-in for the namenode and resourcemanager REST APIs, with generated, recorded or '
+                    'replayed responses'
+    )
+    parser.add_argument('-p', '--port', type=int, default=18088, help='Listen to this port. (default 18088)')
+    parser.add_argument('--nodes', type=int, default=1000,
+                        help='Datanodes and nodemanagers of the generated cluster. (default 1000)')
+    parser.add_argument('--dead-nodes', dest='dead_nodes', type=int, default=0,
+                        help='Dead datanodes besides the live ones. (default 0)')
+    parser.add_argument('--filler-beans', dest='filler_beans', type=int, default=0,
+                        help='/jmx beans the exporter does not read. (default 0)')
+    parser.add_argument('--queue-depth', dest='queue_depth', type=int, default=2,
+                        help='Levels of queues below root. (default 2)')
+    parser.add_argument('--queue-width', dest='queue_width', type=int, default=4,
+                        help='Child queues of every parent queue. (default 4)')
+    parser.add_argument('--scheduler', choices=('fair', 'capacity'), default='fair',
+                        help='Scheduler whose queues are served. (default fair)')
+    parser.add_argument('--apps', type=int, default=0, help='Running applications. (default 0)')
+    parser.add_argument('--finish-rate', dest='finish_rate', type=float, default=0,
+                        help='Applications finishing per second. (default 0)')
+    parser.add_argument('--host-jmx', dest='host_jmx', action='store_true',
+                        help='Point every datanode and nodemanager at the stand-in, which serves their /jmx too.')
+    parser.add_argument('--state', choices=('active', 'standby'), default='active',
+                        help='HA state reported. (default active)')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds every request is delayed. (default 0)')
+    parser.add_argument('--failure-rate', dest='failure_rate', type=float, default=0,
+                        help='Share of requests answered with a 500. (default 0)')
+    parser.add_argument('--drop-rate', dest='drop_rate', type=float, default=0,
+                        help='Share of requests whose connection is closed without an answer. (default 0)')
+    parser.add_argument('--record', metavar='url',
+                        help='Proxy every request to this namenode / resourcemanager and save the bodies '
+                             'in --dir.')
+    parser.add_argument('--replay', metavar='dir', help='Serve the bodies saved by --record from dir.')
+    parser.add_argument('--dir', dest='directory', default='recorded',
+                        help='Where --record saves bodies. (default "recorded")')
+    parser.add_argument('--receiver', action='store_true',
+                        help='Stand in for a remote write receiver and Pushgateway instead, for --push.url '
+                             '(/api/v1/write) and --push.gateway of the exporter. --failure-rate applies.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.receiver:
+        receiver = Receiver(args.failure_rate).start(args.port, '0.0.0.0')
+        print "Receiving pushes at %s" % receiver.url
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print(" Interrupted")
+        return
+    if args.record and not os.path.isdir(args.directory):
+        os.makedirs(args.directory)
+    standin = StandIn(args.nodes, args.queue_depth, args.queue_width, args.filler_beans, args.dead_nodes,
+                      args.state, args.latency, args.failure_rate, args.drop_rate, args.record, args.replay,
+                      args.directory, scheduler=args.scheduler, apps=args.apps, finish_rate=args.finish_rate,
+                      host_jmx=args.host_jmx)
+    standin.start(args.port, '0.0.0.0')
+    print "Serving a stand-in hadoop at %s" % standin.url
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(" Interrupted")
+
+
+if __name__ == "__main__":
+    main()
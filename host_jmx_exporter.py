@@ -0,0 +1,167 @@
+#!/usr/bin/python
+
+import fnmatch
+import time
+import zlib
+from functools import partial
+from multiprocessing.pool import ThreadPool
+
+from prometheus_client.core import GaugeMetricFamily
+
+from http_client import HTTP
+from metric_descriptors import add_sample
+from metric_rules import RuleSet
+
+# The attributes read from the /jmx of every host, rules in the style of
+# jmx_exporter (see metric_rules.py) that --jmx.rules extends. Bean names go
+# on after a '-' (DataNodeActivity-<host>-<port>, FSDatasetState-<storage id>).
+DATANODE_RULES = [
+    {"bean": "Hadoop:service=DataNode,name=FSDatasetState*", "attributes": {
+        "NumFailedVolumes": "Failed volumes of the datanode",
+        "Capacity": "Capacity of the datanode volumes in bytes",
+        "DfsUsed": "Bytes used by HDFS on the datanode",
+        "Remaining": "Bytes left for HDFS on the datanode",
+    }},
+    {"bean": "Hadoop:service=DataNode,name=DataNodeActivity*", "attributes": {
+        "VolumeFailures": "Volume failures since the datanode started",
+        "DataNodeActiveXceiversCount": "Data transfer threads (xceivers) busy on the datanode",
+        "BlockReportsNumOps": "Block reports sent to the namenode",
+        "BlockReportsAvgTime": "Average time of a block report to the namenode in ms",
+        "HeartbeatsNumOps": "Heartbeats sent to the namenode",
+        "HeartbeatsAvgTime": "Average time of a heartbeat to the namenode in ms",
+        "BytesRead": "Bytes read from the datanode",
+        "BytesWritten": "Bytes written to the datanode",
+    }},
+    {"bean": "Hadoop:service=DataNode,name=DataNodeInfo", "attributes": {
+        "XceiverCount": "Data transfer threads (xceivers) of the datanode",
+    }},
+]
+
+NODEMANAGER_RULES = [
+    {"bean": "Hadoop:service=NodeManager,name=NodeManagerMetrics", "attributes": {
+        "ContainerLaunchDurationNumOps": "Containers whose launch was timed",
+        "ContainerLaunchDurationAvgTime": "Average time to launch a container in ms",
+        "ContainersLaunched": "Containers launched on the nodemanager",
+        "ContainersCompleted": "Containers that completed on the nodemanager",
+        "ContainersFailed": "Containers that failed on the nodemanager",
+        "ContainersKilled": "Containers killed on the nodemanager",
+        "ContainersRunning": "Containers running on the nodemanager",
+        "AllocatedGB": "Memory allocated to containers in GB",
+        "AvailableGB": "Memory left for containers in GB",
+        "AllocatedVCores": "Virtual cores allocated to containers",
+        "AvailableVCores": "Virtual cores left for containers",
+        "BadLocalDirs": "Local dirs of the nodemanager that failed",
+        "BadLogDirs": "Log dirs of the nodemanager that failed",
+    }},
+]
+
+# kind -> (rules, ?qry= asking for all beans the rules may read in one request)
+KINDS = {
+    'datanode': (DATANODE_RULES, 'Hadoop:service=DataNode,name=*'),
+    'nodemanager': (NODEMANAGER_RULES, 'Hadoop:service=NodeManager,name=*'),
+}
+
+
+class HostJmxCollector(object):
+    # Scrapes the /jmx of every datanode or nodemanager the namenode /
+    # resourcemanager collector listed last. Each host is scraped once per
+    # interval at its own offset within it, so the requests are spread over
+    # the interval instead of going to thousands of hosts at once, at most
+    # workers of them in flight, each with its own timeout. Only run by the
+    # poller, scrapes are served the snapshot and never wait on the hosts.
+
+    def __init__(self, kind, hosts, cluster, interval=60, workers=32, timeout=5, rules=None):
+        # hosts returns {host: host:port of its http server}, rules extends
+        # the default ones of kind
+        self.name = kind + '_jmx'
+        self._cluster = cluster
+        self._hosts = hosts
+        self._interval = interval
+        self._timeout = timeout
+        self._prefix = 'hadoop_{0}_jmx_'.format(kind)
+        default_rules, self._query = KINDS[kind]
+        self._rules = RuleSet(list(rules or ()) + default_rules, self._prefix, ["cluster", "host"])
+        queries = self._rules.queries
+        if len(queries) == 1:
+            # the rules read a single bean, the request asks for it alone
+            self._query = queries[0]
+        elif not all(fnmatch.fnmatchcase(query, self._query) for query in queries):
+            # beans of other domains, e.g. java.lang, are only in the whole dump
+            self._query = None
+        self._pool = ThreadPool(workers)
+        # thousands of hosts are counted as one endpoint by the http client
+        self._endpoint = kind + ':/jmx'
+        # host -> (labels, values() of the beans of its last scrape or None when it failed)
+        self._values = {}
+        # host -> unix time its next scrape is due
+        self._due = {}
+
+    @property
+    def tick(self):
+        # how often the poller should look for hosts that are due
+        return max(self._interval / 20.0, 1)
+
+    def fetch_jobs(self):
+        now = time.time()
+        hosts = self._hosts()
+        due = []
+        for host, address in hosts.iteritems():
+            at = self._due.get(host)
+            if at is None:
+                at = self._due[host] = now + self._offset(host)
+            if at <= now:
+                due.append((host, address))
+        # hosts that left the list are forgotten
+        for host in self._due.keys():
+            if host not in hosts:
+                del self._due[host]
+                self._values.pop(host, None)
+        if not due:
+            return []
+        return [(self.name, partial(self._scrape_hosts, due))]
+
+    def build_metrics(self, results):
+        now = time.time()
+        for host, values in results.get(self.name, ()):
+            at = self._due.get(host)
+            if at is None:
+                continue
+            # the next scrape keeps the offset of the host
+            while at <= now:
+                at += self._interval
+            self._due[host] = at
+            labels = self._values[host][0] if host in self._values else {"cluster": self._cluster, "host": host}
+            self._values[host] = (labels, values)
+
+        metrics = self._rules.families()
+        up = GaugeMetricFamily(self._prefix + 'up', 'Whether the last jmx scrape of the host worked. 1:up, 0:down',
+                               labels=["cluster", "host"])
+        for labels, values in self._values.itervalues():
+            add_sample(up, labels, 0 if values is None else 1)
+            if values:
+                self._rules.add_samples(metrics, labels, values)
+
+        for metric in self._rules.emit(metrics):
+            yield metric
+        yield up
+
+    def describe(self):
+        return []
+
+    def _offset(self, host):
+        # the same host always gets the same offset, spread over the interval
+        return (zlib.crc32(host) & 0xffffffff) % 1000 / 1000.0 * self._interval
+
+    def _scrape_hosts(self, due):
+        values = self._pool.map(self._scrape, [address for host, address in due])
+        return zip([host for host, address in due], values)
+
+    def _scrape(self, address):
+        result = HTTP.get_json('http://{0}/jmx'.format(address), {'qry': self._query} if self._query else None,
+                               (self._timeout, self._timeout), self._endpoint)
+        if result is None:
+            return None
+        values = []
+        for bean in result.get('beans', ()):
+            values.extend(self._rules.values(bean))
+        return values
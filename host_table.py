@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+from metric_descriptors import add_sample
+
+
+class HostRecord(object):
+    __slots__ = ('label_values', 'labels', 'values', 'seen', 'address')
+
+    def __init__(self, labelnames, label_values, size):
+        self.label_values = label_values
+        self.labels = dict(zip(labelnames, label_values))
+        self.values = [None] * size
+        self.seen = 0
+        # host:port of the http server of the host, if it is up
+        self.address = None
+
+
+class HostTable(object):
+    # The datanodes / nodemanagers of one namenode / resourcemanager, kept
+    # between refreshes. A refresh only overwrites the values of the hosts it
+    # sees, the labels dict of a host is built once and replaced only when a
+    # label (e.g. the version) changes. Hosts missing from a complete refresh
+    # are dropped and counted as disappeared, new ones as appeared.
+
+    def __init__(self, labelnames, statuses, converters=None):
+        # converters maps a status to the function turning its field into a
+        # sample value, e.g. a node state name into its number
+        converters = converters or {}
+        statuses = tuple(statuses)
+        self._labelnames = labelnames
+        self._size = len(statuses)
+        self._plain = tuple((i, status) for i, status in enumerate(statuses) if status not in converters)
+        self._converted = tuple((i, status, converters[status]) for i, status in enumerate(statuses)
+                                if status in converters)
+        self._hosts = {}
+        self._generation = 0
+        self._filled = False
+        self.appeared = 0
+        self.disappeared = 0
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def begin(self):
+        # Hosts not updated after begin() are not emitted, so a failed
+        # refresh exports no hosts but forgets none of them.
+        self._generation += 1
+
+    def update(self, key, label_values, fields, address=None):
+        record = self._hosts.get(key)
+        if record is None:
+            record = self._hosts[key] = HostRecord(self._labelnames, label_values, self._size)
+            if self._filled:
+                self.appeared += 1
+        elif record.label_values != label_values:
+            record.label_values = label_values
+            record.labels = dict(zip(self._labelnames, label_values))
+        values = record.values
+        get = fields.get
+        for i, status in self._plain:
+            values[i] = get(status)
+        for i, status, convert in self._converted:
+            value = get(status)
+            values[i] = None if value is None else convert(value)
+        record.seen = self._generation
+        record.address = address
+
+    def addresses(self):
+        # [(key, address)] of the hosts whose http server is up, may be
+        # called from other threads while the table is refreshed
+        return [(key, record.address) for key, record in self._hosts.items() if record.address]
+
+    def finish(self):
+        # Called after a complete refresh, the hosts not seen in it are gone.
+        # The first refresh only fills the table, it does not count arrivals.
+        for key, record in self._hosts.items():
+            if record.seen != self._generation:
+                del self._hosts[key]
+                self.disappeared += 1
+        self._filled = True
+
+    def emit(self, families):
+        # families are in the order of statuses
+        generation = self._generation
+        records = [record for record in self._hosts.itervalues() if record.seen == generation]
+        for i, family in enumerate(families):
+            for record in records:
+                value = record.values[i]
+                if value is not None:
+                    add_sample(family, record.labels, value)
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+
+import threading
+import time
+import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+from prometheus_client import Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from circuit_breaker import CircuitBreaker
+from json_decoder import DECODER
+from self_metrics import SELF_METRICS, DECODE, FETCH
+
+
+class HttpError(Exception):
+    pass
+
+
+class ResponseTooLarge(HttpError):
+    pass
+
+
+class HttpClient(object):
+    # One requests session shared by every collector: connections to each
+    # namenode / resourcemanager are pooled and kept alive between scrapes,
+    # every request has a connect and read timeout and large json is asked
+    # for gzip compressed.
+
+    def __init__(self, connect_timeout=5, read_timeout=30, max_bytes=512 * 1024 * 1024, pool_size=8):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._errors = {}
+        self._received_bytes = {}
+        self.breaker = CircuitBreaker()
+        self._latency = Histogram('hadoop_exporter_http_request_duration_seconds',
+                                  'Latency of requests to hadoop, headers and body',
+                                  ['endpoint'], registry=None)
+        self.configure(pool_size)
+
+    def configure(self, pool_size, hosts=32):
+        # pool_size is the number of connections kept per host, it should match
+        # the number of requests made in parallel. hosts is the number of hosts
+        # whose pools are kept.
+        self._session = requests.Session()
+        self._session.headers['Accept-Encoding'] = 'gzip'
+        self._adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size)
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+
+    def get_json(self, url, params=None, timeout=None, endpoint=None, extract=None):
+        # The decoded json, or None when hadoop can not be reached, answers
+        # with an error or sends more than max_bytes. With extract, what
+        # extract() makes of it, see JsonDecoder.decode(). A body that is no
+        # json raises ValueError and counts as a failure of the host.
+        status, chunks = self._open(url, params, timeout, endpoint, None, False, True)
+        body = _read(chunks)
+        if body is None:
+            return None
+        return self._decode(url, endpoint, body, extract)
+
+    def get_json_status(self, url, params=None, timeout=None, endpoint=None, extract=None):
+        # (status code, decoded json) of url. Unlike get_json() the json of an
+        # error status is returned too (None when it is no json), e.g. the
+        # RemoteException of webhdfs, so a request hadoop rejects can be told
+        # from one that failed. (None, None) when hadoop can not be reached or
+        # the body can not be read.
+        status, chunks = self._open(url, params, timeout, endpoint, None, True, True)
+        if chunks is None:
+            return status, None
+        body = _read(chunks)
+        if body is None:
+            return None, None
+        if status != requests.codes.ok:
+            try:
+                return status, DECODER.loads(body)
+            except ValueError:
+                return status, None
+        return status, self._decode(url, endpoint, body, extract)
+
+    def get(self, url, params=None, timeout=None, endpoint=None):
+        # The whole body, or None like get_json()
+        return _read(self.get_stream(url, params, timeout, endpoint))
+
+    def get_stream(self, url, params=None, timeout=None, endpoint=None, max_bytes=None):
+        # The body as an iterator of chunks, so large responses can be decoded
+        # while they arrive. None when hadoop can not be reached or answers with
+        # an error. Failures half way through the body raise HttpError.
+        # Hosts whose circuit is open are not asked at all. timeout overrides
+        # the (connect, read) timeouts, endpoint the endpoint label, e.g. for
+        # requests to every datanode that should count as one endpoint, and
+        # max_bytes the size limit, e.g. for a download of the fsimage.
+        return self._open(url, params, timeout, endpoint, max_bytes, False, False)[1]
+
+    def get_stream_status(self, url, params=None, timeout=None, endpoint=None, max_bytes=None):
+        # (status code, chunks) like get_stream(), with the body of an error
+        # status too. (None, None) when hadoop can not be reached.
+        return self._open(url, params, timeout, endpoint, max_bytes, True, False)
+
+    def _open(self, url, params, timeout, endpoint, max_bytes, errors, decoded):
+        # decoded: the caller reads the body as json and only then tells the
+        # breaker whether the host answered properly
+        host, url_endpoint = _endpoint(url)
+        endpoint = endpoint or url_endpoint
+        if not self.breaker.allow(host):
+            self._count(self._errors, (endpoint, 'CircuitOpen'), 1)
+            return None, None
+
+        # streamed bodies are read by build_metrics, the labels of the job are kept
+        labels = SELF_METRICS.current()
+        start = time.time()
+        try:
+            response = self._session.get(url, params=params, stream=True,
+                                         timeout=timeout or (self.connect_timeout, self.read_timeout))
+        except requests.RequestException as e:
+            self.breaker.failure(host)
+            self._count(self._errors, (endpoint, e.__class__.__name__), 1)
+            self._latency.labels(endpoint).observe(time.time() - start)
+            SELF_METRICS.observe(labels, FETCH, time.time() - start)
+            return None, None
+
+        # any answer, even an error status, means the host is alive
+        if not decoded or response.status_code != requests.codes.ok:
+            self.breaker.success(host)
+        self._count(self._requests, (endpoint, str(response.status_code)), 1)
+        if response.status_code != requests.codes.ok and not errors:
+            self._finish(response, endpoint, start, labels)
+            return response.status_code, None
+        return response.status_code, self._iter_body(response, host, endpoint, start, labels,
+                                                     max_bytes or self.max_bytes)
+
+    def _iter_body(self, response, host, endpoint, start, labels, max_bytes):
+        size = 0
+        try:
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ResponseTooLarge('{0} sent more than {1} bytes'.format(response.url, max_bytes))
+                yield chunk
+        except requests.RequestException as e:
+            self.breaker.failure(host)
+            self._count(self._errors, (endpoint, e.__class__.__name__), 1)
+            raise HttpError(str(e))
+        except ResponseTooLarge as e:
+            # the host answers, a half open circuit closes
+            self.breaker.success(host)
+            self._count(self._errors, (endpoint, e.__class__.__name__), 1)
+            raise HttpError(str(e))
+        finally:
+            self._finish(response, endpoint, start, labels)
+
+    def _decode(self, url, endpoint, body, extract):
+        # A cut or html body of a 200 is a failure of the host, like a
+        # connection that breaks, so a host sending them is backed off too
+        host, url_endpoint = _endpoint(url)
+        start = time.time()
+        try:
+            value = DECODER.decode(body, extract)
+        except ValueError as e:
+            self.breaker.failure(host)
+            self._count(self._errors, (endpoint or url_endpoint, e.__class__.__name__), 1)
+            raise
+        except Exception:
+            # json that extract() does not expect, the host is fine
+            self.breaker.success(host)
+            raise
+        finally:
+            SELF_METRICS.observe(SELF_METRICS.current(), DECODE, time.time() - start)
+        self.breaker.success(host)
+        return value
+
+    def _finish(self, response, endpoint, start, labels):
+        self._count(self._received_bytes, endpoint, response.raw.tell())
+        self._latency.labels(endpoint).observe(time.time() - start)
+        SELF_METRICS.observe(labels, FETCH, time.time() - start)
+        response.close()
+
+    def _count(self, counter, key, value):
+        with self._lock:
+            counter[key] = counter.get(key, 0) + value
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        requests_total = CounterMetricFamily('hadoop_exporter_http_requests',
+                                             'Requests made to hadoop', labels=['endpoint', 'code'])
+        errors = CounterMetricFamily('hadoop_exporter_http_errors',
+                                     'Requests to hadoop that failed without a response, or whose body was no json',
+                                     labels=['endpoint', 'error'])
+        received = CounterMetricFamily('hadoop_exporter_http_received_bytes',
+                                       'Bytes received from hadoop, as sent on the wire',
+                                       labels=['endpoint'])
+        opened = CounterMetricFamily('hadoop_exporter_http_connections_opened',
+                                     'Connections opened to a hadoop host', labels=['host'])
+        reused = CounterMetricFamily('hadoop_exporter_http_connections_reused',
+                                     'Requests sent over an already open connection', labels=['host'])
+        circuit_state = GaugeMetricFamily('hadoop_exporter_http_circuit_state',
+                                          'Circuit of a hadoop host. 0:closed, 1:open, 2:half open',
+                                          labels=['host'])
+        circuit_opened = CounterMetricFamily('hadoop_exporter_http_circuit_opened',
+                                             'Times the circuit of a hadoop host opened', labels=['host'])
+
+        with self._lock:
+            for (endpoint, code), value in self._requests.items():
+                requests_total.add_metric([endpoint, code], value)
+            for (endpoint, error), value in self._errors.items():
+                errors.add_metric([endpoint, error], value)
+            for endpoint, value in self._received_bytes.items():
+                received.add_metric([endpoint], value)
+
+        for key in self._adapter.poolmanager.pools.keys():
+            pool = self._adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            host = '{0}:{1}'.format(pool.host, pool.port)
+            opened.add_metric([host], pool.num_connections)
+            reused.add_metric([host], max(pool.num_requests - pool.num_connections, 0))
+
+        for host, state, opened_total in self.breaker.states():
+            circuit_state.add_metric([host], state)
+            circuit_opened.add_metric([host], opened_total)
+
+        for metric in (requests_total, errors, received, opened, reused, circuit_state, circuit_opened):
+            yield metric
+        for metric in self._latency.collect():
+            yield metric
+
+
+def _read(chunks):
+    # The whole body of chunks, None when there is none or reading it failed
+    if chunks is None:
+        return None
+    try:
+        return ''.join(chunks)
+    except HttpError:
+        return None
+
+
+def _endpoint(url):
+    # (host, endpoint label) of url
+    parts = urlparse.urlsplit(url)
+    return parts.netloc, parts.netloc + parts.path
+
+
+# Shared by all collectors
+HTTP = HttpClient()
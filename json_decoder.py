@@ -0,0 +1,97 @@
+#!/usr/bin/python
+
+import json
+import multiprocessing
+import signal
+
+# The backends 'auto' tries, fastest first
+BACKENDS = ('orjson', 'ujson', 'simdjson', 'json')
+
+
+def backend_loads(name):
+    # The loads function of a backend, None when it is not installed
+    try:
+        if name == 'orjson':
+            import orjson
+            return orjson.loads
+        if name == 'ujson':
+            import ujson
+            return ujson.loads
+        if name == 'simdjson':
+            import simdjson
+            return simdjson.loads
+    except ImportError:
+        return None
+    if name == 'json':
+        return json.loads
+    raise ValueError('unknown json backend {0}, use auto or one of {1}'.format(name, ', '.join(BACKENDS)))
+
+
+def available_backends():
+    return [name for name in BACKENDS if backend_loads(name) is not None]
+
+
+class JsonDecoder(object):
+    # Decodes the json hadoop answers with, using the fastest backend that is
+    # installed. With a pool started, bodies of threshold bytes or more are
+    # decoded by worker processes, so large namenode and resourcemanager
+    # responses neither hold the GIL of the exporter nor share its core. A
+    # worker only sends back what extract() makes of the decoded body, e.g.
+    # the few fields of every node a collector reads, not the whole object.
+
+    def __init__(self, backend='auto'):
+        self.use(backend)
+        self.threshold = 1024 * 1024
+        self.timeout = 60
+        self._pool = None
+
+    def use(self, backend):
+        if backend == 'auto':
+            backend = available_backends()[0]
+        loads = backend_loads(backend)
+        if loads is None:
+            raise ValueError('json backend {0} is not installed'.format(backend))
+        self.backend = backend
+        self.loads = loads
+
+    def start_pool(self, processes, threshold=None):
+        # Forks the workers, so it has to run before the exporter starts its
+        # threads. The workers use the backend chosen at this point.
+        if threshold is not None:
+            self.threshold = threshold
+        self._pool = multiprocessing.Pool(processes, _start_worker, (self.backend,))
+
+    @property
+    def pooled(self):
+        return self._pool is not None
+
+    def decode(self, text, extract=None):
+        # extract(decoded) or the decoded text. extract has to be a module
+        # level function (or a partial of one) for the workers to get it.
+        if self._pool is not None and len(text) >= self.threshold:
+            try:
+                return self._pool.apply_async(_decode, (text, extract)).get(self.timeout)
+            except multiprocessing.TimeoutError:
+                # a worker that died takes its task with it
+                raise ValueError('decoding {0} bytes of json took over {1}s'.format(len(text), self.timeout))
+        value = self.loads(text)
+        return value if extract is None else extract(value)
+
+
+_worker_loads = None
+
+
+def _start_worker(backend):
+    global _worker_loads
+    _worker_loads = backend_loads(backend)
+    # ^C is for the exporter, which takes its daemonic workers down with it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _decode(text, extract):
+    value = _worker_loads(text)
+    return value if extract is None else extract(value)
+
+
+# Shared by the http client and the collectors
+DECODER = JsonDecoder()
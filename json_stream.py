@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+# what a number may go on with
+_NUMBER_CHARS = '0123456789.eE+-'
+
+
+def iter_object_items(text):
+    # Yields the (key, value) pairs of the json object in text one at a time,
+    # e.g. the LiveNodes string of NameNodeInfo, without building the dict of
+    # every datanode first.
+    pos = _skip(text, 0)
+    if text[pos] != '{':
+        raise ValueError('expected a json object at {0}'.format(pos))
+    pos = _skip(text, pos + 1)
+    if text[pos] == '}':
+        return
+    while True:
+        key, pos = _decoder.raw_decode(text, pos)
+        pos = _skip(text, pos)
+        if text[pos] != ':':
+            raise ValueError('expected : at {0}'.format(pos))
+        value, pos = _decoder.raw_decode(text, _skip(text, pos + 1))
+        yield key, value
+        pos = _skip(text, pos)
+        if text[pos] == '}':
+            return
+        if text[pos] != ',':
+            raise ValueError('expected , or }} at {0}'.format(pos))
+        pos = _skip(text, pos + 1)
+
+
+def iter_array_items(chunks, path):
+    # Yields the items of the array found under the keys in path, e.g.
+    # ('nodes', 'node') for /ws/v1/cluster/nodes, while the body is still
+    # arriving in chunks. Only the current item and the unread part of one
+    # chunk are held in memory. A null array yields nothing.
+    reader = _ChunkReader(chunks)
+    if not reader.find_array(path):
+        return
+
+    while True:
+        char = reader.next_char()
+        if char == ']':
+            return
+        if char == ',':
+            continue
+        item = reader.decode()
+        yield item
+
+
+def _skip(text, pos):
+    while text[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+class _ChunkReader(object):
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = ''
+        self._pos = 0
+
+    def _more(self):
+        for chunk in self._chunks:
+            if chunk:
+                self._buf = self._buf[self._pos:] + chunk
+                self._pos = 0
+                return True
+        return False
+
+    def next_char(self):
+        # The next character that is not whitespace
+        while True:
+            while self._pos < len(self._buf):
+                char = self._buf[self._pos]
+                self._pos += 1
+                if char not in _WHITESPACE:
+                    return char
+            if not self._more():
+                raise ValueError('unexpected end of json')
+
+    def decode(self):
+        # Decodes the value starting at the character next_char() just returned
+        self._pos -= 1
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                # the value is cut by the end of the chunk
+                if not self._more():
+                    raise
+                continue
+            if not isinstance(value, (dict, list, basestring)) and (
+                    end == len(self._buf) or self._buf[end] in _NUMBER_CHARS):
+                # a number may go on in the next chunk, also when it is cut
+                # right after its . or e and only its start decoded
+                if self._more():
+                    continue
+            self._pos = end
+            return value
+
+    def find_array(self, path):
+        # Walks the enclosing objects up to the array under path, skipping
+        # every other value. Returns False when the array is null.
+        depth = 0
+        matched = 0
+        while True:
+            char = self.next_char()
+            if char == '"':
+                key = self.decode()
+                if self.next_char() != ':':
+                    # a string value, not a key
+                    self._pos -= 1
+                    continue
+                if depth == matched + 1 and key == path[matched]:
+                    matched += 1
+                    char = self.next_char()
+                    if char == 'n':
+                        return False
+                    if matched == len(path):
+                        if char == '[':
+                            return True
+                        raise ValueError('{0} is not an array'.format('.'.join(path)))
+                    self._pos -= 1
+            elif char in '{[':
+                depth += 1
+            elif char in '}]':
+                depth -= 1
+                if matched and depth <= matched:
+                    raise ValueError('{0} not found'.format('.'.join(path)))
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+
+import re
+
+from prometheus_client.core import GaugeMetricFamily
+
+
+def snake_case(name):
+    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', name).lower()
+
+
+class MetricDescriptor(object):
+    __slots__ = ('key', 'name', 'documentation', 'labels')
+
+    def __init__(self, prefix, key, documentation, labels):
+        self.key = key
+        self.name = prefix + snake_case(key)
+        self.documentation = documentation
+        self.labels = labels
+
+    def family(self):
+        return GaugeMetricFamily(self.name, self.documentation, labels=self.labels)
+
+
+class DescriptorTable(object):
+    # Metric names, help and label names of a statuses dict, worked out once
+    # when the collector is created instead of on every scrape.
+
+    def __init__(self, prefix, statuses, labels):
+        self.descriptors = tuple(MetricDescriptor(prefix, key, statuses[key], labels) for key in statuses)
+
+    def __iter__(self):
+        return iter(self.descriptors)
+
+    def families(self):
+        # Families hold the samples of one scrape, so they are the only thing
+        # still allocated per scrape.
+        return dict((descriptor.key, descriptor.family()) for descriptor in self.descriptors)
+
+
+class LabelCache(object):
+    # Interns the labels dict of every label set, so all samples of a target or
+    # a host share one dict instead of zipping a new one per sample. Label sets
+    # not used during a whole scrape are dropped by rotate().
+
+    def __init__(self, labelnames):
+        self._labelnames = labelnames
+        self._labels = {}
+        self._previous = {}
+
+    def get(self, *values):
+        labels = self._labels.get(values)
+        if labels is None:
+            labels = self._previous.get(values)
+            if labels is None:
+                labels = dict(zip(self._labelnames, values))
+            self._labels[values] = labels
+        return labels
+
+    def rotate(self):
+        self._previous, self._labels = self._labels, {}
+
+
+def add_sample(family, labels, value):
+    # GaugeMetricFamily.add_metric without building the labels dict again.
+    # labels is shared between samples and must not be modified.
+    family.add_sample(family.name, labels, value)
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+
+import fnmatch
+import re
+import threading
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from metric_descriptors import snake_case
+
+# The keys of a --jmx.rules file, the collectors whose rules it extends, and
+# of each of its rules. Rules are in the style of the jmx_exporter ones:
+#
+# {"namenode": [
+#    {"bean": "Hadoop:service=NameNode,name=RpcActivityForPort*",
+#     "pattern": "RpcActivityForPort(\\d+)", "labels": {"port": "$1"},
+#     "name": "hadoop_namenode_rpc_{attribute}",
+#     "attributes": ["RpcQueueTimeAvgTime", "RpcProcessingTimeAvgTime", "CallQueueLength"]},
+#    {"bean": "Hadoop:service=NameNode,name=FSNamesystem", "attributes": {"TotalFiles": "Files and dirs"}}],
+#  "datanode": [
+#    {"bean": "Hadoop:service=DataNode,name=DataNodeActivity*", "type": "counter",
+#     "attributes": ["BlocksRead", "BlocksWritten"]}]}
+CONFIG_KEYS = ('namenode', 'datanode', 'nodemanager')
+RULE_KEYS = ('bean', 'pattern', 'attributes', 'name', 'help', 'type', 'labels')
+TYPES = ('gauge', 'counter')
+
+_GROUP = re.compile(r'\$(\d)')
+_INVALID = re.compile(r'[^a-zA-Z0-9_:]')
+
+
+def load_rules(config):
+    # {collector: [rule]} of a --jmx.rules file
+    config = config or {}
+    if not isinstance(config, dict):
+        raise ValueError('the jmx rules config must be a mapping')
+    unknown = set(config) - set(CONFIG_KEYS)
+    if unknown:
+        raise ValueError('unknown jmx rules collectors: {0}'.format(', '.join(sorted(unknown))))
+    return dict((collector, list(rules)) for collector, rules in config.items())
+
+
+class RuleFamily(object):
+    # The family an attribute goes to, the same for every bean it is read of
+    __slots__ = ('name', 'documentation', 'type', 'labelnames', 'sample_name')
+
+    def __init__(self, name, documentation, type, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.labelnames = labelnames
+        # counters hold samples named <name>_total
+        self.sample_name = name + '_total' if type == 'counter' else name
+
+    def family(self):
+        if self.type == 'counter':
+            return CounterMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        return GaugeMetricFamily(self.name, self.documentation, labels=self.labelnames)
+
+
+class JmxRule(object):
+    # The beans whose ObjectName matches bean, a JMX pattern asked for with
+    # ?qry= as it is, and pattern, a regex searched in the name whose groups
+    # are $1..$9 in name, help and labels. attributes lists the attributes
+    # read (a mapping gives their help), without it every numeric attribute
+    # of the bean is. name is prefix{attribute} unless set, {attribute}
+    # being the snake_case name of the attribute.
+
+    def __init__(self, rule, prefix):
+        unknown = set(rule) - set(RULE_KEYS)
+        if unknown:
+            raise ValueError('unknown jmx rule settings: {0}'.format(', '.join(sorted(unknown))))
+        if 'bean' not in rule:
+            raise ValueError('every jmx rule needs a "bean" name or pattern')
+        self.bean = rule['bean']
+        self._glob = re.compile(fnmatch.translate(self.bean)) if '*' in self.bean or '?' in self.bean else None
+        self._pattern = re.compile(rule['pattern']) if 'pattern' in rule else None
+        attributes = rule.get('attributes')
+        if attributes is None or attributes == '*':
+            self.attributes = None
+        elif isinstance(attributes, dict):
+            self.attributes = sorted(attributes.items())
+        else:
+            self.attributes = [(attribute, None) for attribute in attributes]
+        self.type = rule.get('type', 'gauge')
+        if self.type not in TYPES:
+            raise ValueError('type of {0} must be one of {1}'.format(self.bean, ', '.join(TYPES)))
+        self._name = rule.get('name', prefix + '{attribute}')
+        self._help = rule.get('help')
+        self._labels = sorted(rule.get('labels', {}).items())
+        # families that do not depend on the bean name are known up front
+        self.static = self._pattern is None or not (_GROUP.search(self._name) or
+                                                    any(_GROUP.search(value) for name, value in self._labels))
+
+    def match(self, name):
+        # The groups of pattern in the bean name, None when the rule does not apply
+        if self._glob is not None:
+            if self._glob.match(name) is None:
+                return None
+        elif name != self.bean:
+            return None
+        if self._pattern is None:
+            return ()
+        found = self._pattern.search(name)
+        return found.groups() if found is not None else None
+
+    def family(self, attribute, documentation, groups, labelnames):
+        name = _expand(self._name.replace('{attribute}', snake_case(attribute)), groups)
+        if self._help is not None:
+            documentation = _expand(self._help.replace('{attribute}', attribute), groups)
+        return RuleFamily(_INVALID.sub('_', name), documentation or attribute, self.type,
+                          labelnames + [label for label, value in self._labels])
+
+    def labels(self, groups):
+        return tuple((label, _expand(value, groups)) for label, value in self._labels)
+
+
+class _Compiled(object):
+    # What the rules make of one bean name: (attribute, family, labels) of
+    # the attributes rules name, and the rules taking every other numeric
+    # attribute, whose families are added as attributes show up
+    __slots__ = ('mapped', 'named', 'wildcard', 'rest')
+
+    def __init__(self):
+        self.mapped = []
+        self.named = set()
+        self.wildcard = []
+        self.rest = {}
+
+
+class RuleSet(object):
+    # Rules compiled into a dispatch index: bean name -> the attributes read
+    # of it and the family each goes to, worked out the first time a bean of
+    # that name shows up. A bean then costs a dict lookup plus a get per
+    # mapped attribute, instead of a comparison with every rule and status.
+    #
+    # An attribute of a bean goes to the first rule naming it, rules without
+    # attributes take the numeric attributes no rule names, the first of them
+    # matching the bean wins.
+
+    def __init__(self, rules, prefix, labelnames):
+        self._rules = [JmxRule(rule, prefix) for rule in rules]
+        self._labelnames = list(labelnames)
+        self._index = {}
+        # name -> RuleFamily of every family known so far, and their order
+        self._families = {}
+        self._order = []
+        self._lock = threading.Lock()
+        for rule in self._rules:
+            if rule.static and rule.attributes is not None:
+                for attribute, documentation in rule.attributes:
+                    self._family(rule, attribute, documentation, ())
+
+    @property
+    def queries(self):
+        # the bean names and patterns to ask for, once each
+        queries = []
+        for rule in self._rules:
+            if rule.bean not in queries:
+                queries.append(rule.bean)
+        return queries
+
+    def families(self):
+        # New families to fill by one build, name -> family
+        with self._lock:
+            return dict((name, self._families[name].family()) for name in self._order)
+
+    def emit(self, families):
+        # The families of a build in the order of the rules
+        with self._lock:
+            order = list(self._order)
+        return [families[name] for name in order if name in families]
+
+    def values(self, bean):
+        # (family, labels, value) of the numeric attributes of bean the rules map
+        compiled = self._compiled(bean.get('name', ''))
+        values = []
+        for attribute, family, labels in compiled.mapped:
+            value = bean.get(attribute)
+            if isinstance(value, (int, long, float)):
+                values.append((family, labels, value))
+        if compiled.wildcard:
+            for attribute, value in bean.iteritems():
+                if attribute in compiled.named or not isinstance(value, (int, long, float)):
+                    continue
+                mapping = compiled.rest.get(attribute)
+                if mapping is None:
+                    rule, groups = compiled.wildcard[0]
+                    with self._lock:
+                        mapping = compiled.rest[attribute] = (self._family(rule, attribute, None, groups),
+                                                              rule.labels(groups))
+                values.append((mapping[0], mapping[1], value))
+        return values
+
+    def add_samples(self, families, labels, values):
+        # Adds values of values() to the families of families(), labels are
+        # the ones of the collector, shared with the samples of a rule
+        # without labels of its own
+        merged = {}
+        for family, extra, value in values:
+            metric = families.get(family.name)
+            if metric is None:
+                metric = families[family.name] = family.family()
+            if extra:
+                sample_labels = merged.get(extra)
+                if sample_labels is None:
+                    sample_labels = merged[extra] = dict(labels, **dict(extra))
+            else:
+                sample_labels = labels
+            metric.add_sample(family.sample_name, sample_labels, value)
+
+    def _compiled(self, name):
+        compiled = self._index.get(name)
+        if compiled is None:
+            with self._lock:
+                compiled = self._index.get(name)
+                if compiled is None:
+                    compiled = self._index[name] = self._compile(name)
+        return compiled
+
+    def _compile(self, name):
+        compiled = _Compiled()
+        for rule in self._rules:
+            groups = rule.match(name)
+            if groups is None:
+                continue
+            if rule.attributes is None:
+                compiled.wildcard.append((rule, groups))
+                continue
+            for attribute, documentation in rule.attributes:
+                if attribute in compiled.named:
+                    continue
+                compiled.named.add(attribute)
+                compiled.mapped.append((attribute, self._family(rule, attribute, documentation, groups),
+                                        rule.labels(groups)))
+        return compiled
+
+    def _family(self, rule, attribute, documentation, groups):
+        # the RuleFamily of the name, the first rule making a name sets it
+        family = rule.family(attribute, documentation, groups, self._labelnames)
+        known = self._families.get(family.name)
+        if known is not None:
+            return known
+        self._families[family.name] = family
+        self._order.append(family.name)
+        return family
+
+
+def _expand(template, groups):
+    return _GROUP.sub(lambda found: groups[int(found.group(1)) - 1] if int(found.group(1)) <= len(groups) else '',
+                      template)
@@ -1,50 +1,78 @@
 #!/usr/bin/python
 
-import re
 import time
-import requests
 import urllib
 import argparse
 from pprint import pprint
 
+import fnmatch
 import json
 import os
+import threading
 from sys import exit
-from prometheus_client import start_http_server
-from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from functools import partial
+from prometheus_client.core import REGISTRY, CounterMetricFamily
+
+from concurrent_collector import collect_once
+from exposition import start_exposition_server
+from http_client import HTTP
+from json_decoder import DECODER
+from metric_descriptors import DescriptorTable, LabelCache, add_sample
+from metric_rules import RuleSet
+from host_table import HostTable
+from json_stream import iter_object_items
+from ha_state import ACTIVE, ha_state, is_passive, namenode_state
+from poller import Poller
+from quota_exporter import HdfsQuotaCollector
 
 DEBUG = int(os.environ.get('DEBUG', '0'))
 
+# Seconds a namenode that rejected ?qry= gets the full dump before it is
+# asked with ?qry= again
+QUERY_RETRY = 3600
+
 
 class NameNodeCollector(object):
-    # The build statuses we want to export about.
+    name = 'namenode'
+
+    # The build statuses we want to export about, besides the bean
+    # attributes of the rules.
     statuses = {
         "up": "node status. 1:up, 0:down",
-        "MissingBlocks": "MissingBlocks",
-        "CapacityTotal": "CapacityTotal",
-        # "CapacityTotalGB": "CapacityTotalGB",
-        "CapacityUsed": "CapacityUsed",
-        # "CapacityUsedGB": "CapacityUsedGB",
-        "CapacityRemaining": "CapacityRemaining",
-        # "CapacityRemainingGB": "CapacityRemainingGB",
-        "CapacityUsedNonDFS": "CapacityUsedNonDFS",
-        "TotalLoad": "TotalLoad",
-        "BlocksTotal": "BlocksTotal",
-        "FilesTotal": "FilesTotal",
-        "PendingReplicationBlocks": "PendingReplicationBlocks",
-        "UnderReplicatedBlocks": "UnderReplicatedBlocks",
-        "CorruptBlocks": "CorruptBlocks",
-        "ScheduledReplicationBlocks": "ScheduledReplicationBlocks",
-        "PendingDeletionBlocks": "PendingDeletionBlocks",
-        "ExcessBlocks": "ExcessBlocks",
-        "PostponedMisreplicatedBlocks": "PostponedMisreplicatedBlocks",
-        "PendingDataNodeMessageCount": "PendingDataNodeMessageCount",
-        "BlockCapacity": "BlockCapacity",
-        "StaleDataNodes": "StaleDataNodes",
-        "NumLiveDataNodes": "NumLiveDataNodes",
-        "NumDeadDataNodes": "NumDeadDataNodes",
+        "haState": "HA state. 1:active, 0:standby",
     }
 
+    # The bean attributes exported, rules in the style of jmx_exporter (see
+    # metric_rules.py) that --jmx.rules extends. Each bean is requested on
+    # its own with ?qry= so the namenode does not render the whole /jmx dump
+    # for us.
+    rules = [
+        {"bean": "Hadoop:service=NameNode,name=FSNamesystemState", "attributes": {
+            "CapacityTotal": "CapacityTotal",
+            "CapacityUsed": "CapacityUsed",
+            "CapacityRemaining": "CapacityRemaining",
+            "TotalLoad": "TotalLoad",
+            "BlocksTotal": "BlocksTotal",
+            "FilesTotal": "FilesTotal",
+            "PendingReplicationBlocks": "PendingReplicationBlocks",
+            "UnderReplicatedBlocks": "UnderReplicatedBlocks",
+            "ScheduledReplicationBlocks": "ScheduledReplicationBlocks",
+            "NumLiveDataNodes": "NumLiveDataNodes",
+            "NumDeadDataNodes": "NumDeadDataNodes",
+        }},
+        {"bean": "Hadoop:service=NameNode,name=FSNamesystem", "attributes": {
+            "MissingBlocks": "MissingBlocks",
+            "CapacityUsedNonDFS": "CapacityUsedNonDFS",
+            "CorruptBlocks": "CorruptBlocks",
+            "PendingDeletionBlocks": "PendingDeletionBlocks",
+            "ExcessBlocks": "ExcessBlocks",
+            "PostponedMisreplicatedBlocks": "PostponedMisreplicatedBlocks",
+            "PendingDataNodeMessageCount": "PendingDataNodeMessageCount",
+            "BlockCapacity": "BlockCapacity",
+            "StaleDataNodes": "StaleDataNodes",
+        }},
+    ]
+
     datanode_statuses = {
         "up": "node status. 1:up, 0:down",
         "blockPoolUsed": "blockPoolUsed",
@@ -58,134 +86,240 @@ class NameNodeCollector(object):
         # "usedSpace": "usedSpace", # same as used
     }
 
-    quota_statuses = {
-        "TotalFiles": "TotalFiles",
-        "RemainFiles": "RemainFiles",
-        "TotalSpace": "TotalSpace",
-        "RemainSpace": "RemainSpace",
-    }
+    # The bean the datanodes are read of
+    info_bean = "Hadoop:service=NameNode,name=NameNodeInfo"
 
-    def __init__(self, target, cluster):
+    def __init__(self, target, cluster, shard=None, rules=None):
         self._cluster = cluster
         self._targets = target.rstrip("/").split(';')
         self._prefix = 'hadoop_namenode_'
+        # With shard set only the datanodes it owns are exported, and only the
+        # primary shard exports the namenode families and asks for their beans.
+        self._shard = shard
+        self._primary = shard is None or shard.primary
+        # rules extends the default ones, its rules come first
+        self._rules = RuleSet(list(rules or ()) + self.rules, self._prefix, ["cluster", "nn_host", "nn_port"])
+        queries = self._rules.queries if self._primary else []
+        self.beans = tuple(queries + ([self.info_bean] if self.info_bean not in queries else []))
         self._datanode_prefix = 'hadoop_datanode_node_'
-        self._quota_prefix = 'hadoop_quota_'
+        # namenode -> unix time until which it gets the full dump instead of
+        # ?qry=, it rejected ?qry= before
+        self._full_dump_targets = {}
+
+        self._addresses = dict((url, split_host_port(url)) for url in self._targets)
+        self._descriptors = DescriptorTable(self._prefix, self.statuses, ["cluster", "nn_host", "nn_port"])
+        self._datanode_descriptors = DescriptorTable(self._datanode_prefix, self.datanode_statuses,
+                                                     ["cluster", "nn_host", "nn_port", "host", "xferaddr"])
+        self._labels = LabelCache(["cluster", "nn_host", "nn_port"])
+        # the datanodes each namenode reported, kept between scrapes
+        self._datanode_statuses = tuple(self.datanode_statuses)
+        self._datanodes = dict((url, HostTable(["cluster", "nn_host", "nn_port", "host", "xferaddr"],
+                                               self._datanode_statuses)) for url in self._targets)
+        # what the json decoder workers send back of a /jmx body
+        self._extract = partial(compact_jmx, self.beans, self._datanode_statuses + ('xferaddr', 'infoAddr'))
 
     def collect(self):
+        return collect_once(self)
+
+    def fetch_jobs(self):
+        # Request data from namenode jmx API, one job per namenode and bean
+        jobs = []
+        now = time.time()
+        for url in self._targets:
+            if len(self._targets) > 1:
+                jobs.append(((url, 'haState'), partial(self._ha_state, url)))
+            if self._full_dump_targets.get(url, 0) > now:
+                jobs.append(((url, None), partial(self._request_dump, url)))
+            else:
+                # the bean jobs of a namenode rejecting ?qry= share one full dump
+                dump = _Once(partial(self._request_dump, url))
+                for bean in self.beans:
+                    jobs.append(((url, bean), partial(self._request_bean, url, bean, dump)))
+        return jobs
+
+    def build_metrics(self, results):
         self._setup_empty_prometheus_metrics()
-        # Request data from namenode jmx API
         for url in self._targets:
-            self._target = url
-            beans = self._request_data()
-            self._get_metrics(beans)
-
-
-        self._load_quota()
-
-        for status in self.statuses:
-            yield self._prometheus_metrics[status]
-
-        for status in self.datanode_statuses:
-            yield self._prometheus_datanode_metrics[status]
-
-        for status in self.quota_statuses:
-            yield self._prometheus_quota_metrics[status]
-
-    def _request_data(self):
-        # Request exactly the information we need from namenode
-        # url = '{0}/jmx'.format(self._target)
-        url = self._target
+            if (url, None) in results:
+                beans = results[(url, None)] or []
+            else:
+                # a bean matching several patterns of the rules is read once
+                beans = []
+                names = set()
+                for bean in self.beans:
+                    for found in results.get((url, bean), ()):
+                        if found['name'] not in names:
+                            names.add(found['name'])
+                            beans.append(found)
+            self._get_metrics(url, beans, results.get((url, 'haState')))
+
+        datanode_metrics = [self._prometheus_datanode_metrics[status] for status in self._datanode_statuses]
+        appeared = CounterMetricFamily(self._datanode_prefix + 'appeared',
+                                       'Datanodes that joined the LiveNodes / DeadNodes of the namenode',
+                                       labels=["cluster", "nn_host", "nn_port"])
+        disappeared = CounterMetricFamily(self._datanode_prefix + 'disappeared',
+                                          'Datanodes that left the LiveNodes / DeadNodes of the namenode',
+                                          labels=["cluster", "nn_host", "nn_port"])
+        for url in self._targets:
+            table = self._datanodes[url]
+            table.emit(datanode_metrics)
+            nn_host, nn_port = self._addresses[url]
+            appeared.add_metric([self._cluster, nn_host, nn_port], table.appeared)
+            disappeared.add_metric([self._cluster, nn_host, nn_port], table.disappeared)
+
+        if self._primary:
+            for status in self.statuses:
+                yield self._prometheus_metrics[status]
+            for metric in self._rules.emit(self._rule_metrics):
+                yield metric
+
+        for metric in datanode_metrics:
+            yield metric
+        yield appeared
+        yield disappeared
+
+    def datanode_addresses(self):
+        # {host: infoAddr} of the live datanodes, for the datanode jmx collector
+        addresses = {}
+        for table in self._datanodes.values():
+            addresses.update(table.addresses())
+        return addresses
+
+    def _ha_state(self, url):
+        return ha_state(self._targets, url, namenode_state)
+
+    def _request_dump(self, url):
+        if is_passive(self._ha_state(url)):
+            return []
+        return self._request_data(url)[1]
+
+    def _request_bean(self, url, bean, dump):
+        # Standby namenodes only get the state probe, their LiveNodes duplicate the active one
+        if is_passive(self._ha_state(url)):
+            return []
+        status, beans = self._request_data(url, {'qry': bean})
+        if beans is None:
+            if status is None or not 400 <= status < 500:
+                # down, timed out or failing, the next refresh asks again
+                return []
+            # Old namenodes answer ?qry= with an error, they get the full dump
+            # for a while, fetched once for all the beans of this refresh
+            self._full_dump_targets[url] = time.time() + QUERY_RETRY
+            beans = dump.get()
+            if beans is None:
+                return []
+        # namenodes that ignore ?qry= return every bean
+        return [b for b in beans if b['name'] == bean or fnmatch.fnmatchcase(b['name'], bean)]
+
+    def _request_data(self, url, params=None):
+        # Request exactly the information we need from namenode: (status
+        # code, beans), beans is None unless the request succeeded
+        # url = '{0}/jmx'.format(target)
 
         def parsejobs(myurl):
-            response = requests.get(myurl) #, params=params, auth=(self._user, self._password))
-            if response.status_code != requests.codes.ok:
-                return[]
-            result = response.json()
+            # with decoder workers LiveNodes / DeadNodes arrive decoded and cut down
+            extract = self._extract if DECODER.pooled else None
+            status, result = HTTP.get_json_status(myurl, params, extract=extract) #, auth=(self._user, self._password))
+            if status != 200 or result is None:
+                return status, None
             if DEBUG:
                 pprint(result)
 
-            return result['beans']
+            return status, result['beans']
 
         return parsejobs(url)
 
     def _setup_empty_prometheus_metrics(self):
         # The metrics we want to export.
-        self._prometheus_metrics = {}
-        self._prometheus_datanode_metrics = {}
-        self._prometheus_quota_metrics = {}
-        for status in self.statuses:
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', status).lower()
-            self._prometheus_metrics[status] = GaugeMetricFamily(self._prefix + snake_case,
-                                      self.statuses[status], labels=["cluster", "nn_host", "nn_port"])
-
-        for status in self.datanode_statuses:
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', status).lower()
-            self._prometheus_datanode_metrics[status] = GaugeMetricFamily(self._datanode_prefix + snake_case,
-                        self.datanode_statuses[status], labels=["cluster", "nn_host", "nn_port", "host", "xferaddr"])
-
-        for status in self.quota_statuses:
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', status).lower()
-            self._prometheus_quota_metrics[status] = GaugeMetricFamily(self._quota_prefix + snake_case,
-                        self.quota_statuses[status], labels=["cluster", "dir"])
-
-    def _get_metrics(self, beans):
-        nn_host, nn_port = split_host_port(self._target)
+        self._prometheus_metrics = self._descriptors.families()
+        self._rule_metrics = self._rules.families()
+        self._prometheus_datanode_metrics = self._datanode_descriptors.families()
+        self._labels.rotate()
+        for table in self._datanodes.values():
+            table.begin()
+
+    def _get_metrics(self, url, beans, state=None):
+        nn_host, nn_port = self._addresses[url]
+        labels = self._labels.get(self._cluster, nn_host, nn_port)
+        if state is not None:
+            add_sample(self._prometheus_metrics["haState"], labels, 1 if state == ACTIVE else 0)
         status = "up"
-        self._prometheus_metrics[status].add_metric([self._cluster, nn_host, nn_port], 0 if beans == [] else 1)
+        if is_passive(state):
+            add_sample(self._prometheus_metrics[status], labels, 1)
+            return
+        add_sample(self._prometheus_metrics[status], labels, 0 if beans == [] else 1)
 
         for bean in beans:
-            if bean['name'] == "Hadoop:service=NameNode,name=FSNamesystemState":
-                for status in self.statuses:
-                    if bean.has_key(status):
-                        self._prometheus_metrics[status].add_metric([self._cluster, nn_host, nn_port], bean[status])
-            if bean['name'] == "Hadoop:service=NameNode,name=FSNamesystem":
-                for status in self.statuses:
-                    if bean.has_key(status):
-                        self._prometheus_metrics[status].add_metric([self._cluster, nn_host, nn_port], bean[status])
-            elif bean['name'] == "Hadoop:service=NameNode,name=NameNodeInfo":
-                liveNodes = json.loads(bean['LiveNodes'])
-                deadNodes = json.loads(bean['DeadNodes'])
-                for host in liveNodes:
-                    node = liveNodes[host]
+            if self._primary:
+                self._rules.add_samples(self._rule_metrics, labels, self._rules.values(bean))
+            if bean['name'] == self.info_bean:
+                # LiveNodes / DeadNodes are json strings holding every datanode,
+                # decode them one datanode at a time into the datanode table
+                table = self._datanodes[url]
+                shard = self._shard
+                for host, node in _datanodes(bean['LiveNodes']):
+                    if shard is not None and not shard.owns(host):
+                        continue
                     node['up'] = 1
-                    for status in self.datanode_statuses:
-                        self._prometheus_datanode_metrics[status].add_metric(
-                            [self._cluster, nn_host, nn_port, host, node['xferaddr'] ], node[status])
-                for host in deadNodes:
-                    node = deadNodes[host]
+                    table.update(host, (self._cluster, nn_host, nn_port, host, node['xferaddr']), node,
+                                 node.get('infoAddr'))
+                for host, node in _datanodes(bean['DeadNodes']):
+                    if shard is not None and not shard.owns(host):
+                        continue
                     node['up'] = 0
-                    for status in self.datanode_statuses:
-                        if node.has_key(status):
-                            self._prometheus_datanode_metrics[status].add_metric(
-                                [self._cluster, nn_host, nn_port, host, node['xferaddr'] ], node[status])
-
-    def _load_quota(self):
-        quota_file = 'result'
-        quota_dict = {}
-        with open(quota_file, 'r') as f:
-            for line in f.readlines():
-                tags = line.strip().split()
-                path = tags[len(tags) - 1]
-                quota_dict["TotalFiles"] = str2float(tags[0])
-                quota_dict["RemainFiles"] = str2float(tags[1])
-                quota_dict["TotalSpace"] = str2float(tags[2])
-                quota_dict["RemainSpace"] = str2float(tags[3])
-                for status in self.quota_statuses:
-                    self._prometheus_quota_metrics[self.quota_statuses[status]].add_metric(
-                        [self._cluster, path], quota_dict[status])
+                    table.update(host, (self._cluster, nn_host, nn_port, host, node['xferaddr']), node)
+                table.finish()
+
+class _Once(object):
+    # The result of fetch, run by the first job asking for it, the jobs
+    # asking at the same time wait for it
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._done = False
+        self._result = None
+
+    def get(self):
+        with self._lock:
+            if not self._done:
+                self._result = self._fetch()
+                self._done = True
+            return self._result
+
+
+def compact_jmx(beans, fields, result):
+    # Run where a /jmx body is decoded, in a json decoder worker when it is
+    # large: only the beans in beans are kept, and their LiveNodes / DeadNodes
+    # strings become [(host, {field: value})] of the fields in fields. The
+    # strings are decoded whole, with the fast backend, a worker has the
+    # memory to spare.
+    kept = []
+    for bean in result.get('beans', ()):
+        name = bean.get('name', '')
+        if name not in beans and not any(fnmatch.fnmatchcase(name, pattern) for pattern in beans):
+            continue
+        for key in ('LiveNodes', 'DeadNodes'):
+            nodes = bean.get(key)
+            if isinstance(nodes, basestring):
+                bean[key] = [(host, {field: node[field] for field in fields if field in node})
+                             for host, node in DECODER.loads(nodes).iteritems()]
+        kept.append(bean)
+    result['beans'] = kept
+    return result
+
+
+def _datanodes(nodes):
+    # (host, node) of a LiveNodes / DeadNodes string, or of its compact_jmx() list
+    if isinstance(nodes, basestring):
+        return iter_object_items(nodes)
+    return nodes
+
 
 def split_host_port(url):
     protocol, s1 = urllib.splittype(url)
     host, s2=  urllib.splithost(s1)
     return urllib.splitport(host)
 
-def str2float(value):
-    try:
-        return float(value)
-    except:
-        return -1
-
 def parse_args():
     parser = argparse.ArgumentParser(
         description='namenode exporter args namenode address and port'
@@ -219,6 +353,35 @@ def parse_args():
         required=True,
         help='label for cluster'
     )
+
+    parser.add_argument(
+        '--quota.dirs',
+        metavar='dirs',
+        dest='quota_dirs',
+        required=False,
+        help='Comma separated HDFS directory globs to export quotas of, each may end in =seconds to set its '
+             'own refresh interval, "" disables it. (default "/user/*")',
+        default='/user/*'
+    )
+
+    parser.add_argument(
+        '--quota.interval',
+        metavar='seconds',
+        dest='quota_interval',
+        required=False,
+        type=float,
+        help='Seconds between two WebHDFS quota refreshes of a directory glob. (default 300)',
+        default=300
+    )
+
+    parser.add_argument(
+        '--quota.user',
+        metavar='user',
+        dest='quota_user',
+        required=False,
+        help='user.name sent with WebHDFS requests. (default "hdfs")',
+        default='hdfs'
+    )
     return parser.parse_args()
 
 
@@ -226,13 +389,20 @@ def main():
     try:
         args = parse_args()
         port = int(args.port)
+        REGISTRY.register(HTTP)
         REGISTRY.register(NameNodeCollector(args.url, args.cluster))
-
-        start_http_server(port)
+        quota = HdfsQuotaCollector(args.url, args.cluster, args.quota_dirs, args.quota_interval, args.quota_user)
+        if quota.globs:
+            poller = Poller()
+            poller.add(quota, quota.interval, args.cluster)
+            REGISTRY.register(quota)
+            REGISTRY.register(poller)
+            poller.start()
+
+        start_exposition_server(port, args.telemetry_path, REGISTRY)
         print "Polling %s. Serving at port: %s" % (args.url, port)
         while True:
-            os.system('bash quota_count.sh')
-            time.sleep(3600)
+            time.sleep(1)
     except KeyboardInterrupt:
         print(" Interrupted")
         exit(0)
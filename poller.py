@@ -0,0 +1,172 @@
+#!/usr/bin/python
+
+import heapq
+import threading
+import time
+from functools import partial
+from multiprocessing.pool import ThreadPool
+
+from prometheus_client.core import GaugeMetricFamily
+
+from concurrent_collector import run_jobs
+from self_metrics import SELF_METRICS
+
+
+class PolledCollector(object):
+    # Keeps the metric families of the last successful refresh of a collector.
+    # The snapshot is a tuple that is swapped as a whole, so a scrape never
+    # sees a half built refresh.
+
+    def __init__(self, collector, interval, cluster):
+        self.collector = collector
+        self.interval = interval
+        self.cluster = cluster
+        self.snapshot = ()
+        self.last_success = 0
+        # a refresh was tried, whether or not it worked
+        self.attempted = False
+
+    def refresh(self, pool=None, slots=None):
+        jobs = SELF_METRICS.jobs(self.collector, self.collector.fetch_jobs())
+        if slots is not None:
+            jobs = [(key, partial(_bounded, slots, self.cluster, job)) for key, job in jobs]
+        results = run_jobs(jobs, pool)
+        self.snapshot = tuple(SELF_METRICS.build(self.collector, results))
+        self.last_success = time.time()
+
+
+class Poller(object):
+    # Refreshes every collector in the background on its own interval and
+    # serves the latest snapshots, so scrapes never wait on hadoop.
+
+    def __init__(self, workers=8):
+        self._polled = []
+        self._workers = workers
+        self._cluster_workers = {}
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        # bumped after every refresh, rendered payloads of an older one are stale
+        self.generation = 0
+
+    def add(self, collector, interval, cluster, workers=None):
+        # workers caps the requests one cluster has in flight, the first
+        # collector added for a cluster sets it
+        self._polled.append(PolledCollector(collector, interval, cluster))
+        self._cluster_workers.setdefault(cluster, workers or self._workers)
+
+    def __len__(self):
+        return len(self._polled)
+
+    def start(self):
+        # refresh_pool runs one refresh per collector, the fetch pools fan out
+        # the http calls of a refresh. They are kept apart so a refresh waiting
+        # on its fetches can never starve them. Every cluster has its own fetch
+        # pool, so a slow cluster only ties up its own threads, and slots
+        # bounds the requests in flight over all clusters together, see Slots.
+        self._refresh_pool = ThreadPool(len(self._polled))
+        self._fetch_pools = dict((cluster, ThreadPool(workers))
+                                 for cluster, workers in self._cluster_workers.items() if workers > 1)
+        self._slots = Slots(self._workers, self._cluster_workers) if len(self._cluster_workers) > 1 else None
+        now = time.time()
+        for polled in self._polled:
+            self._schedule(now, polled)
+
+        thread = threading.Thread(target=self._run, name='poller')
+        thread.daemon = True
+        thread.start()
+
+    def _schedule(self, due, polled):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (due, self._seq, polled))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(timeout)
+                due, seq, polled = heapq.heappop(self._heap)
+            self._refresh_pool.apply_async(self._refresh, (polled,))
+
+    def _refresh(self, polled):
+        started = time.time()
+        try:
+            polled.refresh(self._fetch_pools.get(polled.cluster), self._slots)
+        except Exception as e:
+            print "Refreshing %s failed: %s" % (polled.collector.name, e)
+        polled.attempted = True
+        self.generation += 1
+        # The next refresh is due one interval after this one started, or right
+        # away when the refresh took longer than the interval.
+        self._schedule(max(started + polled.interval, time.time()), polled)
+
+    def ready(self):
+        # Every collector had its first refresh, scrapes no longer miss families
+        return all(polled.attempted for polled in self._polled)
+
+    def describe(self):
+        # Snapshots are empty until the first refresh, so there is nothing
+        # useful to describe at registration time.
+        return []
+
+    def collect(self):
+        last_success = GaugeMetricFamily('hadoop_exporter_last_success_timestamp_seconds',
+                                         'Unix time of the last successful refresh of the collector',
+                                         labels=["cluster", "collector"])
+        age = GaugeMetricFamily('hadoop_exporter_age_seconds',
+                                'Seconds since the last successful refresh of the collector',
+                                labels=["cluster", "collector"])
+        now = time.time()
+        for polled in self._polled:
+            snapshot, success = polled.snapshot, polled.last_success
+            for metric in snapshot:
+                yield metric
+            labels = [polled.cluster, polled.collector.name]
+            last_success.add_metric(labels, success)
+            age.add_metric(labels, now - success if success else float('inf'))
+
+        yield last_success
+        yield age
+
+
+class Slots(object):
+    # Bounds the requests in flight of all clusters together. Every cluster
+    # has one slot of its own and the others are shared, so a cluster whose
+    # hosts hang can only hold the shared slots until they time out and the
+    # other clusters keep refreshing. With more clusters than slots each
+    # still gets its own one.
+
+    def __init__(self, total, clusters):
+        self._cond = threading.Condition()
+        self._shared = max(total - len(clusters), 0)
+        self._own = dict((cluster, 1) for cluster in clusters)
+
+    def acquire(self, cluster):
+        # Whether the slot taken is the cluster's own one
+        with self._cond:
+            while not self._own[cluster] and not self._shared:
+                self._cond.wait()
+            if self._own[cluster]:
+                self._own[cluster] -= 1
+                return True
+            self._shared -= 1
+            return False
+
+    def release(self, cluster, own):
+        with self._cond:
+            if own:
+                self._own[cluster] += 1
+            else:
+                self._shared += 1
+            self._cond.notify_all()
+
+
+def _bounded(slots, cluster, job):
+    own = slots.acquire(cluster)
+    try:
+        return job()
+    finally:
+        slots.release(cluster, own)
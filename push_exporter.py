@@ -0,0 +1,372 @@
+#!/usr/bin/python
+
+import os
+import random
+import struct
+import threading
+import time
+
+import requests
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.exposition import push_to_gateway
+
+import snappy_codec
+from snappy_codec import read_varint, varint
+
+REMOTE_WRITE = 'remote_write'
+PUSHGATEWAY = 'pushgateway'
+
+REMOTE_WRITE_HEADERS = {
+    'Content-Encoding': 'snappy',
+    'Content-Type': 'application/x-protobuf',
+    'X-Prometheus-Remote-Write-Version': '0.1.0',
+    'User-Agent': 'hadoop_exporter',
+}
+
+# The NaN prometheus takes as the end of a series, sent once for a series
+# that is gone. Kept as bytes, the payload bits of a NaN may not survive a float.
+STALE_MARKER = struct.pack('<Q', 0x7ff0000000000002)
+
+
+class Pusher(object):
+    # Pushes the families of the collection scrapes are served from (see
+    # Exposition.families) every interval seconds, to a
+    # remote write url as snappy compressed protobuf WriteRequests of at most
+    # batch_size series each, and / or as text to a Pushgateway. For hosts
+    # prometheus can not reach, or links too slow for the whole text payload.
+    #
+    # With changed_only a series is only sent again when its value changed,
+    # or resend_after seconds after it was last sent, so prometheus does not
+    # take it as stale (it looks back 5 minutes). A series counts as sent once
+    # the batch holding it was taken or spooled. Failed requests are retried
+    # retries times with jittered backoff. Remote write batches that still
+    # fail go to spool and are sent, oldest first, before anything newer once
+    # the receiver is back, the samples of a series have to arrive in order.
+
+    def __init__(self, exposition, url=None, gateway=None, job='hadoop_exporter', labels=None, interval=30,
+                 changed_only=False, resend_after=240, batch_size=2000, retries=5, timeout=30, spool=None):
+        self._exposition = exposition
+        self._url = url
+        self._gateway = gateway
+        self._job = job
+        # external labels of every series, the grouping key on a Pushgateway
+        self._labels = labels or {}
+        self._interval = interval
+        self._changed_only = changed_only
+        self._resend_after = resend_after
+        self._batch_size = batch_size
+        self._retries = retries
+        self._timeout = timeout
+        self._spool = spool
+        self._session = requests.Session()
+        # (sample name, sorted labels) -> [encoded labels, value, unix time] of the series last sent
+        self._sent = {}
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._series = {}
+        self._bytes = {}
+        self._dropped = 0
+        self._last_success = {}
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name='pusher')
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            started = time.time()
+            try:
+                self.push_once()
+            except Exception as e:
+                print "Pushing failed: %s" % e
+            time.sleep(max(started + self._interval - time.time(), 0))
+
+    def push_once(self):
+        families = self._exposition.families()
+        if self._gateway:
+            self._push_gateway(families)
+        if self._url:
+            self._remote_write(families)
+
+    def _remote_write(self, families):
+        now = time.time()
+        series = self._select(families, now)
+        batches = [series[start:start + self._batch_size] for start in range(0, len(series), self._batch_size)]
+        self._count(self._series, REMOTE_WRITE, len(series))
+
+        spool = self._spool
+        while spool is not None and len(spool):
+            if not self._post(spool.oldest()):
+                self._give_up(batches, now)
+                return
+            spool.pop()
+        for index, batch in enumerate(batches):
+            if not self._post(_compress(batch)):
+                self._give_up(batches[index:], now)
+                return
+            self._sent_batch(batch, now)
+
+    def _give_up(self, batches, now):
+        # Spooled batches are sent later and count as sent. Dropped ones do
+        # not, their series are sent again on the next push.
+        for batch in batches:
+            if self._spool is not None:
+                self._spool.put(_compress(batch))
+                self._sent_batch(batch, now)
+            else:
+                with self._lock:
+                    self._dropped += 1
+
+    def _sent_batch(self, batch, now):
+        sent = self._sent
+        for key, labels, value, encoded in batch:
+            if value is None:
+                sent.pop(key, None)
+            else:
+                sent[key] = [labels, value, now]
+
+    def _post(self, body):
+        # True when the receiver took the batch, or refused it for good
+        for attempt in range(self._retries + 1):
+            if attempt:
+                time.sleep(min(2 ** (attempt - 1), 30) * random.uniform(0.5, 1.5))
+            try:
+                response = self._session.post(self._url, data=body, headers=REMOTE_WRITE_HEADERS,
+                                              timeout=self._timeout)
+            except requests.RequestException:
+                self._count(self._requests, (REMOTE_WRITE, 'error'), 1)
+                continue
+            response.close()
+            if response.status_code < 300:
+                self._count(self._requests, (REMOTE_WRITE, 'ok'), 1)
+                self._count(self._bytes, REMOTE_WRITE, len(body))
+                with self._lock:
+                    self._last_success[REMOTE_WRITE] = time.time()
+                return True
+            if 400 <= response.status_code < 500 and response.status_code != 429:
+                # sending the same batch again will not help
+                self._count(self._requests, (REMOTE_WRITE, 'rejected'), 1)
+                return True
+            self._count(self._requests, (REMOTE_WRITE, 'error'), 1)
+        return False
+
+    def _select(self, families, now):
+        # (key, encoded labels, value, encoded TimeSeries) of the series to
+        # send: all series, or with changed_only the ones that changed or are
+        # due again, and a stale marker (value None) for every series sent
+        # before that is gone. What was sent is only updated once a batch is.
+        timestamp = int(now * 1000)
+        series = []
+        seen = set()
+        sent = self._sent
+        for metric in families:
+            for sample in metric.samples:
+                key = (sample.name, tuple(sorted(sample.labels.items())))
+                seen.add(key)
+                value = float(sample.value)
+                state = sent.get(key)
+                if state is None:
+                    labels = encode_labels(sample.name, sample.labels, self._labels)
+                elif (self._changed_only and now - state[2] < self._resend_after and
+                      (state[1] == value or (value != value and state[1] != state[1]))):
+                    continue
+                else:
+                    labels = state[0]
+                series.append((key, labels, value, encode_series(labels, struct.pack('<d', value), timestamp)))
+        for key, state in sent.items():
+            if key not in seen:
+                series.append((key, state[0], None, encode_series(state[0], STALE_MARKER, timestamp)))
+        return series
+
+    def _push_gateway(self, families):
+        # The Pushgateway keeps the last push of a group only, a push that
+        # failed for good is not worth keeping.
+        registry = _Families(families)
+        for attempt in range(self._retries + 1):
+            if attempt:
+                time.sleep(min(2 ** (attempt - 1), 30) * random.uniform(0.5, 1.5))
+            try:
+                push_to_gateway(self._gateway, self._job, registry, self._labels, self._timeout)
+            except IOError:
+                self._count(self._requests, (PUSHGATEWAY, 'error'), 1)
+                continue
+            self._count(self._requests, (PUSHGATEWAY, 'ok'), 1)
+            self._count(self._series, PUSHGATEWAY, sum(len(metric.samples) for metric in families))
+            with self._lock:
+                self._last_success[PUSHGATEWAY] = time.time()
+            return
+
+    def _count(self, counter, key, value):
+        with self._lock:
+            counter[key] = counter.get(key, 0) + value
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        requests_total = CounterMetricFamily('hadoop_exporter_push_requests', 'Push requests by result',
+                                             labels=['destination', 'result'])
+        series = CounterMetricFamily('hadoop_exporter_push_series', 'Series pushed, stale markers included',
+                                     labels=['destination'])
+        sent_bytes = CounterMetricFamily('hadoop_exporter_push_sent_bytes',
+                                         'Compressed bytes of the remote write batches the receiver took',
+                                         labels=['destination'])
+        last_success = GaugeMetricFamily('hadoop_exporter_push_last_success_timestamp_seconds',
+                                         'Unix time of the last push the destination took',
+                                         labels=['destination'])
+        dropped = CounterMetricFamily('hadoop_exporter_push_dropped_batches',
+                                      'Remote write batches given up on, not sent after all retries or '
+                                      'pushed out of the full spool')
+        spooled = GaugeMetricFamily('hadoop_exporter_push_spool_bytes',
+                                    'Bytes of the remote write batches waiting in the spool')
+        with self._lock:
+            for (destination, result), value in self._requests.items():
+                requests_total.add_metric([destination, result], value)
+            for destination, value in self._series.items():
+                series.add_metric([destination], value)
+            for destination, value in self._bytes.items():
+                sent_bytes.add_metric([destination], value)
+            for destination, value in self._last_success.items():
+                last_success.add_metric([destination], value)
+            dropped.add_metric([], self._dropped + (self._spool.dropped if self._spool is not None else 0))
+        spooled.add_metric([], self._spool.bytes if self._spool is not None else 0)
+
+        for metric in (requests_total, series, sent_bytes, last_success, dropped, spooled):
+            yield metric
+
+
+class Spool(object):
+    # Remote write batches the receiver did not take, a file each, named by
+    # a sequence number. They outlive a restart of the exporter. When they
+    # take more than max_bytes the oldest are deleted.
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._files = sorted(name for name in os.listdir(directory) if name.endswith('.snappy'))
+        self._sizes = dict((name, os.path.getsize(self._path(name))) for name in self._files)
+        self._next = int(self._files[-1].split('.')[0]) + 1 if self._files else 0
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._files)
+
+    @property
+    def bytes(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def put(self, body):
+        name = '%020d.snappy' % self._next
+        self._next += 1
+        # written under another name first, a crash never leaves half a batch
+        with open(self._path(name) + '.tmp', 'wb') as f:
+            f.write(body)
+        os.rename(self._path(name) + '.tmp', self._path(name))
+        with self._lock:
+            self._files.append(name)
+            self._sizes[name] = len(body)
+            while self._files and sum(self._sizes.values()) > self._max_bytes:
+                self._remove(self._files[0])
+                self.dropped += 1
+
+    def oldest(self):
+        with open(self._path(self._files[0]), 'rb') as f:
+            return f.read()
+
+    def pop(self):
+        with self._lock:
+            self._remove(self._files[0])
+
+    def _remove(self, name):
+        self._files.remove(name)
+        del self._sizes[name]
+        os.remove(self._path(name))
+
+    def _path(self, name):
+        return os.path.join(self._directory, name)
+
+
+def _compress(batch):
+    return snappy_codec.compress(''.join(encoded for key, labels, value, encoded in batch))
+
+
+class _Families(object):
+    # The families of one collection, as the registry push_to_gateway wants
+    def __init__(self, families):
+        self._families = families
+
+    def collect(self):
+        return self._families
+
+
+def encode_labels(name, labels, external):
+    # The Label messages of a TimeSeries, sorted by name as remote write
+    # wants them. Labels of the series win over the external ones.
+    pairs = dict(external)
+    pairs.update(labels)
+    pairs['__name__'] = name
+    return ''.join(_message(1, _message(1, _utf8(key)) + _message(2, _utf8(value)))
+                   for key, value in sorted(pairs.items()))
+
+
+def encode_series(labels, value, timestamp):
+    # One TimeSeries with one Sample, as field 1 of a WriteRequest. value is
+    # the little endian double, timestamp in ms.
+    sample = '\x09' + value + '\x10' + varint(timestamp)
+    return _message(1, labels + _message(2, sample))
+
+
+def decode_write_request(body):
+    # [(labels dict, [(value, timestamp)])] of an uncompressed WriteRequest,
+    # for the stand-in receiver
+    series = []
+    for field, timeseries in _fields(body):
+        if field != 1:
+            continue
+        labels = {}
+        samples = []
+        for ts_field, value in _fields(timeseries):
+            if ts_field == 1:
+                pair = dict(_fields(value))
+                labels[pair.get(1, '').decode('utf-8')] = pair.get(2, '').decode('utf-8')
+            elif ts_field == 2:
+                sample = dict(_fields(value))
+                samples.append((sample.get(1, 0.0), sample.get(2, 0)))
+        series.append((labels, samples))
+    return series
+
+
+def _fields(message):
+    # (field number, value) of a protobuf message: length delimited values as
+    # str, varints as int, 64 bit values as double
+    pos = 0
+    end = len(message)
+    while pos < end:
+        key, pos = read_varint(message, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = read_varint(message, pos)
+        elif wire == 1:
+            value = struct.unpack_from('<d', message, pos)[0]
+            pos += 8
+        elif wire == 2:
+            length, pos = read_varint(message, pos)
+            value = message[pos:pos + length]
+            pos += length
+        else:
+            raise ValueError('unexpected protobuf wire type {0}'.format(wire))
+        yield field, value
+
+
+def _message(field, payload):
+    # a length delimited field
+    return chr((field << 3) | 2) + varint(len(payload)) + payload
+
+
+def _utf8(text):
+    return text.encode('utf-8') if isinstance(text, unicode) else str(text)
@@ -1,8 +1,6 @@
 #!/usr/bin/python
 
-import re
 import time
-import requests
 import urllib
 import argparse
 from pprint import pprint
@@ -10,101 +8,205 @@ from pprint import pprint
 import json
 import os
 from sys import exit
-from prometheus_client import start_http_server
-from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from functools import partial
+from prometheus_client.core import REGISTRY
+
+from concurrent_collector import collect_once
+from exposition import start_exposition_server
+from http_client import HTTP
+from metric_descriptors import DescriptorTable, add_sample
+from ha_state import ha_state, is_passive, resourcemanager_state
 
 DEBUG = int(os.environ.get('DEBUG', '0'))
 
 
 class YarnQueueCollector(object):
-    # The build statuses we want to export about.
+    name = 'queue'
+
+    # The build statuses we want to export about, of fair scheduler queues.
     queue_statues = {
         "allocatedContainers":"allocatedContainers",
-        "clusterResources":"clusterResources",
-        "demandResources":"demandResources",
-        "fairResources":"fairResources",
         "numActiveApps":"numActiveApps",
         "numPendingApps":"numPendingApps",
         "reservedContainers":"reservedContainers",
+    }
+
+    # Of capacity scheduler queues, leaf queues have the application and
+    # container counts.
+    capacity_statues = {
+        "capacity":"Configured capacity in percent of the parent queue",
+        "usedCapacity":"Used capacity in percent of the configured capacity",
+        "maxCapacity":"Maximum capacity in percent of the parent queue",
+        "absoluteCapacity":"Configured capacity in percent of the cluster",
+        "absoluteUsedCapacity":"Used capacity in percent of the cluster",
+        "absoluteMaxCapacity":"Maximum capacity in percent of the cluster",
+        "numApplications":"numApplications",
+        "numActiveApplications":"numActiveApplications",
+        "numPendingApplications":"numPendingApplications",
+        "numContainers":"numContainers",
+        "pendingContainers":"pendingContainers",
+        "maxApplications":"maxApplications",
+    }
+
+    # Resources of both, one series per res_type
+    resource_statues = {
+        "clusterResources":"clusterResources",
+        "demandResources":"demandResources",
+        "fairResources":"fairResources",
         "steadyFairResources":"steadyFairResources",
         "usedResources":"usedResources",
+        "resourcesUsed":"resourcesUsed",
+        "usedAMResource":"usedAMResource",
+        "AMResourceLimit":"AMResourceLimit",
     }
 
     def __init__(self, target, cluster):
         self._cluster = cluster
         self._targets = target.rstrip("/").split(';')
         self._prefix = 'yarn_queue_'
+        self._addresses = dict((url, split_host_port(url)) for url in self._targets)
+        queue_statues = dict(self.queue_statues, **self.capacity_statues)
+        self._descriptors = DescriptorTable(self._prefix, queue_statues,
+                                            ["cluster", "rm_host", "rm_port", "queue_name", "queue_path"])
+        self._resource_descriptors = DescriptorTable(self._prefix, self.resource_statues,
+                                                     ["cluster", "rm_host", "rm_port", "queue_name", "queue_path",
+                                                      "res_type"])
+        # the queue index of every resourcemanager, kept between scrapes
+        self._indexes = {}
 
     def collect(self):
+        return collect_once(self)
+
+    def fetch_jobs(self):
+        # Request data from resourcemanager scheduler API, one job per resourcemanager
+        return [(url, partial(self._request_data, url)) for url in self._targets]
+
+    def build_metrics(self, results):
         self._setup_empty_prometheus_metrics()
-        # Request data from namenode jmx API
         for url in self._targets:
-            self._target = url
-            self.rm_host, self.rm_port = split_host_port(self._target)
-            beans = self._request_data()
-            self._get_metrics(beans)
-
+            if results.get(url):
+                self._get_metrics(url, walk_queues(results[url]))
 
-        for status in self.queue_statues:
-            yield self._prometheus_metrics[status]
+        for family in self._prometheus_metrics.values():
+            yield family
 
-    def _request_data(self):
+    def _request_data(self, target):
+        # The scheduler of a standby resourcemanager is stale, only the active one is asked
+        if is_passive(ha_state(self._targets, target, resourcemanager_state)):
+            return []
         # Request exactly the information we need from namenode
-        url = '{0}/ws/v1/cluster/scheduler'.format(self._target)
+        url = '{0}/ws/v1/cluster/scheduler'.format(target)
 
         def parsejobs(myurl):
-            response = requests.get(myurl) #, params=params, auth=(self._user, self._password))
-            if response.status_code != requests.codes.ok:
+            result = HTTP.get_json(myurl) #, params=params, auth=(self._user, self._password))
+            if result is None:
                 return[]
-            result = response.json()
             if DEBUG:
                 pprint(result)
 
-            return result['scheduler']['schedulerInfo']['rootQueue']
+            return result['scheduler']['schedulerInfo']
 
         return parsejobs(url)
 
     def _setup_empty_prometheus_metrics(self):
         # The metrics we want to export.
-        self._prometheus_metrics = {}
-        for status in self.queue_statues:
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', status).lower()
-            if "Resources" in status:
-                self._prometheus_metrics[status] = GaugeMetricFamily(
-                    self._prefix + snake_case,
-                    self.queue_statues[status],
-                    labels=["cluster", "rm_host", "rm_port", "queue_name", "res_type"])
-            else:
-                    self._prometheus_metrics[status] = GaugeMetricFamily(self._prefix + snake_case,
-                                      self.queue_statues[status], labels=["cluster", "rm_host", "rm_port", "queue_name"])
-
-
-    def _get_metrics(self, beans):
-        self._tree_list(beans)
-
-
-    def _tree_list(self, root):
-        if "childQueues" in root:
-            self._set_metrics(root)
-            self._tree_list(root["childQueues"])
-        elif "queue" in root:
-            self._tree_list(root["queue"])
-        elif isinstance (root, list):
-            for queue in root:
-                self._tree_list(queue)
-        else:
-            self._set_metrics(root)
-
-    def _set_metrics(self, root):
-        queue_name = root["queueName"]
-        for key in root:
-            if key in self.queue_statues:
-                if "Resources" in key:
-                    resources_dict = root[key]
-                    for res_key in resources_dict:
-                        self._prometheus_metrics[key].add_metric([self._cluster, self.rm_host, self.rm_port, queue_name, res_key], resources_dict[res_key])
-                else:
-                    self._prometheus_metrics[key].add_metric([self._cluster, self.rm_host, self.rm_port, queue_name], root[key])
+        self._prometheus_metrics = self._descriptors.families()
+        self._prometheus_metrics.update(self._resource_descriptors.families())
+        # (key, family) pairs looked up once per scrape instead of once per queue
+        self._queue_families = [(d.key, self._prometheus_metrics[d.key]) for d in self._descriptors]
+        self._resource_families = [(d.key, self._prometheus_metrics[d.key]) for d in self._resource_descriptors]
+
+    def _get_metrics(self, url, queues):
+        index = self._index(url, queues)
+        for entry, (path, queue) in zip(index.entries, queues):
+            for key, family in self._queue_families:
+                value = queue.get(key)
+                if value is not None and isinstance(value, NUMBERS):
+                    add_sample(family, entry.labels, value)
+            for key, family in self._resource_families:
+                resources = queue.get(key)
+                # usedResources of the capacity scheduler is a "<memory:0, vCores:0>" string
+                if resources and isinstance(resources, dict):
+                    for res_type, value in resources.iteritems():
+                        # hadoop 3 adds a resourceInformations list next to memory and vCores
+                        if isinstance(value, NUMBERS):
+                            add_sample(family, entry.resource_labels(res_type), value)
+
+    def _index(self, url, queues):
+        # The index of the last scrape is reused as long as the same queues
+        # are walked in the same order, entries of queues that are still
+        # there are carried over when it changed.
+        paths = tuple(path for path, queue in queues)
+        index = self._indexes.get(url)
+        if index is not None and index.paths == paths:
+            return index
+        rm_host, rm_port = self._addresses[url]
+        previous = dict((entry.path, entry) for entry in index.entries) if index is not None else {}
+        entries = []
+        for path, queue in queues:
+            entry = previous.get(path)
+            if entry is None or entry.labels["queue_name"] != queue["queueName"]:
+                entry = QueueEntry(path, {"cluster": self._cluster, "rm_host": rm_host, "rm_port": rm_port,
+                                          "queue_name": queue["queueName"], "queue_path": path})
+            entries.append(entry)
+        index = QueueIndex(paths, entries)
+        self._indexes[url] = index
+        return index
+
+
+NUMBERS = (int, long, float)
+
+
+class QueueIndex(object):
+    __slots__ = ('paths', 'entries')
+
+    def __init__(self, paths, entries):
+        self.paths = paths
+        self.entries = entries
+
+
+class QueueEntry(object):
+    # The labels of one queue, shared by all of its samples
+    __slots__ = ('path', 'labels', '_resource_labels')
+
+    def __init__(self, path, labels):
+        self.path = path
+        self.labels = labels
+        self._resource_labels = {}
+
+    def resource_labels(self, res_type):
+        labels = self._resource_labels.get(res_type)
+        if labels is None:
+            labels = dict(self.labels, res_type=res_type)
+            self._resource_labels[res_type] = labels
+        return labels
+
+
+def walk_queues(scheduler_info):
+    # [(queue path, queue)] of a fair or capacity scheduler, parents before
+    # their children. Walked with a stack instead of recursion, so no queue
+    # tree is too deep. Fair scheduler queue names are full paths already,
+    # capacity scheduler ones are relative to the parent queue.
+    queues = []
+    stack = [(scheduler_info.get("rootQueue", scheduler_info), None)]
+    while stack:
+        queue, parent = stack.pop()
+        path = queue.get("queuePath") or queue["queueName"]
+        if parent is not None and not path.startswith(parent + "."):
+            path = parent + "." + path
+        queues.append((path, queue))
+
+        children = queue.get("childQueues") or queue.get("queues")
+        if children:
+            # {"queue": [...]}, a bare list in older fair schedulers, and a
+            # single child may come as an object instead of a list
+            if isinstance(children, dict):
+                children = children.get("queue") or []
+            if isinstance(children, dict):
+                children = [children]
+            for child in reversed(children):
+                stack.append((child, path))
+    return queues
 
 def split_host_port(url):
     protocol, s1 = urllib.splittype(url)
@@ -126,7 +228,7 @@ def parse_args():
         metavar='url',
         dest='url',
         required=False,
-        help='Hadoop Yarn FairScheduler JMX URL. (default "http://localhost:8088")',
+        help='Hadoop Yarn ResourceManager URL, with a fair or capacity scheduler. (default "http://localhost:8088")',
         default='http://localhost:8088'
     )
     parser.add_argument(
@@ -157,10 +259,11 @@ def main():
     try:
         args = parse_args()
         port = int(args.port)
+        REGISTRY.register(HTTP)
         REGISTRY.register(YarnQueueCollector(args.url, args.cluster))
         #REGISTRY.register(ResourceManagerNodeCollector(args.url, args.cluster))
 
-        start_http_server(port)
+        start_exposition_server(port, args.telemetry_path, REGISTRY)
         print "Polling %s. Serving at port: %s" % (args.url, port)
         while True:
             time.sleep(1)
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+
+import fnmatch
+import time
+import urllib
+from functools import partial
+from multiprocessing.pool import ThreadPool
+
+from prometheus_client.core import GaugeMetricFamily
+
+from http_client import HTTP, HttpError
+from json_stream import iter_array_items
+from ha_state import ha_state, is_passive, namenode_state
+from metric_descriptors import DescriptorTable, add_sample
+
+
+class HdfsQuotaCollector(object):
+    name = 'quota'
+
+    # The same families quota_count.sh used to feed through `hadoop fs -count -q`
+    quota_statuses = {
+        "TotalFiles": "TotalFiles",
+        "RemainFiles": "RemainFiles",
+        "TotalSpace": "TotalSpace",
+        "RemainSpace": "RemainSpace",
+    }
+
+    def __init__(self, target, cluster, dirs='/user/*', interval=300, user='hdfs', workers=8):
+        # target is the namenode jmx url(s) given with -nnurl, webhdfs is served
+        # next to /jmx on the namenode http port.
+        self._cluster = cluster
+        self._targets = target.rstrip("/").split(';')
+        self._user = user
+        self._prefix = 'hadoop_quota_'
+        self.globs = parse_dirs(dirs, interval)
+        self._descriptors = DescriptorTable(self._prefix, self.quota_statuses, ["cluster", "dir"])
+        self._pool = ThreadPool(workers)
+        # dir -> (quota values, unix time they were fetched)
+        self._values = {}
+        self._glob_dirs = {}
+        self._next_refresh = {}
+        # namenodes before 3.0 do not know GETQUOTAUSAGE, set once one
+        # rejects it as an unsupported operation
+        self._content_summary = False
+
+    @property
+    def interval(self):
+        # how often the poller should look for globs that are due
+        return min(interval for pattern, interval in self.globs)
+
+    def fetch_jobs(self):
+        # Run by the poller, scrapes only read the cached values in collect()
+        now = time.time()
+        return [(pattern, partial(self._refresh_glob, pattern)) for pattern, interval in self.globs
+                if self._next_refresh.get(pattern, 0) <= now]
+
+    def build_metrics(self, results):
+        now = time.time()
+        values = dict(self._values)
+        for pattern, interval in self.globs:
+            if results.get(pattern) is None:
+                # failed refreshes are retried on the next poll
+                continue
+            dirs, fetched = results[pattern]
+            self._next_refresh[pattern] = now + interval
+            # a dir whose quota could not be fetched keeps its last values
+            self._glob_dirs[pattern] = set(dirs)
+            values.update(fetched)
+
+        # dirs that no longer match any glob are dropped
+        matched = set()
+        for dirs in self._glob_dirs.values():
+            matched.update(dirs)
+        self._values = dict((path, value) for path, value in values.items() if path in matched)
+        # the families are served by collect(), so the ages are those of the scrape
+        return ()
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        now = time.time()
+        values = self._values
+        metrics = self._descriptors.families()
+        age = GaugeMetricFamily(self._prefix + 'age_seconds',
+                                'Seconds since the quota of the dir was fetched', labels=["cluster", "dir"])
+        for path in sorted(values):
+            quota, fetched = values[path]
+            labels = {"cluster": self._cluster, "dir": path}
+            for status in self.quota_statuses:
+                add_sample(metrics[status], labels, quota[status])
+            add_sample(age, labels, now - fetched)
+
+        for status in self.quota_statuses:
+            yield metrics[status]
+        yield age
+
+    def _refresh_glob(self, pattern):
+        base = self._active_target()
+        if base is None:
+            return None
+        dirs = self._expand(base, pattern)
+        if dirs is None:
+            return None
+        fetched = self._pool.map(partial(self._fetch_quota, base), dirs)
+        return dirs, dict((path, value) for path, value in zip(dirs, fetched) if value is not None)
+
+    def _active_target(self):
+        # webhdfs on a standby namenode answers with a StandbyException
+        for url in self._targets:
+            if not is_passive(ha_state(self._targets, url, namenode_state)):
+                return url[:-len('/jmx')] if url.endswith('/jmx') else url
+        return None
+
+    def _webhdfs(self, base, path, op):
+        return '{0}/webhdfs/v1{1}?op={2}&user.name={3}'.format(
+            base, urllib.quote(path), op, urllib.quote(self._user))
+
+    def _expand(self, base, pattern):
+        # Expands the glob one path component at a time with LISTSTATUS
+        dirs = ['/']
+        for component in pattern.strip('/').split('/'):
+            if not any(char in component for char in '*?['):
+                dirs = [_join(parent, component) for parent in dirs]
+                continue
+            expanded = []
+            for parent in dirs:
+                children = self._list_dirs(base, parent)
+                if children is None:
+                    return None
+                expanded.extend(_join(parent, child) for child in children if fnmatch.fnmatchcase(child, component))
+            dirs = expanded
+        return dirs
+
+    def _list_dirs(self, base, path):
+        # The dirs in path, [] when path does not exist, None when listing it
+        # failed and the glob can not be expanded this time
+        code, chunks = HTTP.get_stream_status(self._webhdfs(base, path, 'LISTSTATUS'))
+        if chunks is None:
+            return None
+        try:
+            if code != 200:
+                ''.join(chunks)
+                return [] if code == 404 else None
+            return sorted(status['pathSuffix'] for status in iter_array_items(chunks, ('FileStatuses', 'FileStatus'))
+                          if status['type'] == 'DIRECTORY')
+        except (HttpError, ValueError):
+            return None
+
+    def _fetch_quota(self, base, path):
+        if not self._content_summary:
+            status, result = HTTP.get_json_status(self._webhdfs(base, path, 'GETQUOTAUSAGE'))
+            if status == 200 and result is not None:
+                usage = result['QuotaUsage']
+                return quota_values(usage['quota'], usage['fileAndDirectoryCount'],
+                                    usage['spaceQuota'], usage['spaceConsumed']), time.time()
+            if not _unsupported(result):
+                # down, timed out or failing: GETCONTENTSUMMARY walks the whole
+                # subtree under the namenode lock, it is no retry
+                return None
+            self._content_summary = True
+
+        result = HTTP.get_json(self._webhdfs(base, path, 'GETCONTENTSUMMARY'))
+        if result is None:
+            return None
+        summary = result['ContentSummary']
+        return quota_values(summary['quota'], summary['directoryCount'] + summary['fileCount'],
+                            summary['spaceQuota'], summary['spaceConsumed']), time.time()
+
+
+def quota_values(quota, count, space_quota, space_consumed):
+    # Same values `hadoop fs -count -q` printed: a missing quota is "none"
+    # (-1 once parsed) with "inf" remaining.
+    inf = float('inf')
+    return {
+        "TotalFiles": quota if quota >= 0 else -1,
+        "RemainFiles": quota - count if quota >= 0 else inf,
+        "TotalSpace": space_quota if space_quota >= 0 else -1,
+        "RemainSpace": space_quota - space_consumed if space_quota >= 0 else inf,
+    }
+
+
+def parse_dirs(dirs, interval):
+    # "/user/*,/tmp=60" -> [("/user/*", interval), ("/tmp", 60.0)]
+    globs = []
+    for item in dirs.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' in item:
+            pattern, item_interval = item.rsplit('=', 1)
+            globs.append((pattern, float(item_interval)))
+        else:
+            globs.append((item, float(interval)))
+    return globs
+
+
+def _unsupported(result):
+    # Whether webhdfs answered with the error of an op it does not know
+    exception = result.get('RemoteException', {}).get('exception') if isinstance(result, dict) else None
+    return exception in ('IllegalArgumentException', 'UnsupportedOperationException')
+
+
+def _join(parent, child):
+    return parent.rstrip('/') + '/' + child
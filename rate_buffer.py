@@ -0,0 +1,293 @@
+#!/usr/bin/python
+
+import time
+from array import array
+
+from prometheus_client.core import Metric
+
+from concurrent_collector import collect_once
+
+# The keys of a --derived.file and of each of its series
+#
+# {"samples": 60,
+#  "series": [
+#    {"source": "hadoop_resourcemanager_apps_submitted", "function": "rate", "window": 600, "per": 60,
+#     "name": "hadoop_resourcemanager_apps_submitted_per_minute"},
+#    {"source": "hadoop_namenode_capacity_remaining", "function": "time_to_zero", "window": 21600,
+#     "name": "hadoop_namenode_capacity_seconds_to_full"}]}
+CONFIG_KEYS = ('samples', 'series')
+SERIES_KEYS = ('source', 'function', 'window', 'per', 'name', 'help')
+
+# rate: increase per `per` seconds of a counter, resets taken into account
+# deriv: least squares slope per `per` seconds of a gauge
+# time_to_zero: seconds until the gauge reaches 0 at that slope, no sample
+# while it does not go down
+FUNCTIONS = ('rate', 'deriv', 'time_to_zero')
+
+# What --derived exports without a --derived.file
+DEFAULT_SERIES = [
+    {"source": "hadoop_resourcemanager_apps_submitted", "function": "rate", "window": 600, "per": 60,
+     "name": "hadoop_resourcemanager_apps_submitted_per_minute",
+     "help": "Applications submitted per minute over the last 10 minutes"},
+    {"source": "hadoop_resourcemanager_apps_completed", "function": "rate", "window": 600, "per": 60,
+     "name": "hadoop_resourcemanager_apps_completed_per_minute",
+     "help": "Applications completed per minute over the last 10 minutes"},
+    {"source": "hadoop_resourcemanager_apps_failed", "function": "rate", "window": 600, "per": 60,
+     "name": "hadoop_resourcemanager_apps_failed_per_minute",
+     "help": "Applications failed per minute over the last 10 minutes"},
+    {"source": "hadoop_namenode_blocks_total", "function": "deriv", "window": 3600, "per": 3600,
+     "name": "hadoop_namenode_blocks_total_growth_per_hour",
+     "help": "Growth of BlocksTotal per hour over the last hour"},
+    {"source": "hadoop_namenode_files_total", "function": "deriv", "window": 3600, "per": 3600,
+     "name": "hadoop_namenode_files_total_growth_per_hour",
+     "help": "Growth of FilesTotal per hour over the last hour"},
+    {"source": "hadoop_namenode_under_replicated_blocks", "function": "deriv", "window": 900, "per": 60,
+     "name": "hadoop_namenode_under_replicated_blocks_growth_per_minute",
+     "help": "Growth of UnderReplicatedBlocks per minute over the last 15 minutes"},
+    {"source": "hadoop_namenode_capacity_remaining", "function": "time_to_zero", "window": 21600,
+     "name": "hadoop_namenode_capacity_seconds_to_full",
+     "help": "Seconds until CapacityRemaining reaches 0 at its slope over the last 6 hours"},
+]
+
+
+class RingBuffers(object):
+    # The last capacity (time, value) pairs of many series, in two flat
+    # arrays of doubles instead of an object per sample: the series in slot n
+    # owns [n * capacity, (n + 1) * capacity) of both. Slots of series not
+    # seen for a while are handed to new ones.
+    #
+    # Pairs are kept at least step seconds apart, so capacity pairs cover a
+    # window of capacity * step seconds whatever the poll interval. The
+    # newest pair is always the last value seen: a value arriving within
+    # step of the pair before it replaces the newest one.
+
+    def __init__(self, capacity, step=0):
+        self.capacity = max(capacity, 2)
+        self.step = step
+        self._times = array('d')
+        self._values = array('d')
+        # index of the oldest pair and number of pairs of every slot
+        self._first = array('l')
+        self._length = array('l')
+        self._slots = {}
+        self._free = []
+
+    def __len__(self):
+        return len(self._slots)
+
+    def append(self, key, t, value):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = self._allocate()
+        capacity = self.capacity
+        base = slot * capacity
+        first = self._first[slot]
+        length = self._length[slot]
+        if length >= 2 and t - self._times[base + (first + length - 2) % capacity] < self.step:
+            at = base + (first + length - 1) % capacity
+        elif length < capacity:
+            at = base + (first + length) % capacity
+            self._length[slot] = length + 1
+        else:
+            at = base + first
+            self._first[slot] = (first + 1) % capacity
+        self._times[at] = t
+        self._values[at] = value
+
+    def expire(self, before):
+        # Frees the slots of the series whose newest pair is older than before
+        for key, slot in self._slots.items():
+            if self._times[slot * self.capacity + (self._first[slot] + self._length[slot] - 1) %
+                           self.capacity] < before:
+                del self._slots[key]
+                self._length[slot] = 0
+                self._free.append(slot)
+
+    def rate(self, key, since):
+        # Increase per second of a counter over the pairs since, a value
+        # below the one before it is a restart counting from 0
+        slot = self._slots.get(key)
+        indexes = self._since(slot, since) if slot is not None else ()
+        if len(indexes) < 2:
+            return None
+        values = self._values
+        increase = 0.0
+        previous = values[indexes[0]]
+        for at in indexes[1:]:
+            value = values[at]
+            increase += value - previous if value >= previous else value
+            previous = value
+        elapsed = self._times[indexes[-1]] - self._times[indexes[0]]
+        return increase / elapsed if elapsed > 0 else None
+
+    def deriv(self, key, since):
+        # Least squares slope per second over the pairs since
+        slot = self._slots.get(key)
+        indexes = self._since(slot, since) if slot is not None else ()
+        if len(indexes) < 2:
+            return None
+        times = self._times
+        values = self._values
+        # relative to the first pair, epoch seconds squared lose precision
+        origin = times[indexes[0]]
+        n = float(len(indexes))
+        sum_t = sum_v = sum_tt = sum_tv = 0.0
+        for at in indexes:
+            t = times[at] - origin
+            v = values[at]
+            sum_t += t
+            sum_v += v
+            sum_tt += t * t
+            sum_tv += t * v
+        denominator = n * sum_tt - sum_t * sum_t
+        if denominator <= 0:
+            return None
+        return (n * sum_tv - sum_t * sum_v) / denominator
+
+    def last(self, key):
+        slot = self._slots.get(key)
+        if slot is None or not self._length[slot]:
+            return None
+        first = self._first[slot]
+        return self._values[slot * self.capacity + (first + self._length[slot] - 1) % self.capacity]
+
+    def _since(self, slot, since):
+        # indexes into the arrays of the pairs of a slot from since on, oldest first
+        capacity = self.capacity
+        base = slot * capacity
+        first = self._first[slot]
+        indexes = [base + (first + i) % capacity for i in range(self._length[slot])]
+        times = self._times
+        return [at for at in indexes if times[at] >= since]
+
+    def _allocate(self):
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._first)
+            self._times.extend([0.0] * self.capacity)
+            self._values.extend([0.0] * self.capacity)
+            self._first.append(0)
+            self._length.append(0)
+        self._first[slot] = 0
+        self._length[slot] = 0
+        return slot
+
+
+class DerivedSeries(object):
+    # One derived family: function of the samples of the source family over
+    # the last window seconds, scaled to per seconds.
+
+    def __init__(self, series):
+        unknown = set(series) - set(SERIES_KEYS)
+        if unknown:
+            raise ValueError('unknown derived series settings: {0}'.format(', '.join(sorted(unknown))))
+        if 'source' not in series:
+            raise ValueError('every derived series needs a "source" family')
+        self.source = series['source']
+        self.function = series.get('function', 'rate')
+        if self.function not in FUNCTIONS:
+            raise ValueError('function of {0} must be one of {1}'.format(self.source, ', '.join(FUNCTIONS)))
+        self.window = float(series.get('window', 600))
+        if self.window <= 0:
+            raise ValueError('the window of {0} must be positive'.format(self.source))
+        self.per = float(series.get('per', 1))
+        self.name = series.get('name', '{0}_{1}'.format(self.source, self.function))
+        self.documentation = series.get('help', '{0} of {1} over {2:g}s'.format(self.function, self.source,
+                                                                                self.window))
+
+    def value(self, buffers, key, now):
+        since = now - self.window
+        if self.function == 'rate':
+            rate = buffers.rate(key, since)
+            return rate * self.per if rate is not None else None
+        slope = buffers.deriv(key, since)
+        if slope is None:
+            return None
+        if self.function == 'deriv':
+            return slope * self.per
+        last = buffers.last(key)
+        return last / -slope if slope < 0 and last > 0 else None
+
+
+class Derived(object):
+    # The derived series of --derived / --derived.file. Every collector they
+    # wrap keeps its own ring buffers of samples pairs per source series,
+    # shared by the derived series of the same source.
+
+    def __init__(self, config=None, samples=60):
+        config = config or {}
+        if not isinstance(config, dict):
+            raise ValueError('the derived series config must be a mapping')
+        unknown = set(config) - set(CONFIG_KEYS)
+        if unknown:
+            raise ValueError('unknown derived series settings: {0}'.format(', '.join(sorted(unknown))))
+        self.samples = config.get('samples', samples)
+        self.series = [DerivedSeries(series) for series in config.get('series', DEFAULT_SERIES)]
+        # source family -> its derived series
+        self.of = {}
+        for series in self.series:
+            self.of.setdefault(series.source, []).append(series)
+        # source family -> the longest window of its derived series, what its buffers cover
+        self.windows = dict((source, max(series.window for series in derived))
+                            for source, derived in self.of.items())
+
+    def wrap(self, collector):
+        return DerivedCollector(collector, self) if self.series else collector
+
+
+class DerivedCollector(object):
+    # Passes the families a collector builds through and adds the derived
+    # ones, from the values of every refresh kept in ring buffers. It has the
+    # interface of a collector, like LimitedCollector.
+
+    def __init__(self, collector, derived):
+        self.collector = collector
+        self.name = collector.name
+        self._cluster = getattr(collector, '_cluster', '')
+        self._derived = derived
+        # one buffer per source family, keeping samples pairs over the longest
+        # window of its derived series, a shorter one reads the newer pairs
+        self._buffers = dict((source, RingBuffers(derived.samples, window / derived.samples))
+                             for source, window in derived.windows.items())
+
+    def fetch_jobs(self):
+        return self.collector.fetch_jobs()
+
+    def build_metrics(self, results):
+        return self._derive(self.collector.build_metrics(results))
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        return collect_once(self)
+
+    def _derive(self, metrics):
+        now = time.time()
+        derived = []
+        for metric in metrics:
+            yield metric
+            of = self._derived.of.get(metric.name)
+            if not of:
+                continue
+            buffers = self._buffers[metric.name]
+            families = [Metric(series.name, series.documentation, 'gauge') for series in of]
+            for sample in metric.samples:
+                if sample.name != metric.name and sample.name != metric.name + '_total':
+                    continue
+                if sample.value != sample.value:
+                    # a target that is down, its history is kept as it was
+                    continue
+                key = tuple(sorted(sample.labels.items()))
+                buffers.append(key, now, float(sample.value))
+                for series, family in zip(of, families):
+                    value = series.value(buffers, key, now)
+                    if value is not None:
+                        family.add_sample(series.name, sample.labels, value)
+            derived.extend(families)
+        # a series keeps its history through a few failed refreshes
+        for source, window in self._derived.windows.items():
+            self._buffers[source].expire(now - window)
+        for family in derived:
+            yield family
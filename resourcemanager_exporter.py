@@ -1,24 +1,34 @@
 #!/usr/bin/python
 
-import re
 import time
-import requests
 import urllib
 import argparse
 from pprint import pprint
 
 import os
 from sys import exit
-from prometheus_client import start_http_server
-from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from functools import partial
+from prometheus_client.core import REGISTRY, CounterMetricFamily
+
+from concurrent_collector import collect_once
+from exposition import start_exposition_server
+from http_client import HTTP, HttpError
+from json_decoder import DECODER
+from json_stream import iter_array_items
+from metric_descriptors import DescriptorTable, LabelCache, add_sample
+from host_table import HostTable
+from ha_state import ACTIVE, ha_state, is_passive, resourcemanager_state
 
 DEBUG = int(os.environ.get('DEBUG', '0'))
 
 
 class ResourceManagerCollector(object):
+    name = 'resourcemanager'
+
     # The build statuses we want to export about.
     statuses = {
         "up": "node status. 1:up, 0:down",
+        "haState": "HA state. 1:active, 0:standby",
         "appsSubmitted": "The number of applications submitted",
         "appsCompleted": "The number of applications completed",
         "appsPending": "The number of applications pending",
@@ -48,60 +58,80 @@ class ResourceManagerCollector(object):
         self._cluster = cluster
         self._targets = target.rstrip("/").split(";")
         self._prefix = 'hadoop_resourcemanager_'
+        self._addresses = dict((url, split_host_port(url)) for url in self._targets)
+        self._descriptors = DescriptorTable(self._prefix, self.statuses, ["cluster", "rm_host", "rm_port"])
+        self._labels = LabelCache(["cluster", "rm_host", "rm_port"])
 
     def collect(self):
+        return collect_once(self)
+
+    def fetch_jobs(self):
+        # Request data from resourcemanager API, one job per resourcemanager
+        return [(url, partial(self._fetch, url)) for url in self._targets]
+
+    def build_metrics(self, results):
         self._setup_empty_prometheus_metrics()
 
         ## check ha
         for url in self._targets:
-            self._target = url
-            # Request data from resourcemanager API
-            clusterMetrics = self._request_data()
-            self._get_metrics(clusterMetrics)
+            state, clusterMetrics = results.get(url, (None, []))
+            self._get_metrics(url, clusterMetrics, state)
 
         for status in self.statuses:
             yield self._prometheus_metrics[status]
 
-    def _request_data(self):
+    def _fetch(self, target):
+        # Standby resourcemanagers only get the state probe, /metrics would redirect to the active one
+        state = ha_state(self._targets, target, resourcemanager_state)
+        if is_passive(state):
+            return state, None
+        return state, self._request_data(target)
+
+    def _request_data(self, target):
         # Request exactly the information we need from resourcemanager
-        url = '{0}/ws/v1/cluster/metrics'.format(self._target)
+        url = '{0}/ws/v1/cluster/metrics'.format(target)
 
         def parsejobs(myurl):
-            response = requests.get(myurl) #, params=params, auth=(self._user, self._password))
-            if response.status_code != requests.codes.ok:
+            result = HTTP.get_json(myurl) #, params=params, auth=(self._user, self._password))
+            if result is None:
                 return[]
-            result = response.json()
             if DEBUG:
                 pprint(result)
 
             return result
 
-        return parsejobs(url)['clusterMetrics']
+        result = parsejobs(url)
+        if result == []:
+            return []
+        return result['clusterMetrics']
 
     def _setup_empty_prometheus_metrics(self):
         # The metrics we want to export.
-        self._prometheus_metrics = {}
-        for status in self.statuses:
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', status).lower()
-            self._prometheus_metrics[status] = GaugeMetricFamily(self._prefix + snake_case,
-                                                                 self.statuses[status],
-                                                                 labels=["cluster", "rm_host", "rm_port"])
-
-    def _get_metrics(self, clusterMetrics):
-        rm_host, rm_port = split_host_port(self._target)
+        self._prometheus_metrics = self._descriptors.families()
+        self._labels.rotate()
+
+    def _get_metrics(self, url, clusterMetrics, state=None):
+        rm_host, rm_port = self._addresses[url]
+        labels = self._labels.get(self._cluster, rm_host, rm_port)
+        if state is not None:
+            add_sample(self._prometheus_metrics["haState"], labels, 1 if state == ACTIVE else 0)
         status = "up"
+        if is_passive(state):
+            add_sample(self._prometheus_metrics[status], labels, 1)
+            return
         if clusterMetrics == []:
-            self._prometheus_metrics[status].add_metric([self._cluster, rm_host, rm_port], 0)
+            add_sample(self._prometheus_metrics[status], labels, 0)
             return
         else:
-            self._prometheus_metrics[status].add_metric([self._cluster, rm_host, rm_port], 1)
+            add_sample(self._prometheus_metrics[status], labels, 1)
         for status in self.statuses:
             if status in clusterMetrics:
-                self._prometheus_metrics[status].add_metric(
-                    [self._cluster, rm_host, rm_port], clusterMetrics[status])
+                add_sample(self._prometheus_metrics[status], labels, clusterMetrics[status])
 
 
 class ResourceManagerNodeCollector(object):
+    name = 'resourcemanager_node'
+
     # The build statuses we want to export about.
     statuses = {
         "state": "State of the node - valid values are: NEW, RUNNING, UNHEALTHY, DECOMMISSIONED, LOST, REBOOTED",
@@ -122,59 +152,116 @@ class ResourceManagerNodeCollector(object):
         'SHUTDOWN': 7,
     }
 
-    def __init__(self, target, cluster):
+    # states of a nodemanager whose http server answers
+    UP_STATES = ('NEW', 'RUNNING', 'UNHEALTHY')
+
+    def __init__(self, target, cluster, shard=None):
         self._cluster = cluster
+        # with shard set only the nodemanagers it owns are exported
+        self._shard = shard
         self._targets = target.rstrip("/").split(";")
         self._prefix = 'hadoop_resourcemanager_node_'
+        self._addresses = dict((url, split_host_port(url)) for url in self._targets)
+        self._descriptors = DescriptorTable(self._prefix, self.statuses,
+                                            ["cluster", "rm_host", "rm_port", "host", "version"])
+        # the nodemanagers each resourcemanager reported, kept between scrapes
+        self._statuses = tuple(self.statuses)
+        self._nodes = dict((url, HostTable(["cluster", "rm_host", "rm_port", "host", "version"], self._statuses,
+                                           {"state": self.NODE_STATE.__getitem__}))
+                           for url in self._targets)
+        # what the json decoder workers send back of a node list
+        self._extract = partial(compact_nodes, self._statuses + ('nodeHostName', 'version', 'nodeHTTPAddress'))
 
     def collect(self):
-        self._setup_empty_prometheus_metrics()
-
-        for url in self._targets:
-            self._target = url
-        # Request data from resourcemanager API
-            nodeInfos = self._request_data()
-
+        return collect_once(self)
 
-            for nodeInfo in nodeInfos:
-                self._get_metrics(nodeInfo)
+    def fetch_jobs(self):
+        # Request data from resourcemanager API, one job per resourcemanager
+        return [(url, partial(self._request_data, url)) for url in self._targets]
 
-        for status in self.statuses:
-            yield self._prometheus_metrics[status]
+    def build_metrics(self, results):
+        self._setup_empty_prometheus_metrics()
 
-    def _request_data(self):
+        for url in self._targets:
+            table = self._nodes[url]
+            table.begin()
+            if results.get(url) is None:
+                continue
+            rm_host, rm_port = self._addresses[url]
+            try:
+                for nodeInfo in results[url]:
+                    self._get_metrics(table, rm_host, rm_port, nodeInfo)
+            except (HttpError, ValueError):
+                # a node list cut short keeps the nodes read so far and drops none
+                continue
+            table.finish()
+
+        metrics = [self._prometheus_metrics[status] for status in self._statuses]
+        appeared = CounterMetricFamily(self._prefix + 'appeared',
+                                       'Nodemanagers that joined the node list of the resourcemanager',
+                                       labels=["cluster", "rm_host", "rm_port"])
+        disappeared = CounterMetricFamily(self._prefix + 'disappeared',
+                                          'Nodemanagers that left the node list of the resourcemanager',
+                                          labels=["cluster", "rm_host", "rm_port"])
+        for url in self._targets:
+            table = self._nodes[url]
+            table.emit(metrics)
+            rm_host, rm_port = self._addresses[url]
+            appeared.add_metric([self._cluster, rm_host, rm_port], table.appeared)
+            disappeared.add_metric([self._cluster, rm_host, rm_port], table.disappeared)
+
+        for metric in metrics:
+            yield metric
+        yield appeared
+        yield disappeared
+
+    def nodemanager_addresses(self):
+        # {host: nodeHTTPAddress} of the nodemanagers that are up, for the
+        # nodemanager jmx collector
+        addresses = {}
+        for table in self._nodes.values():
+            addresses.update(table.addresses())
+        return addresses
+
+    def _request_data(self, target):
+        # The node list of a standby resourcemanager is stale, only the active one is asked
+        if is_passive(ha_state(self._targets, target, resourcemanager_state)):
+            return None
         # Request exactly the information we need from resourcemanager
-        url = '{0}/ws/v1/cluster/nodes'.format(self._target)
+        url = '{0}/ws/v1/cluster/nodes'.format(target)
 
         def parsejobs(myurl):
-            response = requests.get(myurl) #, params=params, auth=(self._user, self._password))
-            if response.status_code != requests.codes.ok:
-                return[]
-            result = response.json()
-            if DEBUG:
-                pprint(result)
+            # With json decoder workers the whole list is read and handed to
+            # them, they send back the fields of every node that are used
+            if DECODER.pooled:
+                return HTTP.get_json(myurl, extract=self._extract)
+
+            # The node list is decoded while it arrives, one node at a time
+            chunks = HTTP.get_stream(myurl) #, params=params, auth=(self._user, self._password))
+            if chunks is None:
+                return None
 
-            return result['nodes']['node']
+            return iter_array_items(chunks, ('nodes', 'node'))
 
         return parsejobs(url)
 
     def _setup_empty_prometheus_metrics(self):
         # The metrics we want to export.
-        self._prometheus_metrics = {}
-        for status in self.statuses:
-            snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', status).lower()
-            self._prometheus_metrics[status] = GaugeMetricFamily(self._prefix + snake_case,
-                                      self.statuses[status], labels=["cluster","rm_host", "rm_port", "host", "version"])
+        self._prometheus_metrics = self._descriptors.families()
 
-    def _get_metrics(self, nodeInfo):
-        rm_host, rm_port = split_host_port(self._target)
-        for status in self.statuses:
-            if status == 'state':
-                v = self.NODE_STATE[nodeInfo['state']]
-            else:
-                v = nodeInfo[status]
-            self._prometheus_metrics[status].add_metric(
-                [self._cluster, rm_host, rm_port, nodeInfo['nodeHostName'], nodeInfo['version']], v)
+    def _get_metrics(self, table, rm_host, rm_port, nodeInfo):
+        host = nodeInfo['nodeHostName']
+        if self._shard is not None and not self._shard.owns(host):
+            return
+        address = nodeInfo.get('nodeHTTPAddress') if nodeInfo.get('state') in self.UP_STATES else None
+        table.update(host, (self._cluster, rm_host, rm_port, host, nodeInfo['version']), nodeInfo, address)
+
+
+def compact_nodes(fields, result):
+    # Run where a /ws/v1/cluster/nodes body is decoded: the nodes, each cut
+    # down to the fields in fields
+    nodes = (result.get('nodes') or {}).get('node') or []
+    return [{field: node[field] for field in fields if field in node} for node in nodes]
 
 
 def split_host_port(url):
@@ -222,10 +309,11 @@ def main():
     try:
         args = parse_args()
         port = int(args.port)
+        REGISTRY.register(HTTP)
         REGISTRY.register(ResourceManagerCollector(args.url, args.cluster))
         REGISTRY.register(ResourceManagerNodeCollector(args.url, args.cluster))
 
-        start_http_server(port)
+        start_exposition_server(port, args.telemetry_path, REGISTRY)
         print "Polling %s. Serving at port: %s" % (args.url, port)
         while True:
             time.sleep(1)
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+
+import cProfile
+import pstats
+import StringIO
+import threading
+import time
+from functools import partial
+
+from prometheus_client import Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+FETCH = 'fetch'
+DECODE = 'decode'
+TRANSFORM = 'transform'
+
+_context = threading.local()
+
+
+class SelfMetrics(object):
+    # Where the time of a scrape goes. Jobs and build_metrics of every
+    # collector run through jobs() / build(), which remember the collector and
+    # target the current thread works for, so the http client can label the
+    # fetch and decode phases it times. Transform is build_metrics, which also
+    # decodes the streamed node lists and walks the queue tree.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._errors = {}
+        self._series = {}
+        self._dropped = {}
+        self._phases = Histogram('hadoop_exporter_phase_duration_seconds',
+                                 'Time spent fetching, decoding and transforming hadoop responses',
+                                 ['cluster', 'collector', 'target', 'phase'], registry=None)
+        self._profiling = False
+        self._stats = None
+
+    def jobs(self, collector, jobs):
+        labels = (_cluster(collector), collector.name)
+        return [(key, partial(self._run_job, labels, target_of(key), job)) for key, job in jobs]
+
+    def build(self, collector, results):
+        # build_metrics of collector, timed and with the series it emits counted
+        cluster = _cluster(collector)
+        start = time.time()
+        series = {}
+        try:
+            if self._profiling:
+                # the work of a generator happens while it is consumed
+                metrics = self._call(lambda: list(collector.build_metrics(results)))
+            else:
+                metrics = collector.build_metrics(results)
+            for metric in metrics:
+                series[metric.name] = len(metric.samples)
+                yield metric
+        except Exception as e:
+            self.error(cluster, collector.name, e)
+            raise
+        finally:
+            self._phases.labels(cluster, collector.name, '', TRANSFORM).observe(time.time() - start)
+        with self._lock:
+            self._series[(cluster, collector.name)] = series
+
+    def dropped(self, cluster, collector, dropped):
+        # {(family, reason): series} the cardinality rules dropped from the
+        # last build of collector
+        with self._lock:
+            self._dropped[(cluster, collector)] = dropped
+
+    def current(self):
+        # (cluster, collector, target) of the job the current thread runs, if any
+        return getattr(_context, 'labels', None)
+
+    def observe(self, labels, phase, seconds):
+        if labels is not None:
+            self._phases.labels(labels[0], labels[1], labels[2], phase).observe(seconds)
+
+    def error(self, cluster, collector, e):
+        with self._lock:
+            key = (cluster, collector, e.__class__.__name__)
+            self._errors[key] = self._errors.get(key, 0) + 1
+
+    def _run_job(self, labels, target, job):
+        _context.labels = labels + (target,)
+        try:
+            return self._call(job)
+        except Exception as e:
+            self.error(labels[0], labels[1], e)
+            raise
+        finally:
+            _context.labels = None
+
+    def _call(self, function):
+        # Runs under cProfile while profiling is switched on. A profiler only
+        # sees its own thread, so every call gets one and their stats are added.
+        if not self._profiling:
+            return function()
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function)
+        finally:
+            with self._lock:
+                if self._profiling:
+                    if self._stats is None:
+                        self._stats = pstats.Stats(profile)
+                    else:
+                        self._stats.add(profile)
+
+    def start_profile(self):
+        with self._lock:
+            self._profiling = True
+
+    def stop_profile(self, limit=50):
+        # The profile since start_profile() as text, sorted by cumulative time
+        with self._lock:
+            stats, self._stats = self._stats, None
+            self._profiling = False
+        if stats is None:
+            return 'nothing was profiled\n'
+        out = StringIO.StringIO()
+        stats.stream = out
+        stats.sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        errors = CounterMetricFamily('hadoop_exporter_errors',
+                                     'Exceptions raised by the jobs and build_metrics of a collector',
+                                     labels=['cluster', 'collector', 'kind'])
+        series = GaugeMetricFamily('hadoop_exporter_series',
+                                   'Series a collector emitted per family in its last build',
+                                   labels=['cluster', 'collector', 'family'])
+        dropped = GaugeMetricFamily('hadoop_exporter_dropped_series',
+                                    'Series the cardinality rules dropped from the last build of a collector, '
+                                    'by family and reason (rule, host or budget)',
+                                    labels=['cluster', 'collector', 'family', 'reason'])
+        with self._lock:
+            for (cluster, collector, kind), value in self._errors.items():
+                errors.add_metric([cluster, collector, kind], value)
+            for (cluster, collector), families in self._series.items():
+                for family, value in families.items():
+                    series.add_metric([cluster, collector, family], value)
+            for (cluster, collector), families in self._dropped.items():
+                for (family, reason), value in families.items():
+                    dropped.add_metric([cluster, collector, family, reason], value)
+
+        yield errors
+        yield series
+        yield dropped
+        for metric in self._phases.collect():
+            yield metric
+
+
+def _cluster(collector):
+    return getattr(collector, '_cluster', '')
+
+
+def target_of(key):
+    # jobs are keyed by their target url, or by (url, what is asked of it)
+    if isinstance(key, tuple):
+        key = key[0]
+    return str(key)
+
+
+# Shared by all collectors and the http client
+SELF_METRICS = SelfMetrics()
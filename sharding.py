@@ -0,0 +1,44 @@
+#!/usr/bin/python
+
+import bisect
+import hashlib
+
+
+class Shard(object):
+    # One of count exporter replicas splitting the datanodes and nodemanagers
+    # of a cluster between them. Hosts are placed on a consistent hash ring
+    # with points virtual points per replica, so changing the number of
+    # replicas only moves about 1/count of the hosts. Shard 0 is the primary
+    # and the only one exporting the cluster level families.
+
+    def __init__(self, index, count, points=128):
+        if not 0 <= index < count:
+            raise ValueError('shard index {0} is not within 0..{1}'.format(index, count - 1))
+        self.index = index
+        self.count = count
+        self.primary = index == 0
+        ring = sorted((_hash('{0}-{1}'.format(shard, point)), shard)
+                      for shard in range(count) for point in range(points))
+        self._hashes = [point for point, shard in ring]
+        self._shards = [shard for point, shard in ring]
+        # host name -> owned, the host lists are asked about on every refresh
+        self._owned = {}
+
+    def shard_of(self, host):
+        position = bisect.bisect(self._hashes, _hash(host)) % len(self._hashes)
+        return self._shards[position]
+
+    def owns(self, host):
+        # The datanode (host:port) and the nodemanager of a machine end up on
+        # the same shard, only the host name is hashed.
+        name = host.split(':', 1)[0]
+        owned = self._owned.get(name)
+        if owned is None:
+            owned = self._owned[name] = self.shard_of(name) == self.index
+        return owned
+
+
+def _hash(key):
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return int(hashlib.md5(key).hexdigest()[:8], 16)
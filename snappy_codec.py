@@ -0,0 +1,153 @@
+#!/usr/bin/python
+
+import struct
+
+# The snappy block format remote write bodies are compressed with. The
+# python-snappy library is used when it is installed, else the pure python
+# compressor below: greedy matches of 4 bytes found through a hash table
+# within 64KB blocks, like snappy itself does, only slower.
+try:
+    import snappy as _snappy
+except ImportError:
+    _snappy = None
+
+_BLOCK = 1 << 16
+
+
+def compress(data):
+    if _snappy is not None:
+        return _snappy.compress(data)
+    out = [varint(len(data))]
+    for start in range(0, len(data), _BLOCK):
+        _compress_block(data[start:start + _BLOCK], out)
+    return ''.join(out)
+
+
+def decompress(data):
+    if _snappy is not None:
+        return _snappy.uncompress(data)
+    size, pos = read_varint(data, 0)
+    out = bytearray()
+    end = len(data)
+    while pos < end:
+        tag = ord(data[pos])
+        pos += 1
+        kind = tag & 3
+        if kind == 0:
+            length = tag >> 2
+            if length >= 60:
+                extra = length - 59
+                length = 0
+                for i in range(extra):
+                    length |= ord(data[pos + i]) << (8 * i)
+                pos += extra
+            length += 1
+            out += data[pos:pos + length]
+            pos += length
+            continue
+        if kind == 1:
+            length = ((tag >> 2) & 7) + 4
+            offset = ((tag >> 5) << 8) | ord(data[pos])
+            pos += 1
+        elif kind == 2:
+            length = (tag >> 2) + 1
+            offset = struct.unpack_from('<H', data, pos)[0]
+            pos += 2
+        else:
+            length = (tag >> 2) + 1
+            offset = struct.unpack_from('<I', data, pos)[0]
+            pos += 4
+        if not 0 < offset <= len(out):
+            raise ValueError('snappy copy offset {0} out of range'.format(offset))
+        start = len(out) - offset
+        if offset >= length:
+            out += out[start:start + length]
+        else:
+            # the copy overlaps what it writes
+            for i in range(length):
+                out.append(out[start + i])
+    if len(out) != size:
+        raise ValueError('snappy body is {0} bytes, expected {1}'.format(len(out), size))
+    return str(out)
+
+
+def _compress_block(data, out):
+    size = len(data)
+    table = {}
+    literal = 0
+    pos = 0
+    # after every 32 misses the step grows by one, incompressible data is
+    # skipped through quickly
+    skip = 32
+    while pos <= size - 4:
+        key = data[pos:pos + 4]
+        candidate = table.get(key)
+        table[key] = pos
+        if candidate is None:
+            pos += skip >> 5
+            skip += 1
+            continue
+        skip = 32
+        length = 4
+        while pos + length + 8 <= size and data[candidate + length:candidate + length + 8] == \
+                data[pos + length:pos + length + 8]:
+            length += 8
+        while pos + length < size and data[candidate + length] == data[pos + length]:
+            length += 1
+        if literal < pos:
+            _literal(data[literal:pos], out)
+        _copy(pos - candidate, length, out)
+        pos += length
+        literal = pos
+    if literal < size:
+        _literal(data[literal:], out)
+
+
+def _literal(chunk, out):
+    n = len(chunk) - 1
+    if n < 60:
+        out.append(chr(n << 2))
+    elif n < 1 << 8:
+        out.append(chr(60 << 2) + chr(n))
+    elif n < 1 << 16:
+        out.append(chr(61 << 2) + struct.pack('<H', n))
+    elif n < 1 << 24:
+        out.append(chr(62 << 2) + struct.pack('<I', n)[:3])
+    else:
+        out.append(chr(63 << 2) + struct.pack('<I', n))
+    out.append(chunk)
+
+
+def _copy(offset, length, out):
+    # copies are at most 64 bytes, and one with a 1 byte offset at least 4
+    while length >= 68:
+        out.append(chr(2 | (63 << 2)) + struct.pack('<H', offset))
+        length -= 64
+    if length > 64:
+        out.append(chr(2 | (59 << 2)) + struct.pack('<H', offset))
+        length -= 60
+    if length < 12 and offset < 2048:
+        out.append(chr(1 | ((length - 4) << 2) | ((offset >> 8) << 5)) + chr(offset & 0xff))
+    else:
+        out.append(chr(2 | ((length - 1) << 2)) + struct.pack('<H', offset))
+
+
+def varint(n):
+    out = []
+    while n > 0x7f:
+        out.append(chr((n & 0x7f) | 0x80))
+        n >>= 7
+    out.append(chr(n))
+    return ''.join(out)
+
+
+def read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
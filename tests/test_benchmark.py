@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import unittest
+
+BENCHMARK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmark.py')
+
+
+class SubcommandTest(unittest.TestCase):
+    # Every subcommand on a small payload, the numbers are not checked
+
+    def run_benchmark(self, *args):
+        return subprocess.check_output([sys.executable, BENCHMARK] + list(args), stderr=subprocess.STDOUT)
+
+    def test_jmx(self):
+        output = self.run_benchmark('jmx', '--datanodes', '50', '--filler-beans', '5', '--rounds', '1')
+        self.assertIn('full', output)
+        self.assertIn('qry', output)
+
+    def test_build(self):
+        self.assertIn('resourcemanager_node', self.run_benchmark('build', '--nodes', '50', '--rounds', '1'))
+
+    def test_memory(self):
+        self.assertIn('nodes-stream', self.run_benchmark('memory', '--nodes', '50'))
+
+    def test_json(self):
+        self.assertIn('LiveNodes', self.run_benchmark('json', '--nodes', '50', '--rounds', '1'))
+
+    def test_fsimage(self):
+        output = self.run_benchmark('fsimage', '--entries', '2000', '--depth', '1,3')
+        self.assertEqual([line.split()[-1] for line in output.splitlines()[1:]], ['True', 'True'])
+
+    def test_collectors(self):
+        output = self.run_benchmark('collectors', '--nodes', '20', '--rounds', '1', '--apps', '20')
+        for name in ('namenode', 'resourcemanager_node', 'queue', 'application'):
+            self.assertIn(name, output)
+
+
+if __name__ == '__main__':
+    unittest.main()
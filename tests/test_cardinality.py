@@ -0,0 +1,146 @@
+import unittest
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+import cardinality
+from cardinality import BUDGET, HOST, RULE, Cardinality, FamilyRule
+from self_metrics import SELF_METRICS
+
+
+def nodes(name='hadoop_datanode_node_used', hosts=('dn1:50010', 'dn2:50010', 'dn1.test:50010'), values=None):
+    family = GaugeMetricFamily(name, 'Used', labels=['cluster', 'nn_host', 'host', 'xferaddr'])
+    for i, host in enumerate(hosts):
+        family.add_metric(['prod', 'nn1', host, '10.0.0.%d' % i], values[i] if values else i + 1)
+    return family
+
+
+def samples(metric):
+    return sorted((sample.name, tuple(sorted(sample.labels.items())), sample.value) for sample in metric.samples)
+
+
+class _Collector(object):
+    name = 'namenode'
+
+    def __init__(self, families):
+        self._cluster = 'prod'
+        self.families = families
+
+    def fetch_jobs(self):
+        return []
+
+    def build_metrics(self, results):
+        return self.families
+
+
+class FamilyRuleTest(unittest.TestCase):
+
+    def test_drop(self):
+        dropped = {}
+        self.assertIsNone(FamilyRule({'match': 'hadoop_datanode_*', 'drop': True}).apply(nodes(), dropped))
+        self.assertEqual(dropped, {('hadoop_datanode_node_used', RULE): 3})
+
+    def test_drop_labels_sums_series(self):
+        rule = FamilyRule({'match': '*', 'labels': {'drop': ['host', 'xferaddr']}})
+        family = nodes()
+        metric = rule.apply(family, {})
+        self.assertEqual(samples(metric), [('hadoop_datanode_node_used', (('cluster', 'prod'), ('nn_host', 'nn1')),
+                                            6.0)])
+        # the family of the collector is left as it is
+        self.assertEqual(len(family.samples), 3)
+
+    def test_keep_labels(self):
+        metric = FamilyRule({'match': '*', 'labels': {'keep': ['cluster', 'host']}}).apply(nodes(), {})
+        self.assertEqual([dict(labels) for name, labels, value in samples(metric)],
+                         [{'cluster': 'prod', 'host': host} for host in ('dn1.test:50010', 'dn1:50010', 'dn2:50010')])
+
+    def test_hosts(self):
+        dropped = {}
+        deny = FamilyRule({'match': '*', 'hosts': {'deny': ['*.test']}})
+        self.assertEqual([dict(labels)['host'] for name, labels, value in samples(deny.apply(nodes(), dropped))],
+                         ['dn1:50010', 'dn2:50010'])
+        self.assertEqual(dropped, {('hadoop_datanode_node_used', HOST): 1})
+        allow = FamilyRule({'match': '*', 'hosts': {'allow': ['dn1*'], 'deny': ['*.test']}})
+        self.assertEqual([dict(labels)['host'] for name, labels, value in samples(allow.apply(nodes(), {}))],
+                         ['dn1:50010'])
+        # samples without a host are kept
+        gauge = GaugeMetricFamily('hadoop_namenode_total', 'Total', labels=['cluster'])
+        gauge.add_metric(['prod'], 1)
+        self.assertEqual(len(allow.apply(gauge, {}).samples), 1)
+
+    def test_host_verdicts_are_bounded(self):
+        saved = cardinality._MAX_HOSTS
+        cardinality._MAX_HOSTS = 10
+        try:
+            rule = FamilyRule({'match': '*', 'hosts': {'deny': ['*.test']}})
+            hosts = ['dn%d:50010' % i for i in range(25)] + ['dn1.test:50010']
+            metric = rule.apply(nodes(hosts=hosts), {})
+            self.assertEqual(len(metric.samples), 25)
+            self.assertTrue(len(rule._hosts) <= 10)
+            # and the verdicts are still right once they were forgotten
+            self.assertEqual(len(rule.apply(nodes(hosts=hosts), {}).samples), 25)
+        finally:
+            cardinality._MAX_HOSTS = saved
+
+    def test_histogram(self):
+        rule = FamilyRule({'match': '*', 'aggregate': 'histogram', 'by': ['cluster', 'nn_host'],
+                           'buckets': [10, 50, 90]})
+        metric = rule.apply(nodes(hosts=['dn%d' % i for i in range(5)], values=[5, 10, 40, 95, float('nan')]), {})
+        self.assertEqual(metric.type, 'histogram')
+        values = dict((sample.name + sample.labels.get('le', ''), sample.value) for sample in metric.samples)
+        self.assertEqual(values, {'hadoop_datanode_node_used_bucket10.0': 2, 'hadoop_datanode_node_used_bucket50.0': 3,
+                                  'hadoop_datanode_node_used_bucket90.0': 3, 'hadoop_datanode_node_used_bucket+Inf': 4,
+                                  'hadoop_datanode_node_used_count': 4, 'hadoop_datanode_node_used_sum': 150})
+        self.assertEqual(set(sample.labels.get('nn_host') for sample in metric.samples), set(['nn1']))
+
+    def test_summary(self):
+        rule = FamilyRule({'match': '*', 'aggregate': 'summary', 'quantiles': [0.5, 1]})
+        metric = rule.apply(nodes(hosts=['dn%d' % i for i in range(4)], values=[4, 1, 3, 2]), {})
+        values = dict((sample.name + sample.labels.get('quantile', ''), sample.value) for sample in metric.samples)
+        self.assertEqual(values, {'hadoop_datanode_node_used0.5': 2, 'hadoop_datanode_node_used1.0': 4,
+                                  'hadoop_datanode_node_used_count': 4, 'hadoop_datanode_node_used_sum': 10})
+
+    def test_bad_rules(self):
+        self.assertRaises(ValueError, FamilyRule, {'drop': True})
+        self.assertRaises(ValueError, FamilyRule, {'match': '*', 'keep': ['host']})
+        self.assertRaises(ValueError, FamilyRule, {'match': '*', 'aggregate': 'average'})
+        self.assertRaises(ValueError, FamilyRule, {'match': '*', 'aggregate': 'histogram'})
+        self.assertRaises(ValueError, Cardinality, {'rules': [], 'limit': 1})
+
+
+class LimitedCollectorTest(unittest.TestCase):
+
+    def test_first_matching_rule(self):
+        config = Cardinality({'rules': [{'match': 'yarn_queue_*_resources', 'drop': True},
+                                        {'match': 'yarn_queue_*', 'labels': {'drop': ['queue_path']}}]})
+        self.assertTrue(config.rule('yarn_queue_used_resources').drop)
+        self.assertFalse(config.rule('yarn_queue_num_active_apps').drop)
+        self.assertIsNone(config.rule('hadoop_namenode_total'))
+
+    def test_nothing_to_limit(self):
+        collector = _Collector([])
+        self.assertIs(Cardinality().limit(collector), collector)
+
+    def test_budget(self):
+        counter = CounterMetricFamily('hadoop_namenode_rpc', 'Calls', labels=['cluster'])
+        counter.add_metric(['prod'], 1)
+        collector = _Collector([nodes('hadoop_datanode_node_used'),
+                                nodes('hadoop_datanode_node_remaining', hosts=['dn%d' % i for i in range(5)]),
+                                counter])
+        limited = Cardinality({'budgets': {'namenode': 5}}, max_series=1000).limit(collector)
+        # the family over the budget is dropped as a whole, the smaller one after it still fits
+        self.assertEqual([metric.name for metric in limited.build_metrics({})],
+                         ['hadoop_datanode_node_used', 'hadoop_namenode_rpc'])
+        self.assertEqual(SELF_METRICS._dropped[('prod', 'namenode')],
+                         {('hadoop_datanode_node_remaining', BUDGET): 5})
+
+    def test_rules_before_budget(self):
+        collector = _Collector([nodes(hosts=['dn%d' % i for i in range(10)])])
+        limited = Cardinality({'max_series': 3, 'rules': [
+            {'match': 'hadoop_datanode_node_*', 'aggregate': 'summary', 'quantiles': [0.5]}]}).limit(collector)
+        metric, = limited.build_metrics({})
+        self.assertEqual(len(metric.samples), 3)
+        self.assertEqual(SELF_METRICS._dropped[('prod', 'namenode')], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
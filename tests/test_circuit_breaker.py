@@ -0,0 +1,108 @@
+import unittest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+HOST = 'nn1:50070'
+
+
+class _Clock(object):
+    # time.time() and random.uniform() of the breaker, under the test's control
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def uniform(self, low, high):
+        return high
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = _Clock()
+        self._time, self._random = circuit_breaker.time, circuit_breaker.random
+        circuit_breaker.time = circuit_breaker.random = self.clock
+        self.breaker = CircuitBreaker(threshold=2, backoff=5, max_backoff=30)
+
+    def tearDown(self):
+        circuit_breaker.time, circuit_breaker.random = self._time, self._random
+
+    def state(self, host=HOST):
+        return dict((host, (state, opened)) for host, state, opened in self.breaker.states()).get(host)
+
+    def open_circuit(self):
+        self.breaker.failure(HOST)
+        self.breaker.failure(HOST)
+
+    def test_unknown_host_is_allowed(self):
+        self.assertTrue(self.breaker.allow(HOST))
+        self.assertEqual(self.breaker.states(), [])
+
+    def test_opens_after_threshold_failures(self):
+        self.breaker.failure(HOST)
+        self.assertEqual(self.state(), (CLOSED, 0))
+        self.assertTrue(self.breaker.allow(HOST))
+        self.breaker.failure(HOST)
+        self.assertEqual(self.state(), (OPEN, 1))
+        self.assertFalse(self.breaker.allow(HOST))
+
+    def test_success_resets_the_failures(self):
+        self.breaker.failure(HOST)
+        self.breaker.success(HOST)
+        self.breaker.failure(HOST)
+        self.assertEqual(self.state(), (CLOSED, 0))
+
+    def test_half_open_after_backoff_allows_one_probe(self):
+        self.open_circuit()
+        self.clock.now += 4.9
+        self.assertFalse(self.breaker.allow(HOST))
+        self.clock.now += 0.1
+        self.assertTrue(self.breaker.allow(HOST))
+        self.assertEqual(self.state(), (HALF_OPEN, 1))
+        # requests while the probe is out are refused
+        self.assertFalse(self.breaker.allow(HOST))
+
+    def test_successful_probe_closes(self):
+        self.open_circuit()
+        self.clock.now += 5
+        self.assertTrue(self.breaker.allow(HOST))
+        self.breaker.success(HOST)
+        self.assertEqual(self.state(), (CLOSED, 1))
+        self.assertTrue(self.breaker.allow(HOST))
+        self.assertTrue(self.breaker.allow(HOST))
+        # the backoff starts over the next time
+        self.open_circuit()
+        self.clock.now += 5
+        self.assertTrue(self.breaker.allow(HOST))
+
+    def test_failed_probe_opens_for_twice_as_long(self):
+        self.open_circuit()
+        backoff = 5
+        for doubled in (10, 20, 30, 30):
+            self.clock.now += backoff
+            self.assertTrue(self.breaker.allow(HOST))
+            # one failure is enough while half open
+            self.breaker.failure(HOST)
+            self.assertEqual(self.state()[0], OPEN)
+            self.clock.now += doubled - 0.1
+            self.assertFalse(self.breaker.allow(HOST), 'backoff {0}'.format(doubled))
+            self.clock.now -= doubled - 0.1
+            backoff = doubled
+        self.assertEqual(self.state(), (OPEN, 5))
+
+    def test_jitter_shortens_the_backoff(self):
+        self.clock.uniform = lambda low, high: low
+        self.open_circuit()
+        self.clock.now += 2.5
+        self.assertTrue(self.breaker.allow(HOST))
+
+    def test_hosts_are_independent(self):
+        self.open_circuit()
+        self.assertTrue(self.breaker.allow('nn2:50070'))
+        self.assertEqual(self.state('nn2:50070'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
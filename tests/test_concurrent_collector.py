@@ -0,0 +1,47 @@
+import unittest
+from multiprocessing.pool import ThreadPool
+
+from concurrent_collector import ConcurrentCollector, run_jobs
+
+
+def _unreachable():
+    raise IOError('connection refused')
+
+
+class _Collector(object):
+    name = 'stub'
+
+    def __init__(self, cluster, jobs):
+        self._cluster = cluster
+        self._jobs = jobs
+        self.built = []
+
+    def fetch_jobs(self):
+        return self._jobs
+
+    def build_metrics(self, results):
+        self.built.append(results)
+        return []
+
+
+class RunJobsTest(unittest.TestCase):
+
+    def test_failed_job_is_left_out(self):
+        jobs = [('nn1', lambda: 1), ('nn2', _unreachable), ('nn3', lambda: None)]
+        self.assertEqual(run_jobs(jobs), {'nn1': 1, 'nn3': None})
+        pool = ThreadPool(2)
+        try:
+            self.assertEqual(run_jobs(jobs, pool), {'nn1': 1, 'nn3': None})
+        finally:
+            pool.terminate()
+
+    def test_other_collectors_are_built(self):
+        first = _Collector('a', [('nn1', _unreachable), ('nn2', lambda: 2)])
+        second = _Collector('b', [('rm1', lambda: 3)])
+        list(ConcurrentCollector([first, second], workers=2).collect())
+        self.assertEqual(first.built, [{'nn2': 2}])
+        self.assertEqual(second.built, [{'rm1': 3}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import gzip
+import httplib
+import os
+import resource
+import socket
+import StringIO
+import unittest
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily
+
+from exposition import start_exposition_server
+
+
+class _Collector(object):
+
+    def collect(self):
+        gauge = GaugeMetricFamily('hadoop_datanode_used', 'Used', labels=['cluster', 'host'])
+        for i in range(200):
+            gauge.add_metric(['prod', 'dn%03d.example.com' % i], i)
+        yield gauge
+
+
+class ExpositionServerTest(unittest.TestCase):
+
+    def setUp(self):
+        registry = CollectorRegistry()
+        registry.register(_Collector())
+        self.ready = False
+        self.httpd = start_exposition_server(0, '/metrics', registry, addr='127.0.0.1', ready=lambda: self.ready,
+                                             threads=2)
+        self.port = self.httpd.server_address[1]
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def get(self, connection, path, headers=None):
+        connection.request('GET', path, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+
+    def test_keep_alive(self):
+        connection = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        status, headers, body = self.get(connection, '/metrics')
+        self.assertEqual(status, 200)
+        self.assertIn('hadoop_datanode_used{cluster="prod",host="dn199.example.com"} 199.0', body)
+        # the second request is read from the same connection
+        sock = connection.sock
+        self.assertEqual(self.get(connection, '/metrics')[2], body)
+        self.assertIs(connection.sock, sock)
+        connection.close()
+
+    def test_gzip(self):
+        connection = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        plain = self.get(connection, '/metrics')[2]
+        status, headers, body = self.get(connection, '/metrics', {'Accept-Encoding': 'gzip'})
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertLess(len(body), len(plain))
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO.StringIO(body)).read(), plain)
+        connection.close()
+
+    def test_ready(self):
+        connection = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.assertEqual(self.get(connection, '/ready')[0], 503)
+        self.assertEqual(self.get(connection, '/healthz')[0], 200)
+        self.ready = True
+        self.assertEqual(self.get(connection, '/ready')[0], 200)
+        self.assertEqual(self.get(connection, '/nope')[0], 404)
+        connection.close()
+
+    @unittest.skipIf(resource.getrlimit(resource.RLIMIT_NOFILE)[0] < 1200, 'needs more than 1200 open files')
+    def test_descriptors_beyond_fd_setsize(self):
+        # idle connections whose descriptors select() can not watch
+        fillers = [os.dup(0) for i in range(1050)]
+        try:
+            connections = [httplib.HTTPConnection('127.0.0.1', self.port, timeout=5) for i in range(4)]
+            for connection in connections:
+                self.assertEqual(self.get(connection, '/healthz')[0], 200)
+            for connection in connections:
+                self.assertEqual(self.get(connection, '/healthz')[0], 200)
+            self.assertTrue(max(connection.sock.fileno() for connection in connections) >= 1024)
+            for connection in connections:
+                connection.close()
+        finally:
+            for fd in fillers:
+                os.close(fd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import fsimage_exporter
+from fsimage_exporter import (BLOCKS, COLUMNS, CONSUMED, DIRS, DS_QUOTA, FILES, HISTOGRAM, NS_QUOTA, SIZE,
+                              FsImageCollector, FsImageUsage)
+
+MB = 1 << 20
+
+
+def entry(path, kind, size=0, replication=3, ns=-1, ds=-1, columns=COLUMNS):
+    # one line of `hdfs oiv -p Delimited`
+    fields = {'Path': path, 'Replication': replication if kind == '-' else 0, 'ModificationTime': '2026-10-01 10:00',
+              'AccessTime': '2026-10-01 10:00', 'PreferredBlockSize': 128 * MB if kind == '-' else 0,
+              'BlocksCount': (size + 128 * MB - 1) // (128 * MB) if kind == '-' else 0, 'FileSize': size,
+              'NSQUOTA': ns if kind == 'd' else 0, 'DSQUOTA': ds if kind == 'd' else 0,
+              'Permission': kind + 'rwxr-xr-x', 'UserName': 'hdfs', 'GroupName': 'supergroup',
+              'ErasureCodingPolicy': '-'}
+    return '\t'.join(str(fields[name]) for name in columns) + '\n'
+
+
+DUMP = [
+    entry('/', 'd', ns=(1 << 63) - 1),
+    entry('/user', 'd'),
+    entry('/user/alice', 'd', ns=100, ds=10 * MB),
+    entry('/user/alice/a.txt', '-', 10),
+    # deeper than the depth, added to /user/alice
+    entry('/user/alice/deep', 'd'),
+    entry('/user/alice/deep/er', 'd'),
+    entry('/user/alice/deep/er/b.bin', '-', 200 * MB),
+    entry('/user/bob', 'd'),
+    entry('/user/bob/empty', '-', 0),
+    entry('/tmp', 'd'),
+    entry('/tmp/x', '-', 100, replication=1),
+    entry('/f_at_root', '-', 5),
+]
+
+
+class FsImageUsageTest(unittest.TestCase):
+
+    def usage(self, lines=DUMP, depth=2):
+        return FsImageUsage(depth, buckets=(0, MB, 128 * MB)).read(lines).finish()
+
+    def test_dirs_down_to_depth(self):
+        usage = self.usage()
+        self.assertEqual(sorted(usage.dirs), ['/', '/tmp', '/user', '/user/alice', '/user/bob'])
+        self.assertEqual(usage.entries, len(DUMP))
+        self.assertEqual(sorted(self.usage(depth=1).dirs), ['/', '/tmp', '/user'])
+        self.assertEqual(self.usage(depth=0).dirs.keys(), ['/'])
+
+    def test_files_and_dirs(self):
+        dirs = self.usage().dirs
+        alice = dirs['/user/alice']
+        self.assertEqual(alice[:NS_QUOTA], [200 * MB + 10, 600 * MB + 30, 2, 2, 3])
+        self.assertEqual((alice[NS_QUOTA], alice[DS_QUOTA]), (100, 10 * MB))
+        self.assertEqual(dirs['/user/bob'][:NS_QUOTA], [0, 0, 1, 0, 0])
+        self.assertEqual(dirs['/tmp'][:NS_QUOTA], [100, 100, 1, 0, 1])
+        # the dirs under a dir, not itself
+        self.assertEqual(dirs['/user'][DIRS], 4)
+        self.assertEqual(dirs['/'][DIRS], 6)
+        # Long.MAX_VALUE on / is no quota
+        self.assertEqual(dirs['/'][NS_QUOTA], -1)
+        self.assertEqual(dirs['/user'][NS_QUOTA], -1)
+
+    def test_histogram(self):
+        dirs = self.usage().dirs
+        # <= 0, <= 1MB, <= 128MB, larger
+        self.assertEqual(dirs['/user/alice'][HISTOGRAM:], [0, 1, 0, 1])
+        self.assertEqual(dirs['/user/bob'][HISTOGRAM:], [1, 0, 0, 0])
+        self.assertEqual(dirs['/'][HISTOGRAM:], [1, 3, 0, 1])
+
+    def test_totals_are_the_sum_of_children(self):
+        dirs = self.usage().dirs
+        files = [line.split('\t') for line in DUMP if line.split('\t')[9].startswith('-')]
+        root = dirs['/']
+        self.assertEqual(root[FILES], len(files))
+        self.assertEqual(root[SIZE], sum(int(fields[6]) for fields in files))
+        self.assertEqual(root[CONSUMED], sum(int(fields[6]) * int(fields[1]) for fields in files))
+        self.assertEqual(sum(root[HISTOGRAM:]), root[FILES])
+        for parent, children, direct in (('/', ('/user', '/tmp'), [5, 15, 1, 2, 1]),
+                                         ('/user', ('/user/alice', '/user/bob'), [0, 0, 0, 2, 0])):
+            for at in (SIZE, CONSUMED, FILES, DIRS, BLOCKS):
+                self.assertEqual(dirs[parent][at], sum(dirs[child][at] for child in children) + direct[at],
+                                 (parent, at))
+
+    def test_parents_missing_from_the_dump(self):
+        usage = FsImageUsage(3).read([entry('/a/b/c/f', '-', 5), entry('/a/x', '-', 1)]).finish()
+        self.assertEqual(sorted((path, values[FILES]) for path, values in usage.dirs.items()),
+                         [('/', 2), ('/a', 2), ('/a/b', 1), ('/a/b/c', 1)])
+
+    def test_order_does_not_matter(self):
+        self.assertEqual(self.usage(list(reversed(DUMP))).dirs, self.usage().dirs)
+
+    def test_header_names_the_columns(self):
+        # newer oivs print more columns
+        columns = COLUMNS[:2] + ('ErasureCodingPolicy',) + COLUMNS[2:]
+        lines = ['\t'.join(columns) + '\n'] + [entry(*fields, columns=columns) for fields in (
+            ('/', 'd'), ('/user', 'd'), ('/user/a', '-', 7))]
+        usage = FsImageUsage(1).read(lines).finish()
+        self.assertEqual(usage.dirs['/'][SIZE], 7)
+        self.assertEqual(usage.entries, 3)
+        header = '\t'.join('Length' if name == 'FileSize' else name for name in COLUMNS) + '\n'
+        self.assertRaises(ValueError, FsImageUsage(1).read, [header])
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1800000000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class _NameNode(object):
+    # the checkpoint txid and /imagetransfer of a namenode
+    connect_timeout = 5
+    read_timeout = 30
+
+    def __init__(self):
+        self.txid = 5
+        self.down = False
+        self.downloads = 0
+
+    def get_json(self, url, params=None, *args, **kwargs):
+        if self.down or self.txid is None:
+            return None
+        return {'beans': [{'name': 'Hadoop:service=NameNode,name=NameNodeInfo',
+                           'JournalTransactionInfo': '{"LastAppliedOrWrittenTxId":"9",'
+                                                     '"MostRecentCheckpointTxId":"%d"}' % self.txid}]}
+
+    def get_stream(self, url, *args, **kwargs):
+        if self.down:
+            return None
+        self.downloads += 1
+        return iter(['fsimage of txid %s' % self.txid])
+
+
+class FsImageCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = _Clock()
+        self.namenode = _NameNode()
+        self.saved = fsimage_exporter.time, fsimage_exporter.HTTP
+        fsimage_exporter.time, fsimage_exporter.HTTP = self.clock, self.namenode
+        self.dir = tempfile.mkdtemp()
+        self.collector = self.new_collector()
+
+    def tearDown(self):
+        fsimage_exporter.time, fsimage_exporter.HTTP = self.saved
+        shutil.rmtree(self.dir)
+
+    def new_collector(self):
+        collector = FsImageCollector('http://nn1:50070/jmx', 'prod', depth=1, interval=3600,
+                                     fetch_dir=self.dir)
+        collector.analysed = []
+        collector.broken = False
+
+        def analyse(source, oiv):
+            with open(source) as f:
+                collector.analysed.append(f.read())
+            if collector.broken:
+                return None
+            usage = FsImageUsage(1).read(DUMP).finish()
+            return {'entries': usage.entries, 'buckets': usage.buckets, 'dirs': usage.dirs}
+        collector._analyse = analyse
+        return collector
+
+    def poll(self, collector=None):
+        # what the poller does every tick, whether the image was refreshed
+        collector = collector or self.collector
+        jobs = collector.fetch_jobs()
+        families = collector.build_metrics(dict((key, job()) for key, job in jobs))
+        return bool(jobs), families
+
+    def test_one_download_per_image(self):
+        ran, families = self.poll()
+        self.assertTrue(ran)
+        self.assertEqual(self.namenode.downloads, 1)
+        self.assertEqual(self.collector.analysed, ['fsimage of txid 5'])
+        self.assertIn('hadoop_fsimage_files', [family.name for family in families])
+        # not due again before the interval
+        self.clock.now += 3599
+        self.assertEqual(self.poll()[0], False)
+        # due, but the namenode has no newer checkpoint
+        self.clock.now += 1
+        self.assertEqual(self.poll(), (True, families))
+        self.assertEqual(self.namenode.downloads, 1)
+        self.assertEqual(len(self.collector.analysed), 1)
+        self.namenode.txid = 6
+        self.clock.now += 3600
+        self.poll()
+        self.assertEqual(self.namenode.downloads, 2)
+        self.assertEqual(self.collector.analysed[-1], 'fsimage of txid 6')
+
+    def test_image_of_a_run_before(self):
+        self.poll()
+        collector = self.new_collector()
+        self.assertEqual(collector._image[1], 5)
+        self.poll(collector)
+        # read once more, but not downloaded again
+        self.assertEqual(self.namenode.downloads, 1)
+        self.assertEqual(collector.analysed, ['fsimage of txid 5'])
+
+    def test_failed_read_backs_off(self):
+        self.collector.broken = True
+        due = []
+        for i in range(200):
+            if self.poll()[0]:
+                due.append(self.clock.now)
+            self.clock.now += 60
+        # retried after 60, 120, 240 ... seconds, up to the interval
+        self.assertEqual([b - a for a, b in zip(due, due[1:])][:7], [60, 120, 240, 480, 960, 1920, 3600])
+        # the image is read again, it is not downloaded again
+        self.assertEqual(self.namenode.downloads, 1)
+        self.collector.broken = False
+        self.clock.now = due[-1] + 3600
+        self.assertTrue(self.poll()[0])
+        self.assertEqual(self.namenode.downloads, 1)
+        self.assertEqual(self.collector._failures, 0)
+        self.assertEqual(self.collector._next_refresh, self.clock.now + 3600)
+
+    def test_namenode_down_backs_off(self):
+        self.namenode.down = True
+        self.assertEqual(self.poll(), (True, ()))
+        self.clock.now += 59
+        self.assertFalse(self.poll()[0])
+        self.clock.now += 1
+        self.assertTrue(self.poll()[0])
+        self.clock.now += 60
+        self.assertFalse(self.poll()[0])
+        self.assertEqual(self.namenode.downloads, 0)
+        self.assertFalse(os.listdir(self.dir))
+
+    def test_retry_without_txid(self):
+        # a namenode that does not tell its checkpoint txid
+        self.namenode.txid = None
+        self.collector.broken = True
+        self.poll()
+        self.collector.broken = False
+        self.clock.now += 60
+        self.poll()
+        # the retry within interval reads the image downloaded for the failed read
+        self.assertEqual(self.namenode.downloads, 1)
+        self.assertEqual(len(self.collector.analysed), 2)
+        # past the interval it is downloaded again
+        self.clock.now += 3600
+        self.poll()
+        self.assertEqual(self.namenode.downloads, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import BaseHTTPServer
+import threading
+import unittest
+
+from circuit_breaker import CLOSED, OPEN
+from http_client import HttpClient
+
+BODIES = {
+    '/jmx': (200, '{"beans": [{"name": "Hadoop:service=NameNode,name=FSNamesystem", "FilesTotal": 12}]}'),
+    '/cut': (200, '{"beans": [{"name": "Hadoop:service=NameNode,name=FSNam'),
+    '/html': (200, '<html><body>Error 500 Server Error</body></html>'),
+    '/missing': (404, '{"RemoteException": {"exception": "FileNotFoundException"}}'),
+}
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        code, body = BODIES[self.path]
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+class HttpClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.paths = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.host = '127.0.0.1:%d' % self.server.server_address[1]
+        self.client = HttpClient(connect_timeout=2, read_timeout=2)
+        self.client.breaker.threshold = 2
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path):
+        return 'http://%s%s' % (self.host, path)
+
+    def state(self):
+        return dict((host, state) for host, state, opened in self.client.breaker.states()).get(self.host, CLOSED)
+
+    def errors(self):
+        family = [metric for metric in self.client.collect() if metric.name == 'hadoop_exporter_http_errors'][0]
+        errors = {}
+        for sample in family.samples:
+            errors[sample.labels['error']] = errors.get(sample.labels['error'], 0) + sample.value
+        return errors
+
+    def test_json(self):
+        self.assertEqual(self.client.get_json(self.url('/jmx'))['beans'][0]['FilesTotal'], 12)
+        self.assertEqual(self.client.get_json_status(self.url('/missing'))[0], 404)
+        self.assertEqual(self.state(), CLOSED)
+        self.assertEqual(self.errors(), {})
+
+    def test_broken_bodies_open_the_circuit(self):
+        self.assertRaises(ValueError, self.client.get_json, self.url('/cut'))
+        self.assertEqual(self.state(), CLOSED)
+        self.assertRaises(ValueError, self.client.get_json_status, self.url('/html'))
+        self.assertEqual(self.state(), OPEN)
+        self.assertEqual(self.errors(), {'ValueError': 2})
+        # the host is not asked again until the backoff is over
+        self.assertIsNone(self.client.get_json(self.url('/jmx')))
+        self.assertEqual(self.server.paths, ['/cut', '/html'])
+
+    def test_good_body_in_between(self):
+        for path in ('/cut', '/jmx', '/cut', '/jmx'):
+            try:
+                self.client.get_json(self.url(path))
+            except ValueError:
+                pass
+        self.assertEqual(self.state(), CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
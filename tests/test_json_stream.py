@@ -0,0 +1,101 @@
+import json
+import unittest
+
+from json_stream import iter_array_items, iter_object_items
+
+BODY = (r'{"clusterInfo": {"id": 1, "note": "a \"nodes\": {\"node\": [1, 2]} lookalike"}, '
+        r'"nodes": {"node": ['
+        r'{"id": "h1:8041", "rack": "/r\\1", "state": "RUNNING", "mem": 12345678, "ratio": 0.25, "labels": [], '
+        r'"tags": [["a", ["b", "]"]], []], "note": "quote \" and \\ and \u00e9 and \n"}, '
+        r'{"id": "h2:8041", "healthy": true, "lost": null, "neg": -1.5e-3, "text": "}]}"}, '
+        r'17, "plain"]}, '
+        r'"after": [{"nodes": {"node": ["not this one"]}}]}')
+EXPECTED = json.loads(BODY)["nodes"]["node"]
+
+
+def splits(body, size):
+    return [body[start:start + size] for start in range(0, len(body), size)]
+
+
+class IterArrayItemsTest(unittest.TestCase):
+
+    def items(self, chunks, path=('nodes', 'node')):
+        return list(iter_array_items(chunks, path))
+
+    def test_whole_body(self):
+        self.assertEqual(self.items([BODY]), EXPECTED)
+
+    def test_one_byte_chunks(self):
+        # every boundary falls inside a string, an escape, a number and a literal once
+        self.assertEqual(self.items(splits(BODY, 1)), EXPECTED)
+
+    def test_every_two_chunk_split(self):
+        for at in range(1, len(BODY)):
+            self.assertEqual(self.items([BODY[:at], BODY[at:]]), EXPECTED, 'split at {0}'.format(at))
+
+    def test_empty_chunks_are_skipped(self):
+        chunks = []
+        for chunk in splits(BODY, 7):
+            chunks.extend(['', chunk])
+        self.assertEqual(self.items(chunks), EXPECTED)
+
+    def test_number_cut_by_chunk(self):
+        self.assertEqual(self.items(['{"a": [12', '34, 5', '6.7', '5e', '1]}'], ('a',)), [1234, 56.75e1])
+
+    def test_nested_arrays(self):
+        body = '{"a": {"b": [[1, [2, [3]]], [], [[]], {"c": [4]}]}}'
+        for size in (1, 2, 3, len(body)):
+            self.assertEqual(self.items(splits(body, size), ('a', 'b')), [[1, [2, [3]]], [], [[]], {"c": [4]}])
+
+    def test_empty_and_null_array(self):
+        self.assertEqual(self.items(['{"nodes": {"node": []}}']), [])
+        # what the resourcemanager sends without nodes
+        self.assertEqual(self.items(['{"nodes": null}']), [])
+        self.assertEqual(self.items(['{"nodes": {"node": null}}']), [])
+
+    def test_missing_path(self):
+        with self.assertRaises(ValueError):
+            self.items(['{"nodes": {"other": [1]}}'])
+        with self.assertRaises(ValueError):
+            self.items(['{"other": 1}'])
+
+    def test_not_an_array(self):
+        with self.assertRaises(ValueError):
+            self.items(['{"nodes": {"node": {"id": 1}}}'])
+
+    def test_truncated_body(self):
+        # inside an item, right after a backslash, inside a number and before the closing ]
+        for at in (BODY.index('"h1'), BODY.index('quote \\') + 7, BODY.index('-1.5e-3') + 3,
+                   BODY.index('"plain"]') + 7):
+            items = iter_array_items(splits(BODY[:at], 5), ('nodes', 'node'))
+            with self.assertRaises(ValueError):
+                list(items)
+
+    def test_items_arrive_before_the_body_ends(self):
+        def chunks():
+            yield '{"nodes": {"node": [{"id": 1}, '
+            raise AssertionError('read past the first item')
+        self.assertEqual(next(iter_array_items(chunks(), ('nodes', 'node'))), {"id": 1})
+
+
+class IterObjectItemsTest(unittest.TestCase):
+
+    def test_items_in_order(self):
+        text = ' { "h1" : {"used": 1, "name": "a\\"b"}, "h2": [1, {"x": null}], "h3": "}" } '
+        self.assertEqual(list(iter_object_items(text)),
+                         [("h1", {"used": 1, "name": 'a"b'}), ("h2", [1, {"x": None}]), ("h3", "}")])
+
+    def test_empty_object(self):
+        self.assertEqual(list(iter_object_items('{}')), [])
+
+    def test_not_an_object(self):
+        with self.assertRaises(ValueError):
+            list(iter_object_items('[1]'))
+
+    def test_truncated(self):
+        with self.assertRaises((ValueError, IndexError)):
+            list(iter_object_items('{"h1": {"used": 1}, "h2": {"us'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import threading
+import time
+import unittest
+
+from poller import Poller, Slots
+
+
+class _Collector(object):
+    name = 'stub'
+
+    def __init__(self, targets, job):
+        self._targets = targets
+        self._job = job
+
+    def fetch_jobs(self):
+        return [(target, self._job) for target in self._targets]
+
+    def build_metrics(self, results):
+        return []
+
+
+def _wait(condition, timeout=5):
+    until = time.time() + timeout
+    while not condition() and time.time() < until:
+        time.sleep(0.01)
+    return condition()
+
+
+class SlotsTest(unittest.TestCase):
+
+    def test_own_slot_then_shared(self):
+        slots = Slots(3, ['a', 'b'])
+        self.assertTrue(slots.acquire('a'))
+        self.assertFalse(slots.acquire('a'))
+        # the shared slot is gone, b still has its own one
+        self.assertTrue(slots.acquire('b'))
+        slots.release('a', False)
+        self.assertFalse(slots.acquire('b'))
+
+    def test_more_clusters_than_slots(self):
+        slots = Slots(1, ['a', 'b', 'c'])
+        self.assertTrue(all(slots.acquire(cluster) for cluster in 'abc'))
+
+
+class PollerTest(unittest.TestCase):
+
+    def test_hanging_cluster_does_not_stall_others(self):
+        hang = threading.Event()
+        started = []
+
+        def hanging():
+            started.append(1)
+            hang.wait(10)
+
+        poller = Poller(4)
+        # the slow cluster has as many fetch threads as there are slots
+        poller.add(_Collector(['nn%d' % i for i in range(8)], hanging), 60, 'slow', 4)
+        poller.add(_Collector(['nn1', 'nn2'], lambda: 1), 60, 'fast', 4)
+        fast = poller._polled[1]
+        try:
+            poller.start()
+            self.assertTrue(_wait(lambda: fast.attempted))
+            self.assertTrue(fast.last_success)
+            # the slow cluster holds its own slot and the shared ones
+            self.assertEqual(len(started), 3)
+        finally:
+            hang.set()
+        self.assertTrue(_wait(poller.ready))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import math
+import struct
+import unittest
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+import snappy_codec
+from push_exporter import STALE_MARKER, Pusher, decode_write_request, encode_labels, encode_series
+
+try:
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+except ImportError:
+    descriptor_pb2 = None
+
+
+def write_request_class():
+    # prometheus/prompb WriteRequest, TimeSeries, Label and Sample, the
+    # fields remote write receivers read
+    proto = descriptor_pb2.FileDescriptorProto(name='remote.proto', package='prometheus', syntax='proto3')
+    fields = descriptor_pb2.FieldDescriptorProto
+
+    def message(name, *specs):
+        added = proto.message_type.add(name=name)
+        for field_name, number, kind, label, type_name in specs:
+            field = added.field.add(name=field_name, number=number, type=kind, label=label)
+            if type_name:
+                field.type_name = type_name
+
+    message('WriteRequest', ('timeseries', 1, fields.TYPE_MESSAGE, fields.LABEL_REPEATED, '.prometheus.TimeSeries'))
+    message('TimeSeries', ('labels', 1, fields.TYPE_MESSAGE, fields.LABEL_REPEATED, '.prometheus.Label'),
+            ('samples', 2, fields.TYPE_MESSAGE, fields.LABEL_REPEATED, '.prometheus.Sample'))
+    message('Label', ('name', 1, fields.TYPE_STRING, fields.LABEL_OPTIONAL, None),
+            ('value', 2, fields.TYPE_STRING, fields.LABEL_OPTIONAL, None))
+    message('Sample', ('value', 1, fields.TYPE_DOUBLE, fields.LABEL_OPTIONAL, None),
+            ('timestamp', 2, fields.TYPE_INT64, fields.LABEL_OPTIONAL, None))
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(proto)
+    return message_factory.MessageFactory(pool).GetPrototype(pool.FindMessageTypeByName('prometheus.WriteRequest'))
+
+
+class _Exposition(object):
+    def __init__(self):
+        self.value = 1.0
+        self.hosts = ['dn1', u'dn-é']
+
+    def families(self):
+        gauge = GaugeMetricFamily('hadoop_datanode_used', 'Used', labels=['cluster', 'host'])
+        for host in self.hosts:
+            gauge.add_metric(['prod', host], self.value)
+        counter = CounterMetricFamily('hadoop_exporter_http_requests', 'Requests', labels=['code'])
+        counter.add_metric(['200'], 7)
+        return [gauge, counter]
+
+
+class _Pusher(Pusher):
+    # keeps the bodies it would post
+    def __init__(self, *args, **kwargs):
+        Pusher.__init__(self, *args, **kwargs)
+        self.bodies = []
+
+    def _post(self, body):
+        self.bodies.append(body)
+        return True
+
+
+@unittest.skipIf(descriptor_pb2 is None, 'protobuf is not installed')
+class WriteRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.WriteRequest = write_request_class()
+        self.exposition = _Exposition()
+
+    def parse(self, body):
+        request = self.WriteRequest()
+        request.ParseFromString(snappy_codec.decompress(body))
+        return [(dict((label.name, label.value) for label in series.labels),
+                 [(sample.value, sample.timestamp) for sample in series.samples],
+                 [label.name for label in series.labels])
+                for series in request.timeseries]
+
+    def test_encode_series(self):
+        body = encode_series(encode_labels('up', {'cluster': 'prod', 'a': u'é'}, {'instance': 'edge1'}),
+                             struct.pack('<d', 2.5), 1792336867707)
+        (labels, samples, names), = self.parse(snappy_codec.compress(body))
+        self.assertEqual(labels, {'__name__': 'up', 'cluster': 'prod', 'a': u'é', 'instance': 'edge1'})
+        # remote write wants the labels sorted by name
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(samples, [(2.5, 1792336867707)])
+
+    def test_series_labels_win_over_external_ones(self):
+        body = encode_series(encode_labels('up', {'cluster': 'prod'}, {'cluster': 'other'}), struct.pack('<d', 1), 0)
+        self.assertEqual(self.parse(snappy_codec.compress(body))[0][0]['cluster'], 'prod')
+
+    def test_pushed_batches(self):
+        pusher = _Pusher(self.exposition, url='http://receiver/api/v1/write', labels={'instance': 'edge1'},
+                         batch_size=2)
+        pusher.push_once()
+        self.assertEqual(len(pusher.bodies), 2)
+        series = [item for body in pusher.bodies for item in self.parse(body)]
+        self.assertEqual(sorted((labels['__name__'], labels.get('host'), samples[0][0]) for labels, samples, names
+                                in series),
+                         [('hadoop_datanode_used', u'dn-é', 1.0), ('hadoop_datanode_used', 'dn1', 1.0),
+                          ('hadoop_exporter_http_requests_total', None, 7.0)])
+        self.assertTrue(all(labels['instance'] == 'edge1' for labels, samples, names in series))
+        self.assertEqual(len(set(samples[0][1] for labels, samples, names in series)), 1)
+        # the stand-in receiver decodes the same
+        self.assertEqual(sorted(labels for labels, samples in decode_write_request(
+            snappy_codec.decompress(pusher.bodies[0]))),
+            sorted(labels for labels, samples, names in self.parse(pusher.bodies[0])))
+
+    def test_stale_marker_and_changed_only(self):
+        pusher = _Pusher(self.exposition, url='http://receiver/api/v1/write', changed_only=True)
+        pusher.push_once()
+        del pusher.bodies[:]
+        self.exposition.hosts = ['dn1']
+        pusher.push_once()
+        # unchanged series are left out, the one that is gone gets a stale marker
+        (labels, samples, names), = self.parse(pusher.bodies[0])
+        self.assertEqual(labels['host'], u'dn-é')
+        self.assertTrue(math.isnan(samples[0][0]))
+        self.assertIn(STALE_MARKER, snappy_codec.decompress(pusher.bodies[0]))
+        del pusher.bodies[:]
+        self.exposition.value = 2.0
+        pusher.push_once()
+        self.assertEqual([(labels['host'], samples[0][0]) for labels, samples, names in self.parse(pusher.bodies[0])],
+                         [('dn1', 2.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
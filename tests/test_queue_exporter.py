@@ -0,0 +1,115 @@
+import sys
+import unittest
+
+from queue_exporter import YarnQueueCollector, walk_queues
+
+
+def fair_queue(name, children=None, **values):
+    queue = dict(values, queueName=name)
+    if children is None:
+        queue['type'] = 'fairSchedulerLeafQueueInfo'
+    else:
+        queue['childQueues'] = {'queue': children}
+    return queue
+
+
+def capacity_queue(name, children=None, path=None, **values):
+    queue = dict(values, queueName=name)
+    if path is not None:
+        # hadoop 3 adds the full path
+        queue['queuePath'] = path
+    if children is None:
+        queue['type'] = 'capacitySchedulerLeafQueueInfo'
+    else:
+        queue['queues'] = {'queue': children}
+    return queue
+
+
+FAIR = {'type': 'fairScheduler', 'rootQueue': fair_queue('root', [
+    fair_queue('root.default', numActiveApps=1, usedResources={'memory': 1024, 'vCores': 1}),
+    fair_queue('root.users', [
+        fair_queue('root.users.alice', numActiveApps=2, numPendingApps=1),
+        # a single child comes as an object
+        fair_queue('root.users.etl', {'queueName': 'root.users.etl.nightly', 'numActiveApps': 3}),
+    ], numActiveApps=5),
+], usedResources={'memory': 4096, 'vCores': 4})}
+
+CAPACITY = capacity_queue('root', [
+    capacity_queue('default', capacity=40.0, usedCapacity=10.0, numApplications=1,
+                   resourcesUsed={'memory': 2048, 'vCores': 2}),
+    capacity_queue('prod', [
+        capacity_queue('etl', path='root.prod.etl', capacity=50.0, numApplications=3),
+        capacity_queue('adhoc', capacity=50.0, numApplications=0, usedResources='<memory:0, vCores:0>'),
+    ], capacity=60.0, usedCapacity=20.0),
+], capacity=100.0, usedCapacity=12.0, type='capacityScheduler')
+
+
+class WalkQueuesTest(unittest.TestCase):
+
+    def test_fair_scheduler(self):
+        self.assertEqual([path for path, queue in walk_queues(FAIR)],
+                         ['root', 'root.default', 'root.users', 'root.users.alice', 'root.users.etl',
+                          'root.users.etl.nightly'])
+
+    def test_capacity_scheduler(self):
+        queues = walk_queues(CAPACITY)
+        self.assertEqual([path for path, queue in queues],
+                         ['root', 'root.default', 'root.prod', 'root.prod.etl', 'root.prod.adhoc'])
+        self.assertEqual([queue['queueName'] for path, queue in queues], ['root', 'default', 'prod', 'etl', 'adhoc'])
+
+    def test_deeper_than_the_recursion_limit(self):
+        depth = sys.getrecursionlimit() * 2
+        leaf = capacity_queue('q%d' % depth, numApplications=1)
+        queue = leaf
+        for level in range(depth - 1, 0, -1):
+            queue = capacity_queue('q%d' % level, [queue])
+        queues = walk_queues(capacity_queue('root', [queue]))
+        self.assertEqual(len(queues), depth + 1)
+        self.assertEqual(queues[-1][0], '.'.join(['root'] + ['q%d' % level for level in range(1, depth + 1)]))
+        self.assertIs(queues[-1][1], leaf)
+
+
+class QueueCollectorTest(unittest.TestCase):
+
+    def build(self, scheduler_info):
+        collector = YarnQueueCollector('http://rm1:8088', 'prod')
+        metrics = collector.build_metrics({'http://rm1:8088': scheduler_info})
+        return dict((metric.name, metric.samples) for metric in metrics)
+
+    def values(self, samples, label='queue_path'):
+        return dict((sample[1][label], sample[2]) for sample in samples)
+
+    def test_fair_labels(self):
+        metrics = self.build(FAIR)
+        active = metrics['yarn_queue_num_active_apps']
+        self.assertEqual(self.values(active), {'root.default': 1, 'root.users': 5, 'root.users.alice': 2,
+                                               'root.users.etl.nightly': 3})
+        self.assertEqual(self.values(active, 'queue_name')['root.users.alice'], 2)
+        self.assertEqual(self.values(metrics['yarn_queue_num_pending_apps']), {'root.users.alice': 1})
+        used = metrics['yarn_queue_used_resources']
+        self.assertEqual(sorted((sample[1]['queue_path'], sample[1]['res_type'], sample[2]) for sample in used),
+                         [('root', 'memory', 4096), ('root', 'vCores', 4),
+                          ('root.default', 'memory', 1024), ('root.default', 'vCores', 1)])
+        self.assertEqual(set(sample[1]['rm_host'] for sample in active), set(['rm1']))
+
+    def test_capacity_leaf_and_parent_queues(self):
+        metrics = self.build(CAPACITY)
+        self.assertEqual(self.values(metrics['yarn_queue_capacity']),
+                         {'root': 100.0, 'root.default': 40.0, 'root.prod': 60.0, 'root.prod.etl': 50.0,
+                          'root.prod.adhoc': 50.0})
+        # parent queues have no application counts
+        self.assertEqual(self.values(metrics['yarn_queue_num_applications']),
+                         {'root.default': 1, 'root.prod.etl': 3, 'root.prod.adhoc': 0})
+        self.assertEqual(self.values(metrics['yarn_queue_num_applications'], 'queue_name'),
+                         {'default': 1, 'etl': 3, 'adhoc': 0})
+        # the "<memory:0, vCores:0>" string of older capacity schedulers is skipped
+        self.assertEqual(metrics['yarn_queue_used_resources'], [])
+        self.assertEqual(len(metrics['yarn_queue_resources_used']), 2)
+
+    def test_failed_fetch(self):
+        metrics = self.build([])
+        self.assertTrue(all(samples == [] for samples in metrics.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
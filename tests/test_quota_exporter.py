@@ -0,0 +1,169 @@
+import json
+import unittest
+import urllib
+import urlparse
+
+import quota_exporter
+from quota_exporter import HdfsQuotaCollector, parse_dirs, quota_values
+
+INF = float('inf')
+
+
+class _WebHdfs(object):
+    # Answers the webhdfs calls of HdfsQuotaCollector from a dict of dirs
+
+    def __init__(self, tree, quota_usage=True):
+        # path -> (children, quota, space quota, files and dirs, space consumed)
+        self.tree = tree
+        self.quota_usage = quota_usage
+        self.down = set()
+        self.calls = []
+
+    def _call(self, url):
+        parsed = urlparse.urlparse(url)
+        path = urllib.unquote(parsed.path[len('/webhdfs/v1'):]) or '/'
+        op = urlparse.parse_qs(parsed.query)['op'][0]
+        self.calls.append((op, path))
+        return op, path
+
+    def _answer(self, url):
+        op, path = self._call(url)
+        if path in self.down:
+            return None, None
+        if path not in self.tree:
+            return 404, {'RemoteException': {'exception': 'FileNotFoundException'}}
+        children, quota, space_quota, count, consumed = self.tree[path]
+        if op == 'LISTSTATUS':
+            return 200, {'FileStatuses': {'FileStatus': [{'pathSuffix': child, 'type': 'DIRECTORY'}
+                                                         for child in children] +
+                                                        [{'pathSuffix': 'file', 'type': 'FILE'}]}}
+        if op == 'GETQUOTAUSAGE':
+            if not self.quota_usage:
+                return 400, {'RemoteException': {'exception': 'IllegalArgumentException'}}
+            return 200, {'QuotaUsage': {'quota': quota, 'fileAndDirectoryCount': count,
+                                        'spaceQuota': space_quota, 'spaceConsumed': consumed}}
+        return 200, {'ContentSummary': {'quota': quota, 'directoryCount': 1, 'fileCount': count - 1,
+                                        'spaceQuota': space_quota, 'spaceConsumed': consumed}}
+
+    def get_json_status(self, url, *args, **kwargs):
+        return self._answer(url)
+
+    def get_json(self, url, *args, **kwargs):
+        status, result = self._answer(url)
+        return result if status == 200 else None
+
+    def get_stream_status(self, url, *args, **kwargs):
+        status, result = self._answer(url)
+        return status, None if status is None else iter([json.dumps(result)])
+
+
+class QuotaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.webhdfs = _WebHdfs({
+            '/': (['user', 'tmp'], -1, -1, 100, 0),
+            '/user': (['alice', 'bob', 'backup'], -1, -1, 50, 0),
+            '/user/alice': ([], 1000, 4096, 10, 1024),
+            '/user/bob': ([], -1, -1, 3, 7),
+            '/user/backup': ([], 10, -1, 10, 0),
+            '/tmp': ([], 500, -1, 20, 0),
+        })
+        self.saved = quota_exporter.HTTP
+        quota_exporter.HTTP = self.webhdfs
+
+    def tearDown(self):
+        quota_exporter.HTTP = self.saved
+
+    def collector(self, dirs='/user/*,/tmp'):
+        return HdfsQuotaCollector('http://nn:50070/jmx', 'prod', dirs=dirs, workers=2)
+
+    def refresh(self, collector):
+        results = dict((key, job()) for key, job in collector.fetch_jobs())
+        list(collector.build_metrics(results))
+        return dict((metric.name, dict((sample[1]['dir'], sample[2]) for sample in metric.samples))
+                    for metric in collector.collect())
+
+    def expire(self, collector):
+        for pattern in collector._next_refresh:
+            collector._next_refresh[pattern] = 0
+
+    def test_quota_values(self):
+        self.assertEqual(quota_values(1000, 10, 4096, 1024),
+                         {'TotalFiles': 1000, 'RemainFiles': 990, 'TotalSpace': 4096, 'RemainSpace': 3072})
+        self.assertEqual(quota_values(-1, 10, -1, 1024),
+                         {'TotalFiles': -1, 'RemainFiles': INF, 'TotalSpace': -1, 'RemainSpace': INF})
+
+    def test_parse_dirs(self):
+        self.assertEqual(parse_dirs(' /user/*, /tmp=60,,', 300), [('/user/*', 300.0), ('/tmp', 60.0)])
+
+    def test_glob_expansion(self):
+        metrics = self.refresh(self.collector('/user/b*,/tmp'))
+        self.assertEqual(sorted(metrics['hadoop_quota_total_files']), ['/tmp', '/user/backup', '/user/bob'])
+        self.assertEqual(metrics['hadoop_quota_remain_files']['/user/backup'], 0)
+        self.assertEqual(metrics['hadoop_quota_remain_space']['/user/bob'], INF)
+        # only the component with a wildcard is listed, files are no match
+        self.assertEqual([call for call in self.webhdfs.calls if call[0] == 'LISTSTATUS'],
+                         [('LISTSTATUS', '/user')])
+
+    def test_missing_dir_matches_nothing(self):
+        metrics = self.refresh(self.collector('/nope/*'))
+        self.assertEqual(metrics['hadoop_quota_total_files'], {})
+        self.assertEqual(self.webhdfs.calls, [('LISTSTATUS', '/nope')])
+
+    def test_quota_usage(self):
+        metrics = self.refresh(self.collector())
+        self.assertEqual(metrics['hadoop_quota_remain_space']['/user/alice'], 3072)
+        self.assertNotIn('GETCONTENTSUMMARY', [op for op, path in self.webhdfs.calls])
+
+    def test_content_summary_fallback(self):
+        self.webhdfs.quota_usage = False
+        collector = self.collector()
+        metrics = self.refresh(collector)
+        self.assertEqual(metrics['hadoop_quota_remain_files']['/user/alice'], 990)
+        self.assertEqual(metrics['hadoop_quota_remain_files']['/tmp'], 480)
+        # a namenode that rejects GETQUOTAUSAGE is not asked for it again
+        del self.webhdfs.calls[:]
+        self.expire(collector)
+        self.refresh(collector)
+        self.assertNotIn('GETQUOTAUSAGE', [op for op, path in self.webhdfs.calls])
+
+    def test_failure_is_no_fallback(self):
+        self.webhdfs.down.add('/user/alice')
+        collector = self.collector()
+        metrics = self.refresh(collector)
+        self.assertNotIn('/user/alice', metrics['hadoop_quota_total_files'])
+        self.assertFalse(collector._content_summary)
+        self.assertNotIn('GETCONTENTSUMMARY', [op for op, path in self.webhdfs.calls])
+
+    def test_failed_dir_keeps_last_values(self):
+        collector = self.collector()
+        self.refresh(collector)
+        self.webhdfs.down.add('/user/alice')
+        self.webhdfs.tree['/tmp'] = ([], 500, -1, 30, 0)
+        self.expire(collector)
+        metrics = self.refresh(collector)
+        self.assertEqual(metrics['hadoop_quota_remain_files']['/user/alice'], 990)
+        self.assertEqual(metrics['hadoop_quota_remain_files']['/tmp'], 470)
+
+    def test_failed_listing_keeps_last_dirs(self):
+        collector = self.collector()
+        self.refresh(collector)
+        self.webhdfs.down.add('/user')
+        self.expire(collector)
+        metrics = self.refresh(collector)
+        self.assertEqual(sorted(metrics['hadoop_quota_total_files']),
+                         ['/tmp', '/user/alice', '/user/backup', '/user/bob'])
+        # and the glob is tried again on the next poll
+        self.assertEqual(collector.fetch_jobs()[0][0], '/user/*')
+
+    def test_removed_dir_is_dropped(self):
+        collector = self.collector()
+        self.refresh(collector)
+        self.webhdfs.tree['/user'] = (['alice'], -1, -1, 50, 0)
+        self.expire(collector)
+        metrics = self.refresh(collector)
+        self.assertEqual(sorted(metrics['hadoop_quota_total_files']), ['/tmp', '/user/alice'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import unittest
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+import rate_buffer
+from rate_buffer import Derived, DerivedSeries, RingBuffers
+
+KEY = (('cluster', 'prod'),)
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class RingBuffersTest(unittest.TestCase):
+
+    def test_fewer_than_two_pairs(self):
+        buffers = RingBuffers(4)
+        self.assertIsNone(buffers.rate(KEY, 0))
+        self.assertIsNone(buffers.last(KEY))
+        buffers.append(KEY, 10, 5)
+        self.assertIsNone(buffers.rate(KEY, 0))
+        self.assertIsNone(buffers.deriv(KEY, 0))
+        self.assertEqual(buffers.last(KEY), 5)
+
+    def test_wrap_around(self):
+        buffers = RingBuffers(3)
+        for t in range(5):
+            buffers.append(KEY, t * 10, t * t)
+        # 0 and 1 were overwritten, 2, 3 and 4 are left
+        self.assertEqual(buffers.last(KEY), 16)
+        self.assertEqual(buffers.rate(KEY, 0), (16 - 4) / 20.0)
+        self.assertEqual(buffers.rate(KEY, 30), (16 - 9) / 10.0)
+
+    def test_step(self):
+        buffers = RingBuffers(3, step=10)
+        for t, value in ((0, 0), (10, 10), (15, 15), (18, 18)):
+            buffers.append(KEY, t, value)
+        # 18 is within step of 10, the pair before the newest, and replaces 15
+        self.assertEqual(buffers.last(KEY), 18)
+        self.assertEqual(buffers.rate(KEY, 1), 1.0)
+        self.assertIsNone(buffers.rate(KEY, 11))
+
+    def test_counter_reset(self):
+        buffers = RingBuffers(10)
+        for t, value in ((0, 100), (10, 150), (20, 30), (30, 60)):
+            buffers.append(KEY, t, value)
+        # 50 before the restart, 30 counted from 0, 30 after it
+        self.assertEqual(buffers.rate(KEY, 0), 110 / 30.0)
+
+    def test_deriv(self):
+        buffers = RingBuffers(10)
+        for t, value in ((1e9, 10), (1e9 + 10, 32), (1e9 + 20, 50), (1e9 + 30, 68)):
+            buffers.append(KEY, t, value)
+        self.assertAlmostEqual(buffers.deriv(KEY, 0), 1.92)
+        self.assertAlmostEqual(buffers.deriv(KEY, 1e9 + 10), 1.8)
+
+    def test_deriv_needs_time_apart(self):
+        buffers = RingBuffers(10)
+        buffers.append(KEY, 10, 1)
+        buffers.append(KEY, 10, 2)
+        self.assertIsNone(buffers.deriv(KEY, 0))
+        self.assertIsNone(buffers.rate(KEY, 0))
+
+    def test_expire_reuses_slots(self):
+        buffers = RingBuffers(3)
+        buffers.append(('old',), 10, 1)
+        buffers.append(KEY, 20, 1)
+        buffers.expire(15)
+        self.assertEqual(len(buffers), 1)
+        self.assertIsNone(buffers.last(('old',)))
+        buffers.append(('new',), 30, 7)
+        self.assertEqual(buffers.last(('new',)), 7)
+        self.assertEqual(len(buffers._first), 2)
+
+
+class DerivedSeriesTest(unittest.TestCase):
+
+    def buffers(self, *values):
+        buffers = RingBuffers(10)
+        for t, value in enumerate(values):
+            buffers.append(KEY, t * 60, value)
+        return buffers
+
+    def test_rate_per(self):
+        series = DerivedSeries({'source': 'apps', 'function': 'rate', 'window': 600, 'per': 60})
+        self.assertEqual(series.value(self.buffers(0, 3, 6), KEY, 120), 3)
+        self.assertEqual(series.name, 'apps_rate')
+
+    def test_window(self):
+        series = DerivedSeries({'source': 'apps', 'window': 60})
+        self.assertEqual(series.value(self.buffers(0, 60, 66), KEY, 120), 0.1)
+
+    def test_time_to_zero(self):
+        series = DerivedSeries({'source': 'remaining', 'function': 'time_to_zero', 'window': 600})
+        self.assertEqual(series.value(self.buffers(300, 240, 180), KEY, 120), 180)
+        # no sample while it does not go down
+        self.assertIsNone(series.value(self.buffers(180, 240), KEY, 60))
+        self.assertIsNone(series.value(self.buffers(180), KEY, 0))
+
+    def test_bad_series(self):
+        self.assertRaises(ValueError, DerivedSeries, {'function': 'rate'})
+        self.assertRaises(ValueError, DerivedSeries, {'source': 'x', 'function': 'avg'})
+        self.assertRaises(ValueError, DerivedSeries, {'source': 'x', 'window': 0})
+        self.assertRaises(ValueError, DerivedSeries, {'source': 'x', 'size': 1})
+
+
+class _Collector(object):
+    name = 'resourcemanager'
+
+    def __init__(self):
+        self._cluster = 'prod'
+        self.submitted = 0
+        self.remaining = 1000
+
+    def fetch_jobs(self):
+        return []
+
+    def build_metrics(self, results):
+        submitted = CounterMetricFamily('apps_submitted', 'Submitted', labels=['cluster'])
+        submitted.add_metric(['prod'], self.submitted)
+        remaining = GaugeMetricFamily('capacity_remaining', 'Remaining', labels=['cluster'])
+        remaining.add_metric(['prod'], self.remaining)
+        remaining.add_metric(['test'], float('nan'))
+        return [submitted, remaining]
+
+
+class DerivedCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = _Clock()
+        self._time = rate_buffer.time
+        rate_buffer.time = self.clock
+
+    def tearDown(self):
+        rate_buffer.time = self._time
+
+    def test_shared_buffers(self):
+        derived = Derived({'samples': 20, 'series': [
+            {'source': 'apps_submitted', 'function': 'rate', 'window': 300, 'per': 60, 'name': 'per_minute'},
+            {'source': 'capacity_remaining', 'function': 'deriv', 'window': 600, 'per': 60, 'name': 'growth'},
+            {'source': 'capacity_remaining', 'function': 'time_to_zero', 'window': 1200, 'name': 'to_zero'}]})
+        source = _Collector()
+        collector = derived.wrap(source)
+        for i in range(5):
+            metrics = dict((metric.name, metric) for metric in collector.build_metrics({}))
+            self.clock.now += 60
+            source.submitted += 30
+            source.remaining -= 120
+
+        # one buffer per source, over the longest window of its derived series
+        self.assertEqual(sorted(collector._buffers), ['apps_submitted', 'capacity_remaining'])
+        self.assertEqual(collector._buffers['capacity_remaining'].step, 60)
+        self.assertEqual(len(collector._buffers['capacity_remaining']), 1)
+        self.assertEqual([sample.value for sample in metrics['per_minute'].samples], [30])
+        self.assertEqual([sample.value for sample in metrics['growth'].samples], [-120])
+        self.assertEqual([(sample.labels, sample.value) for sample in metrics['to_zero'].samples],
+                         [({'cluster': 'prod'}, 260)])
+
+    def test_nothing_to_derive(self):
+        source = _Collector()
+        self.assertIs(Derived({'series': []}).wrap(source), source)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from sharding import Shard
+
+HOSTS = ['dn%05d.example.com' % i for i in range(5000)]
+
+
+class ShardTest(unittest.TestCase):
+
+    def test_every_host_on_one_shard(self):
+        for count in (1, 3, 8):
+            shards = [Shard(index, count) for index in range(count)]
+            owners = [[shard.index for shard in shards if shard.owns(host)] for host in HOSTS]
+            self.assertTrue(all(len(owner) == 1 for owner in owners))
+            # and the shards get about the same share
+            for shard in shards:
+                owned = sum(1 for owner in owners if owner == [shard.index])
+                self.assertTrue(0.5 < owned * count / float(len(HOSTS)) < 1.5, (count, shard.index, owned))
+
+    def test_datanode_and_nodemanager_together(self):
+        shard = Shard(1, 4)
+        for host in HOSTS[:200]:
+            self.assertEqual(shard.owns(host + ':50010'), shard.owns(host))
+            self.assertEqual(shard.owns(host), shard.shard_of(host) == 1)
+
+    def test_adding_a_shard_moves_a_share(self):
+        for count in (2, 4, 8):
+            before = Shard(0, count)
+            after = Shard(0, count + 1)
+            moved = [host for host in HOSTS if before.shard_of(host) != after.shard_of(host)]
+            # only to the new shard, about 1/(count + 1) of the hosts
+            self.assertTrue(all(after.shard_of(host) == count for host in moved))
+            share = len(moved) / float(len(HOSTS))
+            self.assertTrue(0.5 / (count + 1) < share < 1.5 / (count + 1), (count, share))
+
+    def test_index_out_of_range(self):
+        self.assertRaises(ValueError, Shard, 3, 3)
+        self.assertRaises(ValueError, Shard, -1, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
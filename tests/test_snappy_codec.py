@@ -0,0 +1,123 @@
+import random
+import unittest
+
+import snappy_codec
+from snappy_codec import read_varint, varint
+
+try:
+    import snappy as reference
+except ImportError:
+    reference = None
+
+
+def samples():
+    rng = random.Random(7)
+    noise = ''.join(chr(rng.randrange(256)) for i in range(200000))
+    words = ' '.join(rng.choice(['hadoop_datanode', 'cluster="prod"', 'host="dn%03d"' % i, '1.5e+09', 'nn1'])
+                     for i in range(20000))
+    return [
+        ('empty', ''),
+        ('one byte', 'x'),
+        ('shorter than a match', 'abc'),
+        ('run', 'a' * 100000),
+        ('literal of 60', noise[:60]),
+        ('literal of 61', noise[:61]),
+        ('literal over 256', noise[:300]),
+        ('literal over 64KB', noise),
+        ('copy of 61', noise[:100] + noise[:61] + noise[200:230]),
+        ('copy of 64', noise[:100] + noise[:64] + noise[200:230]),
+        ('copy of 67', noise[:100] + noise[:67] + noise[200:230]),
+        ('copy of 1000', noise[:100] + noise[:1000] + noise[200:230]),
+        ('far copy', noise[:5000] + noise[:500]),
+        ('text over several blocks', words),
+    ]
+
+
+def elements(data):
+    # (kind, length) of the literals and copies of a snappy block
+    pos = read_varint(data, 0)[1]
+    found = []
+    while pos < len(data):
+        tag = ord(data[pos])
+        pos += 1
+        kind = tag & 3
+        if kind == 0:
+            length = tag >> 2
+            if length >= 60:
+                extra = length - 59
+                length = sum(ord(data[pos + i]) << (8 * i) for i in range(extra))
+                pos += extra
+            length += 1
+            pos += length
+            found.append(('literal', length))
+        elif kind == 1:
+            found.append(('copy', ((tag >> 2) & 7) + 4))
+            pos += 1
+        else:
+            found.append(('copy', (tag >> 2) + 1))
+            pos += 2 if kind == 2 else 4
+    return found
+
+
+class PurePythonTest(unittest.TestCase):
+    # The fallback used without python-snappy, whatever is installed
+
+    def setUp(self):
+        self._snappy = snappy_codec._snappy
+        snappy_codec._snappy = None
+
+    def tearDown(self):
+        snappy_codec._snappy = self._snappy
+
+    def test_round_trip(self):
+        for name, data in samples():
+            self.assertEqual(snappy_codec.decompress(snappy_codec.compress(data)), data, name)
+
+    def test_compresses(self):
+        self.assertLess(len(snappy_codec.compress('a' * 100000)), 5000)
+
+    def test_long_literals_and_copies(self):
+        found = []
+        for name, data in samples():
+            elements_of = elements(snappy_codec.compress(data))
+            self.assertEqual(sum(length for kind, length in elements_of), len(data), name)
+            found.extend(elements_of)
+        # literals with 1, 2 and 3 length bytes, copies up to the 64 bytes one can hold
+        self.assertTrue(any(kind == 'literal' and 60 < length < 256 for kind, length in found))
+        self.assertTrue(any(kind == 'literal' and 256 <= length < 65536 for kind, length in found))
+        self.assertTrue(any(kind == 'literal' and length == 65536 for kind, length in found))
+        self.assertIn(('copy', 64), found)
+        self.assertTrue(any(kind == 'copy' and 60 < length < 64 for kind, length in found))
+
+    @unittest.skipIf(reference is None, 'python-snappy is not installed')
+    def test_reference_decodes(self):
+        for name, data in samples():
+            self.assertEqual(reference.uncompress(snappy_codec.compress(data)), data, name)
+
+    @unittest.skipIf(reference is None, 'python-snappy is not installed')
+    def test_decodes_reference(self):
+        for name, data in samples():
+            self.assertEqual(snappy_codec.decompress(reference.compress(data)), data, name)
+
+    def test_bad_offset(self):
+        # a copy of 4 bytes 10 back, with nothing written yet
+        with self.assertRaises(ValueError):
+            snappy_codec.decompress(varint(4) + chr(1) + chr(10))
+
+    def test_wrong_length(self):
+        with self.assertRaises(ValueError):
+            snappy_codec.decompress(varint(5) + chr(0) + 'x')
+
+
+class VarintTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for n in (0, 1, 127, 128, 300, 16383, 16384, 2 ** 32, 1792336867707):
+            self.assertEqual(read_varint('x' + varint(n) + 'y', 1), (n, 1 + len(varint(n))))
+
+    def test_encoding(self):
+        self.assertEqual(varint(300), '\xac\x02')
+
+
+if __name__ == '__main__':
+    unittest.main()